@@ -2,8 +2,9 @@ import React, { useMemo, useRef, useEffect } from "react";
 import useDataSocket from "./hooks/useDataSocket";
 import useVideoSocket from "./hooks/useVideoSocket";
 import ControlsPanel from "./components/ControlsPanel";
+import OverlayCanvas from "./components/OverlayCanvas";
 
-export default function SmileViewer({ wsUrl, onRecordChange }) {
+export default function SmileViewer({ wsUrl, onRecordChange, videoProfile, faceFormat = "json" }) {
   const videoCanvasRef = useRef(null);
 
   const resolvedWsUrl = useMemo(() => {
@@ -23,9 +24,9 @@ export default function SmileViewer({ wsUrl, onRecordChange }) {
     settings,
     setSettings,
     sendStateToServer,
-  } = useDataSocket(resolvedWsUrl);
+  } = useDataSocket(resolvedWsUrl, faceFormat);
 
-  const { videoWs, videoConnected } = useVideoSocket(resolvedWsUrl, videoCanvasRef);
+  const { videoWs, videoConnected } = useVideoSocket(resolvedWsUrl, videoCanvasRef, videoProfile);
 
   // Sync recording state with App component
   useEffect(() => {
@@ -44,6 +45,17 @@ export default function SmileViewer({ wsUrl, onRecordChange }) {
           ref={videoCanvasRef}
           style={{ width: "100%", height: "100%", objectFit: "contain", display: "block", border: "1px solid #ccc" }}
         />
+        {settings.OVERLAY_ONLY && (
+          // server sends clean frames in this mode, boxes are drawn here (scaled like the viewer's stream profile)
+          <OverlayCanvas
+            videoCanvasRef={videoCanvasRef}
+            drawFaceBB={settings.DRAW_FACE_BB}
+            drawSmileBB={settings.DRAW_SMILE_BB}
+            drawLandmarks={settings.DRAW_LANDMARKS}
+            facesRef={facesRef}
+            scale={videoProfile && videoProfile.scale ? videoProfile.scale : 1}
+          />
+        )}
       </div>
 
       <div style={{minWidth: 260}}>
@@ -1,7 +1,7 @@
 import React from "react";
 
 export default function ControlsPanel({ settings, setSettings, sendStateToServer, connections, facesRef }) {
-  const { DRAW_LANDMARKS, DRAW_FACE_BB, DRAW_SMILE_BB, DRAW_ROTATED_BB, RECORD, TEST_MODE } = settings;
+  const { DRAW_LANDMARKS, DRAW_FACE_BB, DRAW_SMILE_BB, DRAW_ROTATED_BB, RECORD, TEST_MODE, OVERLAY_ONLY } = settings;
   const { dataConnected, videoConnected, facesCount } = connections;
 
   return (
@@ -116,6 +116,19 @@ export default function ControlsPanel({ settings, setSettings, sendStateToServer
           /> Test Mode (cycle sample faces)
         </label>
       </div>
+      <div style={{marginTop: 8}}>
+        <label style={{display: "flex", alignItems: "center", gap: 8}}>
+          <input
+            type="checkbox"
+            checked={!!OVERLAY_ONLY}
+            onChange={(e) => {
+              const newVal = e.target.checked;
+              setSettings((prev) => ({ ...prev, OVERLAY_ONLY: newVal }));
+              sendStateToServer("OVERLAY_ONLY", newVal);
+            }}
+          /> Draw Overlays in Browser (server sends clean video)
+        </label>
+      </div>
       <div style={{marginTop: 8}}>
         <button
           onClick={() => {
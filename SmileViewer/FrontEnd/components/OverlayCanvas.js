@@ -1,7 +1,8 @@
 import React, { useEffect, useRef } from "react";
 
-// Draws faces overlays according to current video canvas size
-export default function OverlayCanvas({ videoCanvasRef, drawFaceBB, drawSmileBB, drawLandmarks, facesRef }) {
+// Draws faces overlays according to current video canvas size,
+// scale = video frame size / capture size (face coordinates are in capture pixels)
+export default function OverlayCanvas({ videoCanvasRef, drawFaceBB, drawSmileBB, drawLandmarks, facesRef, scale = 1 }) {
   const canvasRef = useRef(null);
 
   useEffect(() => {
@@ -20,7 +21,9 @@ export default function OverlayCanvas({ videoCanvasRef, drawFaceBB, drawSmileBB,
             canvas.width = vidCanvas.width;
             canvas.height = vidCanvas.height;
           }
+          ctx.setTransform(1, 0, 0, 1, 0, 0);
           ctx.clearRect(0, 0, canvas.width, canvas.height);
+          ctx.setTransform(scale, 0, 0, scale, 0, 0);
           const faces = facesRef.current;
           faces.forEach((f) => {
             const fb = f.face_bbox;
@@ -46,6 +49,14 @@ export default function OverlayCanvas({ videoCanvasRef, drawFaceBB, drawSmileBB,
                 ctx.arc(lx, ly, 2, 0, Math.PI * 2);
                 ctx.fill();
               });
+            } else if (drawLandmarks && f.landmarks && ArrayBuffer.isView(f.landmarks)) {
+              // binary frames: flat Int16Array x0, y0, x1, y1, ...
+              ctx.fillStyle = "deepskyblue";
+              for (let i = 0; i + 1 < f.landmarks.length; i += 2) {
+                ctx.beginPath();
+                ctx.arc(f.landmarks[i], f.landmarks[i + 1], 2, 0, Math.PI * 2);
+                ctx.fill();
+              }
             }
           });
         }
@@ -58,7 +69,7 @@ export default function OverlayCanvas({ videoCanvasRef, drawFaceBB, drawSmileBB,
       isActive = false;
       if (rafId) cancelAnimationFrame(rafId);
     };
-  }, [videoCanvasRef, drawFaceBB, drawSmileBB, drawLandmarks, facesRef]);
+  }, [videoCanvasRef, drawFaceBB, drawSmileBB, drawLandmarks, facesRef, scale]);
 
   return (
     <canvas
@@ -1,13 +1,40 @@
 import { useEffect, useRef, useState, useCallback } from "react";
+import { applyFaceDelta, decodeFaceFrame } from "../protocol/faceFrame";
 
-// Handles the data/control WebSocket: settings sync and faces list updates
-export default function useDataSocket(resolvedWsUrl) {
+function rowToFace(row) {
+  const smiling = row[9];
+  const face_bbox = row[1] >= 0 ? [row[1], row[2], row[3], row[4]] : null;
+  const smile_bbox = smiling == "Smiling" ? [row[5], row[6], row[7], row[8]] : [-1, -1, -1, -1];
+  return {
+    face_id: row[0],
+    face_bbox,
+    smile_bbox,
+    smile_status: smiling,
+    landmarks: row.length > 10 ? row[10] : null,
+  };
+}
+
+// format "binary" asks the server for packed face frames instead of json
+export function controlsUrlFor(resolvedWsUrl, format = "json") {
+  if (format !== "binary") return resolvedWsUrl;
+  return `${resolvedWsUrl}${resolvedWsUrl.includes("?") ? "&" : "?"}format=binary`;
+}
+
+// Handles the data/control WebSocket: settings sync and faces list updates.
+// topics (optional) picks what the server sends, e.g. { smiles: 0, metrics: 1 } (max Hz, 0 = every update),
+// by default it's face rows + settings
+export default function useDataSocket(resolvedWsUrl, format = "json", topics = null) {
   const [ws, setWs] = useState(null);
   const [connected, setConnected] = useState(false);
   const reconnectTimeoutRef = useRef(null);
   const retryAttemptsRef = useRef(0);
 
   const facesRef = useRef([]);
+  // every face from the last keyframe + deltas, facesRef only shows the first 3
+  const allFacesRef = useRef([]);
+  // latest landmarks / metrics message and the smile transitions so far, for subscribed topics
+  const topicsRef = useRef({ landmarks: null, metrics: null, smiles: [] });
+  const topicsKey = topics ? JSON.stringify(topics) : null;
   const [facesTick, setFacesTick] = useState(0);
 
   const [settings, setSettings] = useState({
@@ -17,6 +44,7 @@ export default function useDataSocket(resolvedWsUrl) {
     DRAW_ROTATED_BB: false,
     RECORD: false,
     TEST_MODE: false,
+    OVERLAY_ONLY: false,
   });
 
   // Exponential backoff reconnect
@@ -36,7 +64,8 @@ export default function useDataSocket(resolvedWsUrl) {
     function connect() {
       if (closedByEffectCleanup) return;
       try {
-        const socket = new WebSocket(resolvedWsUrl);
+        const socket = new WebSocket(controlsUrlFor(resolvedWsUrl, format));
+        socket.binaryType = "arraybuffer";
         currentSocket = socket;
         setWs(socket);
 
@@ -53,28 +82,41 @@ export default function useDataSocket(resolvedWsUrl) {
           }
           // Request current settings from server
           socket.send(JSON.stringify({ type: "get_settings" }));
+          if (topicsKey) socket.send(JSON.stringify({ type: "subscribe", topics: JSON.parse(topicsKey) }));
         };
 
         socket.onmessage = (ev) => {
           if (closedByEffectCleanup) return;
+          if (ev.data instanceof ArrayBuffer) {
+            const frame = decodeFaceFrame(ev.data);
+            if (frame) {
+              allFacesRef.current = frame.delta
+                ? applyFaceDelta(allFacesRef.current, frame.faces, frame.removed)
+                : frame.faces;
+              facesRef.current = allFacesRef.current.slice(0, 3);
+              setFacesTick((t) => (t + 1) % 1000000);
+            }
+            return;
+          }
           if (typeof ev.data !== "string") return;
           try {
             const payload = JSON.parse(ev.data);
             if (payload.t === "f") {
-              const compact = (payload.f || []).slice(0, 3);
-              facesRef.current = compact.map((row) => {
-                const smiling = row[9];
-                const face_bbox = row[1] >= 0 ? [row[1], row[2], row[3], row[4]] : null;
-                const smile_bbox = smiling == "Smiling" ? [row[5], row[6], row[7], row[8]] : [-1, -1, -1, -1];
-                return {
-                  face_id: row[0],
-                  face_bbox,
-                  smile_bbox,
-                  smile_status: smiling,
-                  landmarks: row.length > 10 ? row[10] : null,
-                };
-              });
+              allFacesRef.current = (payload.f || []).map(rowToFace);
+              facesRef.current = allFacesRef.current.slice(0, 3);
+              setFacesTick((t) => (t + 1) % 1000000);
+            } else if (payload.t === "d") {
+              // delta: changed / new rows in f, removed ids in r
+              allFacesRef.current = applyFaceDelta(allFacesRef.current, (payload.f || []).map(rowToFace), payload.r || []);
+              facesRef.current = allFacesRef.current.slice(0, 3);
               setFacesTick((t) => (t + 1) % 1000000);
+            } else if (payload.t === "l") {
+              topicsRef.current.landmarks = payload;
+            } else if (payload.t === "m") {
+              topicsRef.current.metrics = payload;
+            } else if (payload.t === "s") {
+              // [face_id, old status, new status], keep the last 100
+              topicsRef.current.smiles = topicsRef.current.smiles.concat(payload.e || []).slice(-100);
             } else if (payload.type === "faces") {
               const faces = Array.isArray(payload.faces) ? payload.faces.slice(0, 3) : [];
               facesRef.current = faces.map((f) => ({
@@ -98,6 +140,7 @@ export default function useDataSocket(resolvedWsUrl) {
                   DRAW_ROTATED_BB: !!payload.settings.DRAW_ROTATED_BB,
                   RECORD: !!payload.settings.RECORD,
                   TEST_MODE: !!payload.settings.TEST_MODE,
+                  OVERLAY_ONLY: !!payload.settings.OVERLAY_ONLY,
                 });
               }
             } else if (payload.type === "pong") {
@@ -142,7 +185,7 @@ export default function useDataSocket(resolvedWsUrl) {
         currentSocket = null;
       }
     };
-  }, [resolvedWsUrl]);
+  }, [resolvedWsUrl, format, topicsKey]);
 
   const sendStateToServer = useCallback(
     (key, value) => {
@@ -175,6 +218,7 @@ export default function useDataSocket(resolvedWsUrl) {
     connected,
     facesRef,
     facesTick,
+    topicsRef,
     settings,
     setSettings,
     sendStateToServer,
@@ -1,7 +1,19 @@
 import { useEffect, useRef, useState } from "react";
 
+// Builds the /video url, optional profile { scale, quality, max_fps } goes in the query string
+export function videoUrlFor(resolvedWsUrl, profile) {
+  const base = resolvedWsUrl.replace('/controls', '/video');
+  if (!profile) return base;
+  const params = ["scale", "quality", "max_fps"]
+    .filter((key) => profile[key] !== undefined && profile[key] !== null)
+    .map((key) => `${key}=${encodeURIComponent(profile[key])}`);
+  return params.length ? `${base}?${params.join("&")}` : base;
+}
+
 // Manages the video WebSocket and renders frames into a provided canvas ref
-export default function useVideoSocket(resolvedWsUrl, videoCanvasRef) {
+export default function useVideoSocket(resolvedWsUrl, videoCanvasRef, profile) {
+  // a new profile object each render shouldn't reconnect, only a different url should
+  const videoUrl = videoUrlFor(resolvedWsUrl, profile);
   const [videoWs, setVideoWs] = useState(null);
   const [videoConnected, setVideoConnected] = useState(false);
   const videoReconnectTimeoutRef = useRef(null);
@@ -25,7 +37,6 @@ export default function useVideoSocket(resolvedWsUrl, videoCanvasRef) {
     function connectVideo() {
       if (closedByEffectCleanup) return;
       try {
-        const videoUrl = resolvedWsUrl.replace('/controls', '/video');
         const videoSocket = new WebSocket(videoUrl);
         try { videoSocket.binaryType = "arraybuffer"; } catch {}
         currentVideoSocket = videoSocket;
@@ -151,7 +162,7 @@ export default function useVideoSocket(resolvedWsUrl, videoCanvasRef) {
         currentVideoSocket = null;
       }
     };
-  }, [resolvedWsUrl, videoCanvasRef]);
+  }, [videoUrl, videoCanvasRef]);
 
   // Heartbeat
   useEffect(() => {
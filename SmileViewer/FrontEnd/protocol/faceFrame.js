@@ -0,0 +1,58 @@
+// Binary face frames from /controls?format=binary, layout in Server/Face_protocol.py
+//   header 16 B: u8 type, u8 version, u16 count, u16 landmarks per face, u16 removed count, f64 ts
+//   records 12 x int16 per face: id_lo, id_hi, face box x4, smile box x4, status, reserved
+//   landmarks count * perFace * (x, y) int16
+//   removed (delta frames) removed count * (id_lo, id_hi) u16
+export const FACE_FRAME = 1;
+export const FACE_DELTA = 2;
+export const PROTOCOL_VERSION = 1;
+export const HEADER_BYTES = 16;
+export const RECORD_FIELDS = 12;
+export const STATUS_NAMES = ["Detecting...", "Smiling", "Not Smiling", "Tilted", "Occluded"];
+
+// Returns { ts, faces, delta, removed } shaped like the json path in useDataSocket, or null if it isn't a face frame.
+// delta frames only hold added / changed faces, apply them with applyFaceDelta.
+// landmarks come back as a flat Int16Array [x0, y0, x1, y1, ...] viewing the message buffer
+export function decodeFaceFrame(buffer, maxFaces = Infinity) {
+  if (!(buffer instanceof ArrayBuffer) || buffer.byteLength < HEADER_BYTES) return null;
+  const view = new DataView(buffer);
+  const type = view.getUint8(0);
+  if ((type !== FACE_FRAME && type !== FACE_DELTA) || view.getUint8(1) !== PROTOCOL_VERSION) return null;
+  const count = view.getUint16(2, true);
+  const perFace = view.getUint16(4, true);
+  const removedCount = view.getUint16(6, true);
+  const ts = view.getFloat64(8, true);
+  const records = new Int16Array(buffer, HEADER_BYTES, count * RECORD_FIELDS);
+  const ids = new Uint16Array(buffer, HEADER_BYTES, count * RECORD_FIELDS);
+  const points = perFace ? new Int16Array(buffer, HEADER_BYTES + records.byteLength, count * perFace * 2) : null;
+
+  const faces = [];
+  for (let i = 0; i < Math.min(count, maxFaces); i++) {
+    const o = i * RECORD_FIELDS;
+    const status = STATUS_NAMES[records[o + 10]] || "";
+    faces.push({
+      face_id: ids[o] + ids[o + 1] * 65536,
+      face_bbox: records[o + 2] >= 0 ? Array.from(records.subarray(o + 2, o + 6)) : null,
+      smile_bbox: status === "Smiling" ? Array.from(records.subarray(o + 6, o + 10)) : [-1, -1, -1, -1],
+      smile_status: status,
+      landmarks: points ? points.subarray(i * perFace * 2, (i + 1) * perFace * 2) : null,
+    });
+  }
+  const removedIds = new Uint16Array(buffer, HEADER_BYTES + records.byteLength + (points ? points.byteLength : 0), removedCount * 2);
+  const removed = [];
+  for (let i = 0; i < removedCount; i++) removed.push(removedIds[2 * i] + removedIds[2 * i + 1] * 65536);
+  return { ts, faces, delta: type === FACE_DELTA, removed };
+}
+
+// Keyframe list + delta -> new list, changed faces replace theirs in place, new ones go at the end
+export function applyFaceDelta(faces, changed, removed = []) {
+  const byId = new Map(changed.map((f) => [f.face_id, f]));
+  const gone = new Set(removed);
+  const next = [];
+  for (const f of faces) {
+    if (gone.has(f.face_id)) continue;
+    next.push(byId.has(f.face_id) ? byId.get(f.face_id) : f);
+    byId.delete(f.face_id);
+  }
+  return next.concat(Array.from(byId.values()));
+}
@@ -0,0 +1,158 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from Crop_store import DirectoryStore
+from Frame_pipeline import LatestQueue
+
+
+def crop_signature(crop, size=8):
+    '''
+    Gray size x size thumbnail, normalized for brightness / contrast. On small mouth crops this holds up
+    to landmark jitter + sensor noise much better than a dhash, whose near-tie bits flip frame to frame
+    '''
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    return (small - small.mean()) / (small.std() + 8.0) # + 8 so a flat crop's noise isn't blown up
+
+
+def signature_distance(a, b):
+    '''Mean abs difference, ~0.2 for the same mouth a frame later, 0.4+ for a different expression / face'''
+    return float(np.abs(a - b).mean())
+
+
+class CaptureService:
+    '''
+    Saves face / smile crops while RECORD is on. score_faces notify()s it when a face gets confirmed and on
+    smile frames, the crop is cut from latest_frame right then and queued for a fixed pool of writers.
+    The queue is bounded, when disk can't keep up new crops are refused and counted instead of piling up.
+    With CAPTURE_DEDUP a smile crop within CAPTURE_DEDUP_DISTANCE (crop_signature) of the face's last saved one
+    is skipped, no file and no db row, but one is still saved every CAPTURE_DEDUP_KEEP_EVERY_S.
+    notify() runs on the event loop (tracking stage), the jpeg encode + store write happen in the writer threads.
+    Where crops go is the store's business (Crop_store: a file per crop, or packed segments).
+    '''
+    def __init__(self, parent, workers=2, depth=32, store=None, images_dir=None):
+        self.parent = parent
+        self.store = store or DirectoryStore(images_dir or os.path.join(os.getcwd(), "server", "data", "images"))
+        self.workers = workers
+        self.queue = LatestQueue(depth, "newest", on_drop=self._dropped)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crop-writer")
+        self.tasks = []
+        self.state = {
+            "queued": 0,
+            "written": 0,
+            "dropped": {"face": 0, "smile": 0}, # refused, queue full
+            "stale": 0, # latest_frame gone / recycled before the crop
+            "deduped": 0, # smile crops skipped as near duplicates
+            "failed": 0,
+            "in_flight": 0,
+            "write_ms": 0.0, # EMA
+        }
+
+    def start(self):
+        '''Writer tasks, needs the running loop (lifespan)'''
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.run()) for _ in range(self.workers)]
+
+    def notify(self, kind, face_id, face_data, now=None):
+        '''
+        kind "face" (confirmed, once) or "smile" (every smile frame, rate limited to CAPTURE_SMILE_HZ per face).
+        Returns True once the crop is queued, a face crop that wasn't gets asked for again next frame.
+        '''
+        c = self.parent.controls
+        if not c.get('RECORD', False):
+            return False
+        now = time.time() if now is None else now
+        if kind == "smile":
+            hz = c.get('CAPTURE_SMILE_HZ', 4)
+            if hz <= 0 or now - face_data.get('last_smile_capture', 0.0) < 1.0 / hz:
+                return False
+            bbox = face_data.get('smile_bbox')
+        else:
+            bbox = face_data['face_bbox']
+        latest = self.parent.state.get('latest_frame')
+        crop = latest.crop(*bbox) if latest is not None and bbox else None
+        if crop is None or crop.size == 0:
+            self.state['stale'] += 1
+            return False
+        if kind == "smile" and c.get('CAPTURE_DEDUP', True):
+            signature = crop_signature(crop)
+            last = face_data.get('last_smile_signature')
+            if (last is not None and signature_distance(signature, last) <= c.get('CAPTURE_DEDUP_DISTANCE', 0.3)
+                    and now - face_data['last_smile_saved'] < c.get('CAPTURE_DEDUP_KEEP_EVERY_S', 2.0)):
+                # same expression as the last saved crop, its smiling time rides along with the next saved one
+                face_data['last_smile_capture'] = now
+                self.state['deduped'] += 1
+                return False
+        # smiling time score_faces counted since this face's last queued smile, goes into faces.smiling_s
+        smiling_s = face_data.get('smiling_s', 0.0) - face_data.get('smiling_s_logged', 0.0) if kind == "smile" else 0.0
+        if not self.queue.put_nowait((kind, face_id, now, crop, smiling_s)):
+            return False
+        self.state['queued'] += 1
+        if kind == "smile":
+            face_data['last_smile_capture'] = face_data['last_smile_saved'] = now
+            face_data['smiling_s_logged'] = face_data.get('smiling_s', 0.0)
+            if c.get('CAPTURE_DEDUP', True):
+                face_data['last_smile_signature'] = signature
+        return True
+
+    def _dropped(self, job):
+        self.state['dropped'][job[0]] += 1
+
+    def write(self, kind, face_id, ts, crop):
+        '''Store location of the encoded crop, None if it couldn't be encoded'''
+        ok, jpeg = cv2.imencode(".jpg", crop)
+        return self.store.put(kind, face_id, ts, jpeg.tobytes()) if ok else None
+
+    async def run(self):
+        s = self.state
+        loop = asyncio.get_running_loop()
+        while True:
+            kind, face_id, ts, crop, smiling_s = await self.queue.get()
+            s['in_flight'] += 1
+            t0 = time.perf_counter()
+            try:
+                location = await loop.run_in_executor(self.executor, self.write, kind, face_id, ts, crop)
+            except Exception as e:
+                print(f"Error saving {kind} crop for face {face_id}: {e}")
+                location = None
+            finally:
+                s['in_flight'] -= 1
+            ms = (time.perf_counter() - t0) * 1000
+            s['write_ms'] = ms if s['written'] == 0 else 0.9 * s['write_ms'] + 0.1 * ms
+            if location is None:
+                s['failed'] += 1
+                continue
+            s['written'] += 1
+            if kind == "smile":
+                self.parent.DB_manager.log_smilemeta_to_db(face_id, smiling_s, location)
+            else:
+                self.parent.DB_manager.log_face_crop(face_id, location)
+
+    async def close(self, timeout=2.0):
+        '''Lets the writers finish what's queued (up to timeout), then stops them'''
+        deadline = time.perf_counter() + timeout
+        while self.tasks and (len(self.queue) or self.state['in_flight']) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.02)
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        s = self.state
+        return {
+            "queued": s['queued'],
+            "written": s['written'],
+            "dropped": dict(s['dropped']),
+            "stale": s['stale'],
+            "deduped": s['deduped'],
+            "failed": s['failed'],
+            "backlog": len(self.queue) + s['in_flight'],
+            "write_ms": round(s['write_ms'], 3),
+        }
@@ -0,0 +1,278 @@
+import asyncio
+import collections
+import datetime
+import email.utils
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+from fastapi import FastAPI, HTTPException, Request, Response
+
+THUMB_MIN, THUMB_MAX = 16, 512
+THUMB_QUALITY = 85
+
+
+class ByteLRU:
+    '''Least recently used cache of bytes values, bounded by their total size'''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict()
+        self.bytes = 0
+        self.state = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        data = self.items.get(key)
+        if data is None:
+            self.state['misses'] += 1
+            return None
+        self.items.move_to_end(key)
+        self.state['hits'] += 1
+        return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self.items[key] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.state['evictions'] += 1
+
+    def stats(self):
+        return {"entries": len(self.items), "bytes": self.bytes, "max_bytes": self.max_bytes, **self.state}
+
+
+def http_date(capture_time):
+    '''capture_time (local isoformat) -> Last-Modified header value'''
+    moment = datetime.datetime.fromisoformat(capture_time).astimezone(datetime.timezone.utc)
+    return email.utils.format_datetime(moment.replace(microsecond=0), usegmt=True)
+
+
+def not_modified(request, etag, last_modified):
+    '''Conditional GET: If-None-Match wins, If-Modified-Since only counts without it'''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        return email.utils.parsedate_to_datetime(if_modified_since) >= email.utils.parsedate_to_datetime(last_modified)
+    except (TypeError, ValueError):
+        return False
+
+
+def make_thumbnail(data, size):
+    '''Jpeg of the crop scaled to fit size x size (never up), None if it doesn't decode'''
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    h, w = image.shape[:2]
+    scale = size / max(h, w)
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMB_QUALITY])
+    return jpeg.tobytes() if ok else None
+
+
+class CropServer:
+    '''
+    Serves saved crops: GET /crops/faces/<face_id> (the face crop) and /crops/smiles/<smile id>, ?size=N for a
+    thumbnail that fits N x N. The location comes from the db (a primary key read through SmileQueries' pool),
+    the bytes from the crop store, so both store backends work and crops retention took answer 404.
+    Recently served bytes (crops and thumbnails) stay in a ByteLRU of cache_mb, so a dashboard going over the
+    same recent crops doesn't read the store again. ETag = hash of location + time + size, so a revalidation
+    (If-None-Match / If-Modified-Since) is answered with a 304 from the db row alone.
+    Thumbnails are made once and kept under thumbs_dir/<face|smile>/<id>/, trimmed (least recently used first) past
+    thumb_cache_mb, retention drops a crop's thumbnails along with it (drop_thumbs). Which thumbnails exist, their
+    sizes and use order are kept in memory (walked once, like DirectoryStore's usage), so trimming doesn't rescan.
+    load() runs in worker threads and drop_thumbs on retention's, the index and their counters are under lock.
+    '''
+    def __init__(self, parent, cache_mb=64, thumbs_dir=None, thumb_cache_mb=256):
+        self.parent = parent
+        self.cache = ByteLRU(int(cache_mb * 1024 * 1024))
+        self.thumbs_dir = thumbs_dir or os.path.join(os.getcwd(), "server", "data", "thumbs")
+        self.thumb_max_bytes = int(thumb_cache_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.thumbs = None # path -> size, least recently used first, walked on first use
+        self.thumb_bytes = None
+        self.state = {
+            "served": 0,
+            "not_modified": 0,
+            "not_found": 0,
+            "store_reads": 0,
+            "thumbs_made": 0,
+            "thumbs_trimmed": 0,
+        }
+
+    async def lookup(self, kind, key):
+        '''(location, time) of the crop, 404 if there's no row or no crop anymore'''
+        sql = ("SELECT crop_path, first_seen FROM faces WHERE face_id = ?" if kind == "face"
+               else "SELECT crop, capture_time FROM smiles WHERE id = ?")
+        rows = await self.parent.SmileQueries.run(sql, (key,))
+        if not rows or rows[0][0] is None:
+            self.count('not_found')
+            raise HTTPException(status_code=404, detail=f"no saved crop for {kind} {key}")
+        return rows[0]
+
+    @staticmethod
+    def etag(location, when, size):
+        return '"' + hashlib.blake2b(f"{location}|{when}|{size}".encode(), digest_size=12).hexdigest() + '"'
+
+    def thumb_dir(self, kind, key):
+        return os.path.join(self.thumbs_dir, kind, str(key))
+
+    def count(self, key, n=1):
+        with self.lock:
+            self.state[key] += n
+
+    def thumb_index(self):
+        '''The thumbnails on disk, oldest first, one walk per process'''
+        if self.thumbs is None:
+            found = []
+            for dirpath, _, names in os.walk(self.thumbs_dir):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, path, stat.st_size))
+            found.sort()
+            with self.lock:
+                if self.thumbs is None:
+                    self.thumbs = collections.OrderedDict((path, size) for _, path, size in found)
+                    self.thumb_bytes = sum(self.thumbs.values())
+        return self.thumbs
+
+    def drop_thumbs(self, kind, key):
+        '''Deletes every thumbnail of a crop (retention expired / evicted it), bytes freed'''
+        path = self.thumb_dir(kind, key)
+        try:
+            names = os.listdir(path)
+        except OSError:
+            return 0
+        thumbs = self.thumb_index()
+        freed = 0
+        with self.lock:
+            for name in names:
+                thumb = os.path.join(path, name)
+                size = thumbs.pop(thumb, None)
+                if size is None:
+                    try:
+                        size = os.path.getsize(thumb)
+                    except OSError:
+                        continue
+                else:
+                    self.thumb_bytes -= size
+                try:
+                    os.remove(thumb)
+                except OSError:
+                    continue
+                freed += size
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+        return freed
+
+    def load(self, kind, key, location, size, tag):
+        '''Bytes of the crop / thumbnail from the store or thumbs_dir, runs in a worker thread'''
+        if size:
+            # per crop dir so retention finds them, the tag in the name so a crop moved by compaction is made again
+            name = tag.strip('"')
+            path = os.path.join(self.thumb_dir(kind, key), f"{size}_{name}.jpg")
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                pass
+            else:
+                thumbs = self.thumb_index()
+                with self.lock:
+                    if path in thumbs:
+                        thumbs.move_to_end(path)
+                return data
+        data = self.parent.CropStore.read(location)
+        self.count('store_reads')
+        if data is None or not size:
+            return data
+        thumb = make_thumbnail(data, size)
+        if thumb is not None:
+            self.save_thumb(path, thumb)
+        return thumb
+
+    def save_thumb(self, path, data):
+        thumbs = self.thumb_index()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self.lock:
+            self.thumb_bytes += len(data) - thumbs.pop(path, 0)
+            thumbs[path] = len(data)
+            self.state['thumbs_made'] += 1
+            over = self.thumb_bytes > self.thumb_max_bytes
+        if over:
+            self.trim_thumbs()
+
+    def trim_thumbs(self):
+        '''Deletes the least recently used thumbnails until they're down to 3/4 of the budget'''
+        thumbs = self.thumb_index()
+        victims = []
+        with self.lock:
+            while thumbs and self.thumb_bytes > self.thumb_max_bytes * 3 // 4:
+                path, size = thumbs.popitem(last=False)
+                self.thumb_bytes -= size
+                victims.append(path)
+            self.state['thumbs_trimmed'] += len(victims)
+        for path in victims:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            try:
+                os.rmdir(os.path.dirname(path)) # the crop's dir, if that was its last thumbnail
+            except OSError:
+                pass
+
+    async def serve(self, request, kind, key, size=None):
+        if size is not None and not THUMB_MIN <= size <= THUMB_MAX:
+            raise HTTPException(status_code=400, detail=f"size: {THUMB_MIN} to {THUMB_MAX}, got {size}")
+        location, when = await self.lookup(kind, key)
+        tag = self.etag(location, when, size)
+        headers = {"ETag": tag, "Last-Modified": http_date(when), "Cache-Control": "private, no-cache"}
+        if not_modified(request, tag, headers['Last-Modified']):
+            self.count('not_modified')
+            return Response(status_code=304, headers=headers)
+        data = self.cache.get(tag)
+        if data is None:
+            data = await asyncio.to_thread(self.load, kind, key, location, size, tag)
+            if data is None:
+                self.count('not_found')
+                raise HTTPException(status_code=404, detail=f"crop for {kind} {key} is gone from the store")
+            self.cache.put(tag, data)
+        self.count('served')
+        return Response(content=data, media_type="image/jpeg", headers=headers)
+
+    def register(self, app: FastAPI):
+        @app.get("/crops/faces/{face_id}")
+        async def face_crop(face_id: int, request: Request, size: int = None):
+            """The face's saved face crop, size=N for a thumbnail that fits N x N"""
+            return await self.serve(request, "face", face_id, size)
+
+        @app.get("/crops/smiles/{smile_id}")
+        async def smile_crop(smile_id: int, request: Request, size: int = None):
+            """A smile's crop by smile id (the ids /smiles returns), size=N for a thumbnail"""
+            return await self.serve(request, "smile", smile_id, size)
+
+    def stats(self):
+        with self.lock:
+            return {**self.state, "cache": self.cache.stats(), "thumb_bytes": self.thumb_bytes}
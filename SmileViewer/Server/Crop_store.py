@@ -0,0 +1,326 @@
+import datetime
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import time
+
+# segment record: header then the jpeg, locations point at the jpeg so a read is one slice
+#   magic, kind (0 face / 1 smile), face_id, capture ts, jpeg length
+SEGMENT_MAGIC = b"SVC1"
+RECORD_HEADER = struct.Struct("<4sBIdI")
+KINDS = {"face": 0, "smile": 1}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+SEGMENT_PREFIX = "seg:"
+
+
+def read_file(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except (OSError, TypeError):
+        return None
+
+
+def remove_file(path):
+    '''Deletes a crop file, bytes freed (0 if it was already gone)'''
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except (OSError, TypeError):
+        return 0
+
+
+class DirectoryStore:
+    '''The original layout: images/<face_id>/face.jpg and smile_<timestamp>.jpg, location = file path'''
+    backend = "directory"
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.bytes = None # size of the tree, walked once on the first usage() then kept up by put / delete
+
+    def path_for(self, kind, face_id, ts):
+        face_dir = os.path.join(self.root, str(face_id))
+        if kind == "face":
+            return os.path.join(face_dir, "face.jpg")
+        timestamp = datetime.datetime.fromtimestamp(ts).strftime("%Y%m%d_%H%M%S_%f")
+        return os.path.join(face_dir, f"smile_{timestamp}.jpg")
+
+    def put(self, kind, face_id, ts, data):
+        path = self.path_for(kind, face_id, ts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        with self.lock:
+            if self.bytes is not None:
+                self.bytes += len(data)
+        return path
+
+    def read(self, location):
+        return read_file(location)
+
+    def delete(self, location):
+        size = remove_file(location)
+        with self.lock:
+            if self.bytes is not None:
+                self.bytes -= size
+        return size
+
+    def usage(self):
+        '''Bytes under root'''
+        if self.bytes is None:
+            total = 0
+            for dirpath, _, names in os.walk(self.root):
+                for name in names:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        pass
+            with self.lock:
+                if self.bytes is None:
+                    self.bytes = total
+        return self.bytes
+
+    def stats(self):
+        return {"backend": self.backend, "bytes": self.bytes}
+
+    def close(self):
+        pass
+
+
+class SegmentStore:
+    '''
+    Crops appended to one segment file per hour (rolled early past segment_max_bytes), so a week of
+    crops is ~170 files instead of one per smile. location = "seg:<file>@<offset>+<length>", kept in the db
+    (smiles.crop, faces.crop_path). Reads slice an mmap of the segment. Records whose db row went away
+    (retention) stay in their segment until compact_segments rewrites it.
+    Still reads plain file paths, so crops saved by the directory backend keep working after a switch.
+    '''
+    backend = "segments"
+
+    def __init__(self, root, segment_max_bytes=256 * 1024 * 1024):
+        self.root = root
+        self.segment_max_bytes = segment_max_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock = threading.Lock() # capture writer threads append concurrently
+        self.active = None # (name, file)
+        self.maps = {} # segment name -> mmap, remapped when the segment grew past it
+        self.state = {
+            "appended": 0,
+            "appended_bytes": 0,
+            "reads": 0,
+            "remaps": 0,
+        }
+
+    @staticmethod
+    def location(name, offset, length):
+        return f"{SEGMENT_PREFIX}{name}@{offset}+{length}"
+
+    @staticmethod
+    def parse(location):
+        name, _, span = location[len(SEGMENT_PREFIX):].partition("@")
+        offset, _, length = span.partition("+")
+        return name, int(offset), int(length)
+
+    def segment_for(self, ts, size):
+        '''Active segment for this hour with room for size bytes, opens the next one if not'''
+        hour = datetime.datetime.fromtimestamp(ts).strftime("%Y%m%d_%H")
+        if self.active is not None:
+            name, f = self.active
+            if name.startswith(hour) and f.tell() + size <= self.segment_max_bytes:
+                return name, f
+            f.close()
+        part = 0
+        while True:
+            name = f"{hour}_{part}.seg"
+            path = os.path.join(self.root, name)
+            if not os.path.exists(path) or os.path.getsize(path) + size <= self.segment_max_bytes:
+                break
+            part += 1
+        f = open(path, "ab")
+        self.active = (name, f)
+        return name, f
+
+    def put(self, kind, face_id, ts, data):
+        header = RECORD_HEADER.pack(SEGMENT_MAGIC, KINDS[kind], face_id, ts, len(data))
+        with self.lock:
+            name, f = self.segment_for(ts, len(header) + len(data))
+            offset = f.tell() + len(header)
+            f.write(header + data)
+            f.flush() # readers mmap the file, the bytes have to be in it (page cache) before the location is out
+            self.state['appended'] += 1
+            self.state['appended_bytes'] += len(header) + len(data)
+        return self.location(name, offset, len(data))
+
+    def _map(self, name, end):
+        mm = self.maps.get(name)
+        if mm is None or len(mm) < end:
+            if mm is not None:
+                mm.close()
+                self.state['remaps'] += 1
+            with open(os.path.join(self.root, name), "rb") as f:
+                mm = self.maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def read(self, location):
+        if not isinstance(location, str):
+            return None
+        if not location.startswith(SEGMENT_PREFIX):
+            return read_file(location)
+        name, offset, length = self.parse(location)
+        try:
+            with self.lock:
+                mm = self._map(name, offset + length)
+            self.state['reads'] += 1
+            return mm[offset:offset + length] if len(mm) >= offset + length else None
+        except (OSError, ValueError):
+            return None
+
+    def records(self, name):
+        '''(kind, face_id, ts, offset, length) of every record in a segment, for tools / recovery'''
+        with open(os.path.join(self.root, name), "rb") as f:
+            data = f.read()
+        pos = 0
+        while pos + RECORD_HEADER.size <= len(data):
+            magic, kind, face_id, ts, length = RECORD_HEADER.unpack_from(data, pos)
+            if magic != SEGMENT_MAGIC:
+                break
+            yield KIND_NAMES[kind], face_id, ts, pos + RECORD_HEADER.size, length
+            pos += RECORD_HEADER.size + length
+
+    def delete(self, location):
+        '''
+        A segment record can't be cut out, its bytes come back when the segment is compacted or dropped (0 freed now).
+        Plain files from the directory backend are deleted.
+        '''
+        if isinstance(location, str) and location.startswith(SEGMENT_PREFIX):
+            return 0
+        return remove_file(location)
+
+    def segments(self):
+        return sorted(name for name in os.listdir(self.root) if name.endswith(".seg"))
+
+    def sealed(self, grace_s=300.0):
+        '''
+        Segments, oldest hour first, that aren't being appended to and weren't written for grace_s,
+        so no crop of theirs is still waiting in the db writer's queue
+        '''
+        active = self.active[0] if self.active is not None else None
+        now = time.time()
+        return [name for name in self.segments()
+                if name != active and now - os.path.getmtime(os.path.join(self.root, name)) >= grace_s]
+
+    def usage(self):
+        return sum(os.path.getsize(os.path.join(self.root, name)) for name in self.segments())
+
+    def drop(self, name):
+        '''Unmap and delete a segment nothing points into anymore'''
+        with self.lock:
+            mm = self.maps.pop(name, None)
+            if mm is not None:
+                mm.close()
+            if self.active is not None and self.active[0] == name:
+                self.active[1].close()
+                self.active = None
+            os.remove(os.path.join(self.root, name))
+
+    def stats(self):
+        s = self.state
+        segments = self.segments()
+        return {
+            "backend": self.backend,
+            "segments": len(segments),
+            "bytes": self.usage(),
+            "appended": s['appended'],
+            "reads": s['reads'],
+            "remaps": s['remaps'],
+        }
+
+    def close(self):
+        with self.lock:
+            if self.active is not None:
+                self.active[1].close()
+                self.active = None
+            for mm in self.maps.values():
+                mm.close()
+            self.maps = {}
+
+
+def segment_refs(conn, name, limit=-1):
+    '''(table, key, offset, length) of db rows pointing into a segment, an index range on smiles.crop'''
+    lo, hi = f"{SEGMENT_PREFIX}{name}@", f"{SEGMENT_PREFIX}{name}@~" # "~" sorts after the offset digits
+    rows = conn.execute("SELECT 'smiles', id, crop FROM smiles WHERE crop IS NOT NULL AND crop > ? AND crop < ? LIMIT ?",
+                        (lo, hi, limit)).fetchall()
+    rows += conn.execute("SELECT 'faces', face_id, crop_path FROM faces WHERE crop_path > ? AND crop_path < ? LIMIT ?",
+                         (lo, hi, limit)).fetchall()
+    return [(table, key, *SegmentStore.parse(location)[1:]) for table, key, location in rows]
+
+
+def compact_segment(store, conn, name, min_live_ratio=0.5):
+    '''
+    One sealed segment: if less than min_live_ratio of it is live, live records are copied into a new segment,
+    their db locations moved in one transaction, then the old file is deleted. With nothing live it's just deleted.
+    Returns "rewritten" / "deleted" / None (left alone) and the bytes reclaimed.
+    '''
+    path = os.path.join(store.root, name)
+    size = os.path.getsize(path)
+    live = segment_refs(conn, name)
+    live_bytes = sum(RECORD_HEADER.size + length for *_, length in live)
+    if live and live_bytes >= min_live_ratio * size:
+        return None, 0
+    if live:
+        # live records go to a fresh "<hour>_<part>.c<n>.seg" so they never mix with live appends
+        with open(path, "rb") as src:
+            data = src.read()
+        base, part = name.split(".")[0], 0
+        while os.path.exists(os.path.join(store.root, f"{base}.c{part}.seg")):
+            part += 1
+        new_name = f"{base}.c{part}.seg"
+        moves = []
+        with open(os.path.join(store.root, new_name), "wb") as out:
+            for table, key, offset, length in sorted(live, key=lambda ref: ref[2]):
+                header = data[offset - RECORD_HEADER.size:offset]
+                moves.append((table, key, store.location(new_name, out.tell() + len(header), length)))
+                out.write(header + data[offset:offset + length])
+            out.flush()
+            os.fsync(out.fileno())
+        with conn:
+            conn.executemany("UPDATE smiles SET crop = ? WHERE id = ?",
+                             [(location, key) for table, key, location in moves if table == "smiles"])
+            conn.executemany("UPDATE faces SET crop_path = ? WHERE face_id = ?",
+                             [(location, key) for table, key, location in moves if table == "faces"])
+    store.drop(name)
+    return ("rewritten" if live else "deleted"), size - live_bytes
+
+
+def compact_segments(store, db_path, min_live_ratio=0.5, grace_s=300.0):
+    '''
+    compact_segment over every sealed segment (see SegmentStore.sealed).
+    Returns {"rewritten", "deleted", "reclaimed_bytes"}. Run it off the event loop.
+    '''
+    conn = sqlite3.connect(db_path, timeout=30)
+    result = {"rewritten": 0, "deleted": 0, "reclaimed_bytes": 0}
+    try:
+        for name in store.sealed(grace_s):
+            action, reclaimed = compact_segment(store, conn, name, min_live_ratio)
+            if action is not None:
+                result[action] += 1
+                result['reclaimed_bytes'] += reclaimed
+    finally:
+        conn.close()
+    return result
+
+
+STORES = {
+    "directory": lambda data_dir: DirectoryStore(os.path.join(data_dir, "images")),
+    "segments": lambda data_dir: SegmentStore(os.path.join(data_dir, "segments")),
+}
+
+
+def create_crop_store(name, data_dir):
+    if name not in STORES:
+        raise ValueError(f"Unknown crop store {name!r}, expected one of {sorted(STORES)}")
+    return STORES[name](data_dir)
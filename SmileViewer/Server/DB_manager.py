@@ -1,22 +1,159 @@
-
 import sqlite3
 import datetime
 import os
+import queue
+import threading
+import time
+
+FACES_UPSERT = '''
+    INSERT INTO faces (face_id, first_seen, last_seen, smile_count, crop_path, smiling_s) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (face_id) DO UPDATE SET
+        first_seen = min(first_seen, excluded.first_seen),
+        last_seen = max(last_seen, excluded.last_seen),
+        smile_count = smile_count + excluded.smile_count,
+        crop_path = coalesce(excluded.crop_path, crop_path),
+        smiling_s = smiling_s + excluded.smiling_s
+'''
+
+class SmileWriter:
+    '''
+    Background thread with its own connection that does the smile INSERTs.
+    log() only queues the row; the thread commits whenever batch_size rows are waiting or the
+    oldest one has waited flush_interval_s, one executemany + one commit per batch.
+    Rows are ("smile", face_id, time, smiling seconds, crop location) or ("crop", face_id, time, 0, location),
+    the faces aggregates they move are upserted in the same transaction.
+    WAL + synchronous=NORMAL, so a commit doesn't fsync and readers aren't blocked while it writes.
+    '''
+    STOP = object()
+
+    def __init__(self, db_path, batch_size=256, flush_interval_s=0.5):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self.queue = queue.Queue()
+        self.state = {
+            "queued": 0, # rows of both kinds
+            "written": 0, # ... committed
+            "failed": 0, # ... lost with a batch that didn't commit
+            "smiles_written": 0, # committed smile rows only
+            "batches": 0,
+            "commit_ms": 0.0, # EMA
+            "errors": 0,
+        }
+        self.thread = threading.Thread(target=self.run, name="smile-db-writer", daemon=True)
+        self.thread.start()
 
-class DBmanager: 
-    def __init__(self):
+    def log(self, row):
+        self.state['queued'] += 1
+        self.queue.put(row)
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        rows, first_ts = [], None
+        try:
+            while True:
+                timeout = None if not rows else max(0.0, first_ts + self.flush_interval_s - time.monotonic())
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None # window elapsed
+                if isinstance(item, tuple):
+                    if not rows:
+                        first_ts = time.monotonic()
+                    rows.append(item)
+                    if len(rows) < self.batch_size:
+                        continue
+                if rows:
+                    self.write(conn, rows)
+                    rows = []
+                if item is self.STOP:
+                    return
+                if isinstance(item, threading.Event): # flush() marker, everything before it is committed now
+                    item.set()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def face_totals(rows):
+        '''Per face [face_id, first, last, smiles, crop path, smiling s] for this batch'''
+        faces = {}
+        for kind, face_id, ts, smiling_s, location in rows:
+            f = faces.get(face_id)
+            if f is None:
+                f = faces[face_id] = [face_id, ts, ts, 0, None, 0.0]
+            f[1], f[2] = min(f[1], ts), max(f[2], ts)
+            if kind == "smile":
+                f[3] += 1
+                f[5] += smiling_s
+            else:
+                f[4] = location
+        return list(faces.values())
+
+    def write(self, conn, rows):
+        s = self.state
+        t0 = time.perf_counter()
+        smiles = [(face_id, ts, location) for kind, face_id, ts, _, location in rows if kind == "smile"]
+        try:
+            conn.executemany("INSERT INTO smiles (face_id, capture_time, crop) VALUES (?, ?, ?)", smiles)
+            conn.executemany(FACES_UPSERT, self.face_totals(rows))
+            conn.commit()
+            s['written'] += len(rows)
+            s['smiles_written'] += len(smiles)
+        except sqlite3.Error as e:
+            conn.rollback()
+            s['errors'] += 1
+            s['failed'] += len(rows) # not retried, so no longer pending either
+            print(f"Error writing {len(rows)} smile rows: {e}")
+        ms = (time.perf_counter() - t0) * 1000
+        s['commit_ms'] = ms if s['batches'] == 0 else 0.9 * s['commit_ms'] + 0.1 * ms
+        s['batches'] += 1
+
+    def flush(self, timeout=5.0):
+        '''Blocks until everything logged so far is committed, False on timeout'''
+        if not self.thread.is_alive():
+            return False
+        done = threading.Event()
+        self.queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=5.0):
+        if self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join(timeout)
+
+    def stats(self):
+        s = self.state
+        return {
+            "queued": s['queued'],
+            "written": s['written'],
+            "smiles_written": s['smiles_written'],
+            "failed": s['failed'],
+            "pending": s['queued'] - s['written'] - s['failed'],
+            "batches": s['batches'],
+            "commit_ms": round(s['commit_ms'], 3),
+            "errors": s['errors'],
+        }
+
+class DBmanager:
+    def __init__(self, batch_size=256, flush_interval_s=0.5):
         self.state = {}
         self.setup_database()
+        self.Writer = SmileWriter(self.state['DB_path'], batch_size, flush_interval_s)
 
     def setup_database(self):
-        s = self.state 
+        s = self.state
         if s is None:
             return
         images_dir = os.path.join(os.getcwd(), "server", "data", "images")
         db_path = os.path.join(os.getcwd(), "server", "data", "smile_metadata.db")
         if not os.path.exists(images_dir):
             os.makedirs(images_dir)
+        s['DB_path'] = db_path
         s['DB_conn'] = sqlite3.connect(db_path)
+        # WAL sticks to the db file, the writer thread's commits don't lock out reads here
+        s['DB_conn'].execute("PRAGMA journal_mode=WAL")
         s['DB_cusor'] = s['DB_conn'].cursor()
         s['DB_cusor'].execute('''
             CREATE TABLE IF NOT EXISTS smiles (
@@ -25,22 +162,84 @@ class DBmanager:
                 capture_time TEXT NOT NULL
             )
         ''')
+        # where the smile's crop went (file path or crop segment location), NULL for rows from before
+        s['DB_cusor'].execute("PRAGMA table_info(smiles)")
+        if "crop" not in {row[1] for row in s['DB_cusor'].fetchall()}:
+            s['DB_cusor'].execute("ALTER TABLE smiles ADD COLUMN crop TEXT")
+        # analytics reads (Smile_queries): per face counts / ranges, and time ranges / histograms over all faces
+        s['DB_cusor'].execute("CREATE INDEX IF NOT EXISTS idx_smiles_face_time ON smiles (face_id, capture_time)")
+        s['DB_cusor'].execute("CREATE INDEX IF NOT EXISTS idx_smiles_time ON smiles (capture_time)")
+        # retention: oldest crops first, and which rows point into a crop segment (partial, rows with a crop only)
+        s['DB_cusor'].execute("CREATE INDEX IF NOT EXISTS idx_smiles_crop_time ON smiles (capture_time) WHERE crop IS NOT NULL")
+        s['DB_cusor'].execute("CREATE INDEX IF NOT EXISTS idx_smiles_crop ON smiles (crop) WHERE crop IS NOT NULL")
+        # smiles past the retention age, folded into per face per hour counts
+        s['DB_cusor'].execute('''
+            CREATE TABLE IF NOT EXISTS smile_rollups (
+                face_id INTEGER NOT NULL,
+                hour TEXT NOT NULL,
+                smiles INTEGER NOT NULL,
+                PRIMARY KEY (face_id, hour)
+            ) WITHOUT ROWID
+        ''')
+        s['DB_cusor'].execute("CREATE INDEX IF NOT EXISTS idx_rollups_hour ON smile_rollups (hour)")
+        # one row per recorded face, kept up to date by the writer so summaries never scan smiles
+        s['DB_cusor'].execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='faces'")
+        backfill = s['DB_cusor'].fetchone() is None
+        s['DB_cusor'].execute('''
+            CREATE TABLE IF NOT EXISTS faces (
+                face_id INTEGER PRIMARY KEY,
+                first_seen TEXT NOT NULL,
+                last_seen TEXT NOT NULL,
+                smile_count INTEGER NOT NULL DEFAULT 0,
+                crop_path TEXT,
+                smiling_s REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        if backfill:
+            self.backfill_faces(images_dir)
         s['DB_conn'].commit()
-        s['DB_cusor'].execute("SELECT MAX(face_id) FROM smiles")
-        s['next_face_id'] = s['DB_cusor'].fetchone()[0]
+        s['DB_cusor'].execute("SELECT MAX(face_id) FROM faces") # rowid, no scan
+        last_face_id = s['DB_cusor'].fetchone()[0]
+        s['next_face_id'] = last_face_id + 1 if last_face_id is not None else None
 
-    def log_smilemeta_to_db(self, face_id):
-        '''Logs a smile event 
-        Only meta data is the Face and time'''
-        timestamp = datetime.datetime.now().isoformat()
+    def backfill_faces(self, images_dir):
+        '''One time, for a db from before the faces table (durations weren't recorded back then)'''
         s = self.state
-        s['DB_cusor'].execute("INSERT INTO smiles (face_id, capture_time) VALUES (?, ?)", (face_id, timestamp))
-        s['DB_conn'].commit()
+        s['DB_cusor'].execute('''
+            INSERT INTO faces (face_id, first_seen, last_seen, smile_count)
+            SELECT face_id, MIN(capture_time), MAX(capture_time), COUNT(*) FROM smiles GROUP BY face_id
+        ''')
+        s['DB_cusor'].execute("SELECT face_id FROM faces")
+        crops = [(path, face_id) for (face_id,) in s['DB_cusor'].fetchall()
+                 for path in [os.path.join(images_dir, str(face_id), "face.jpg")] if os.path.exists(path)]
+        s['DB_cusor'].executemany("UPDATE faces SET crop_path = ? WHERE face_id = ?", crops)
+
+    def log_smilemeta_to_db(self, face_id, smiling_s=0.0, crop=None):
+        '''Logs a smile event
+        Only meta data is the Face and time, queued for the writer thread (see flush)
+        smiling_s: how long the face smiled since its previous logged smile, summed up in faces
+        crop: crop store location of the smile crop'''
+        timestamp = datetime.datetime.now().isoformat()
+        self.Writer.log(("smile", face_id, timestamp, smiling_s, crop))
+
+    def log_face_crop(self, face_id, location):
+        '''The confirmed face crop got saved, faces.crop_path points at it'''
+        self.Writer.log(("crop", face_id, datetime.datetime.now().isoformat(), 0.0, location))
+
+    def flush(self, timeout=5.0):
+        '''Wait for every logged smile to be committed'''
+        return self.Writer.flush(timeout)
+
+    def stats(self):
+        return self.Writer.stats()
 
     def cleanup_resources(self):
         """Clean up all resources before exit"""
         s = self.state
         DB_conn = s['DB_conn']
+        # last batch goes in before the connection closes
+        self.Writer.close()
+        print(f"Smile writer stopped ({self.Writer.state['smiles_written']} smiles written, {self.Writer.state['failed']} rows failed).")
         # Close database connection
         if DB_conn:
             DB_conn.close()
@@ -0,0 +1,200 @@
+import struct
+
+import numpy as np
+
+# Binary face frame, little endian, for /controls clients that asked for format=binary
+#   header   16 B: u8 type, u8 version, u16 face count, u16 landmarks per face, u16 removed count, f64 ts
+#   records  24 B per face, 12 x int16: id_lo, id_hi (u16 halves), face box x4, smile box x4, status, reserved
+#   landmarks  count * landmarks per face * (x, y) int16, pixels
+#   removed  (delta frames only) removed count * (id_lo, id_hi) u16
+# everything is 2-byte aligned so the browser reads it with Int16Array views, no per-field parsing
+FACE_FRAME = 1 # keyframe, the full face list
+FACE_DELTA = 2 # only faces that were added / changed, plus removed ids
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("<BBHHHd")
+RECORD = struct.Struct("<HH10h")
+RECORD_FIELDS = 12
+FORMATS = ("json", "binary")
+STATUS_CODES = {"Detecting...": 0, "Smiling": 1, "Not Smiling": 2, "Tilted": 3, "Occluded": 4}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+NO_BOX = (-1, -1, -1, -1)
+
+
+def parse_format(value, default="json"):
+    return value if value in FORMATS else default
+
+
+def _json_rows(faces, landmarks):
+    compact = []
+    for face_id, f in faces.items():
+        row = [face_id, *f['face_bbox'], *(f.get('smile_bbox') or NO_BOX), f['smile_status']]
+        if landmarks is not None:
+            row.append(landmarks[face_id].tolist())
+        compact.append(row)
+    return compact
+
+
+def faces_json(tracked_faces, ts, landmarks=None):
+    '''The original {"t": "f"} message, landmarks = {face_id: (L, 2) px array} or None'''
+    return {"t": "f", "ts": ts, "f": _json_rows(tracked_faces, landmarks)}
+
+
+def delta_json(changed, removed, ts, landmarks=None):
+    '''{"t": "d"}: full rows for added / changed faces in "f", removed ids in "r"'''
+    return {"t": "d", "ts": ts, "f": _json_rows(changed, landmarks), "r": list(removed)}
+
+
+def _i16(v):
+    return min(max(int(v), -32768), 32767)
+
+
+def _pack(kind, faces, ts, landmarks, removed=()):
+    count = len(faces)
+    per_face = len(next(iter(landmarks.values()))) if landmarks and count else 0
+    parts = [HEADER.pack(kind, PROTOCOL_VERSION, count, per_face, len(removed), ts)]
+    for face_id, f in faces.items():
+        boxes = (*f['face_bbox'], *(f.get('smile_bbox') or NO_BOX))
+        parts.append(RECORD.pack(face_id & 0xFFFF, (face_id >> 16) & 0xFFFF, *map(_i16, boxes),
+                                 STATUS_CODES.get(f['smile_status'], 0), 0))
+    if per_face:
+        points = np.stack([landmarks[face_id] for face_id in faces])
+        parts.append(np.clip(points, -32768, 32767).astype("<i2").tobytes())
+    if removed:
+        parts.append(struct.pack(f"<{2 * len(removed)}H", *(half for face_id in removed
+                                                            for half in (face_id & 0xFFFF, (face_id >> 16) & 0xFFFF))))
+    return b"".join(parts)
+
+
+def faces_binary(tracked_faces, ts, landmarks=None):
+    '''Same content as faces_json packed into the layout above'''
+    return _pack(FACE_FRAME, tracked_faces, ts, landmarks)
+
+
+def delta_binary(changed, removed, ts, landmarks=None):
+    '''Same content as delta_json'''
+    return _pack(FACE_DELTA, changed, ts, landmarks, removed)
+
+
+def _unpack(data, expected_kind):
+    kind, version, count, per_face, removed_count, ts = HEADER.unpack_from(data)
+    if kind != expected_kind or version != PROTOCOL_VERSION:
+        raise ValueError(f"expected type {expected_kind} v{PROTOCOL_VERSION}: got type {kind} version {version}")
+    records = np.frombuffer(data, dtype="<i2", count=count * RECORD_FIELDS, offset=HEADER.size).reshape(count, RECORD_FIELDS)
+    points = np.frombuffer(data, dtype="<i2", count=count * per_face * 2,
+                           offset=HEADER.size + records.nbytes).reshape(count, per_face, 2)
+    ids = records[:, :2].view(np.uint16).astype(np.int64)
+    rows = []
+    for i in range(count):
+        row = [int(ids[i, 0] | (ids[i, 1] << 16)), *records[i, 2:10].tolist(), STATUS_NAMES.get(int(records[i, 10]), "")]
+        if per_face:
+            row.append(points[i].tolist())
+        rows.append(row)
+    removed = np.frombuffer(data, dtype="<u2", count=removed_count * 2,
+                            offset=HEADER.size + records.nbytes + points.nbytes).reshape(-1, 2).astype(np.int64)
+    return ts, rows, [int(lo | (hi << 16)) for lo, hi in removed]
+
+
+def decode_faces_binary(data):
+    '''Back to (ts, rows like faces_json), for tests and tools'''
+    ts, rows, _ = _unpack(data, FACE_FRAME)
+    return ts, rows
+
+
+def decode_delta_binary(data):
+    '''(ts, changed rows, removed ids)'''
+    return _unpack(data, FACE_DELTA)
+
+
+class FaceDelta:
+    '''
+    Decides what a face update has to carry. Keeps the face list as last transmitted (the baseline),
+    a face goes out again only when it's new, its status changed, or a box / landmark moved more than
+    FACE_DELTA_TOLERANCE_PX from what clients already have. Full keyframe every FACE_KEYFRAME_EVERY updates.
+    Clients that join late get keyframe() - the baseline - so they're in sync with everyone else's deltas.
+    '''
+    def __init__(self, parent):
+        self.parent = parent
+        self.state = {
+            "faces": {}, # face_id -> {face_bbox, smile_bbox, smile_status} as transmitted
+            "landmarks": None, # face_id -> (L, 2) px as transmitted, None while landmarks are off
+            "since_keyframe": 0,
+            "keyframes": 0,
+            "deltas": 0,
+            "empty": 0, # updates with nothing to send
+            "faces_sent": 0,
+            "faces_suppressed": 0,
+        }
+
+    @staticmethod
+    def moved(old, new, tol):
+        if isinstance(new, np.ndarray):
+            return old.shape != new.shape or bool(np.abs(old - new).max(initial=0) > tol)
+        return any(abs(a - b) > tol for a, b in zip(old, new))
+
+    def changed(self, face_id, face, landmarks, tol):
+        s = self.state
+        old = s['faces'].get(face_id)
+        if old is None or old['smile_status'] != face['smile_status']:
+            return True
+        if (old['smile_bbox'] is None) != (face['smile_bbox'] is None):
+            return True
+        if self.moved(old['face_bbox'], face['face_bbox'], tol):
+            return True
+        if face['smile_bbox'] is not None and self.moved(old['smile_bbox'], face['smile_bbox'], tol):
+            return True
+        return landmarks is not None and self.moved(s['landmarks'].get(face_id), landmarks[face_id], tol)
+
+    def update(self, tracked_faces, landmarks=None):
+        '''
+        Returns (keyframe, faces, landmarks, removed ids): the full list on a keyframe,
+        otherwise only what changed, and the baseline moves to what was sent
+        '''
+        s = self.state
+        c = self.parent.controls
+        current = {face_id: {"face_bbox": tuple(f['face_bbox']), "smile_bbox": f.get('smile_bbox') or None,
+                             "smile_status": f['smile_status']}
+                   for face_id, f in tracked_faces.items()}
+        keyframe = (not c.get('FACE_DELTA', True) or s['keyframes'] == 0
+                    or s['since_keyframe'] + 1 >= c.get('FACE_KEYFRAME_EVERY', 30)
+                    or (landmarks is None) != (s['landmarks'] is None))
+        if keyframe:
+            s['faces'] = current
+            s['landmarks'] = dict(landmarks) if landmarks is not None else None
+            s['since_keyframe'] = 0
+            s['keyframes'] += 1
+            s['faces_sent'] += len(current)
+            return True, current, landmarks, []
+
+        tol = c.get('FACE_DELTA_TOLERANCE_PX', 2)
+        changed = {face_id: face for face_id, face in current.items() if self.changed(face_id, face, landmarks, tol)}
+        removed = [face_id for face_id in s['faces'] if face_id not in current]
+        s['faces'].update(changed)
+        for face_id in removed:
+            del s['faces'][face_id]
+        changed_landmarks = None
+        if landmarks is not None:
+            changed_landmarks = {face_id: landmarks[face_id] for face_id in changed}
+            s['landmarks'].update(changed_landmarks)
+            for face_id in removed:
+                s['landmarks'].pop(face_id, None)
+        s['since_keyframe'] += 1
+        s['deltas'] += 1
+        s['empty'] += not changed and not removed
+        s['faces_sent'] += len(changed)
+        s['faces_suppressed'] += len(current) - len(changed)
+        return False, changed, changed_landmarks, removed
+
+    def keyframe(self):
+        '''(faces, landmarks) as clients currently have them'''
+        return self.state['faces'], self.state['landmarks']
+
+    def stats(self):
+        s = self.state
+        total = s['faces_sent'] + s['faces_suppressed']
+        return {
+            "enabled": self.parent.controls.get('FACE_DELTA', True),
+            "keyframes": s['keyframes'],
+            "deltas": s['deltas'],
+            "empty_deltas": s['empty'],
+            "suppressed_ratio": round(s['faces_suppressed'] / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,146 @@
+import numpy as np
+
+# cost given to pairs outside the gate, big enough that the solver only uses them when forced
+GATED_COST = 1e6
+
+
+class MotionModel:
+    '''
+    Constant velocity Kalman filter on a face center, state = [x, y, vx, vy] in normalized frame units / second.
+    predict(ts) says where the face should be now, update(center, ts) folds in a detection.
+    '''
+    def __init__(self, center, ts, accel_noise=2.0, measure_noise=0.01):
+        self.x = np.array([center[0], center[1], 0.0, 0.0], dtype=np.float64)
+        # position is known, velocity is a guess until the second detection
+        self.P = np.diag([measure_noise**2, measure_noise**2, 1.0, 1.0])
+        self.accel_noise = accel_noise
+        self.R = np.eye(2) * measure_noise**2
+        self.H = np.array([[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0]])
+        self.ts = ts
+
+    def _advance(self, ts):
+        dt = max(0.0, ts - self.ts)
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        # white acceleration noise
+        q = self.accel_noise**2
+        dt2, dt3, dt4 = dt * dt, dt**3 / 2, dt**4 / 4
+        Q = q * np.array([[dt4, 0, dt3, 0], [0, dt4, 0, dt3], [dt3, 0, dt2, 0], [0, dt3, 0, dt2]])
+        return F @ self.x, F @ self.P @ F.T + Q
+
+    def predict(self, ts):
+        '''Predicted center at ts, doesn't change the filter'''
+        x, _ = self._advance(ts)
+        return x[:2].copy()
+
+    def update(self, center, ts):
+        x, P = self._advance(ts)
+        innovation = np.asarray(center, dtype=np.float64) - self.H @ x
+        S = self.H @ P @ self.H.T + self.R
+        K = P @ self.H.T @ np.linalg.inv(S)
+        self.x = x + K @ innovation
+        self.P = (np.eye(4) - K @ self.H) @ P
+        self.ts = ts
+        return self.x[:2].copy()
+
+    @property
+    def velocity(self):
+        return self.x[2:].copy()
+
+
+def predict_bbox(face_bbox, last_center, predicted_center, w, h):
+    '''Shifts the last seen box by the predicted center move, in pixels'''
+    dx = int(round((predicted_center[0] - last_center[0]) * w))
+    dy = int(round((predicted_center[1] - last_center[1]) * h))
+    x1, y1, x2, y2 = face_bbox
+    return (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+
+
+def linear_assignment(cost):
+    '''
+    Optimal (minimum total cost) one to one assignment, Hungarian / Kuhn-Munkres with potentials.
+    cost = (R, C) array, returns a list of (row, col) pairs, min(R, C) long.
+    Only a handful of faces per frame so O(n^3) in plain python is plenty.
+    '''
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return []
+    cost = cost.tolist()
+    # 1-indexed rows/cols, column 0 is the virtual start
+    u = [0.0] * (n + 1)
+    v = [0.0] * (m + 1)
+    owner = [0] * (m + 1) # row assigned to each column
+    way = [0] * (m + 1)
+    for row in range(1, n + 1):
+        owner[0] = row
+        col0 = 0
+        min_slack = [float('inf')] * (m + 1)
+        used = [False] * (m + 1)
+        while True:
+            used[col0] = True
+            row0 = owner[col0]
+            delta = float('inf')
+            col1 = 0
+            for col in range(1, m + 1):
+                if not used[col]:
+                    slack = cost[row0 - 1][col - 1] - u[row0] - v[col]
+                    if slack < min_slack[col]:
+                        min_slack[col] = slack
+                        way[col] = col0
+                    if min_slack[col] < delta:
+                        delta = min_slack[col]
+                        col1 = col
+            for col in range(m + 1):
+                if used[col]:
+                    u[owner[col]] += delta
+                    v[col] -= delta
+                else:
+                    min_slack[col] -= delta
+            col0 = col1
+            if owner[col0] == 0:
+                break
+        # walk the augmenting path back
+        while col0:
+            col1 = way[col0]
+            owner[col0] = owner[col1]
+            col0 = col1
+    pairs = [(owner[col] - 1, col - 1) for col in range(1, m + 1) if owner[col]]
+    if transposed:
+        pairs = [(col, row) for row, col in pairs]
+    return sorted(pairs)
+
+
+def iou_matrix(boxes_a, boxes_b):
+    '''(A, 4) x (B, 4) boxes as (x_min, y_min, x_max, y_max) -> (A, B) intersection over union'''
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    ix = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = ix * iy
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+
+
+def match_faces(track_centers, track_boxes, face_centers, face_boxes, gate, iou_weight=0.1):
+    '''
+    Matches detections to tracks, each used at most once.
+    cost = normalized center distance + iou_weight * (1 - IoU), pairs with distance >= gate never match.
+    Returns (matches [(track_idx, face_idx)], unmatched face indices)
+    '''
+    n_tracks, n_faces = len(track_centers), len(face_centers)
+    if n_tracks == 0 or n_faces == 0:
+        return [], list(range(n_faces))
+    dist = np.linalg.norm(np.asarray(track_centers, dtype=np.float64)[:, None, :] -
+                          np.asarray(face_centers, dtype=np.float64)[None, :, :], axis=2)
+    cost = dist + iou_weight * (1.0 - iou_matrix(track_boxes, face_boxes))
+    allowed = dist < gate
+    cost = np.where(allowed, cost, GATED_COST)
+    matches = [(t, f) for t, f in linear_assignment(cost) if allowed[t, f]]
+    matched = {f for _, f in matches}
+    return matches, [f for f in range(n_faces) if f not in matched]
@@ -0,0 +1,170 @@
+import time
+
+import cv2
+import numpy as np
+
+from Face_tracker import linear_assignment
+
+LK_PARAMS = {
+    "winSize": (15, 15),
+    "maxLevel": 2,
+    "criteria": (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+}
+
+
+def flow_landmarks(prev_gray, gray, landmarks, w, h):
+    '''
+    Moves (K, N, 3) normalized landmarks from prev_gray to gray with pyramidal Lucas-Kanade.
+    Points LK loses follow the median move of their face. z is carried over.
+    Returns (moved landmarks, per face fraction of points tracked, median move in px per face)
+    '''
+    if len(landmarks) == 0:
+        return landmarks, np.ones(0), np.zeros(0)
+    k, n, _ = landmarks.shape
+    p0 = (landmarks[:, :, :2].reshape(-1, 1, 2) * np.array((w, h), dtype=np.float32)).astype(np.float32)
+    p1, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, p0, None, **LK_PARAMS)
+    p0, p1 = p0.reshape(k, n, 2), p1.reshape(k, n, 2)
+    good = status.reshape(k, n).astype(bool)
+    # drop points that ran off the frame
+    good &= (p1[..., 0] >= 0) & (p1[..., 0] < w) & (p1[..., 1] >= 0) & (p1[..., 1] < h)
+    confidence = good.mean(axis=1)
+    moves = np.zeros(k)
+    for face in range(k):
+        if good[face].any():
+            shift = np.median(p1[face][good[face]] - p0[face][good[face]], axis=0)
+        else:
+            shift = np.zeros(2, dtype=np.float32)
+        p1[face][~good[face]] = p0[face][~good[face]] + shift
+        moves[face] = float(np.hypot(*shift))
+    moved = landmarks.copy()
+    moved[:, :, :2] = p1 / np.array((w, h), dtype=np.float32)
+    return moved, confidence, moves
+
+
+def landmark_error_px(predicted, detected, w, h):
+    '''Mean landmark distance in px between two sets of faces, faces paired by closest centers'''
+    if len(predicted) == 0 or len(detected) == 0:
+        return None
+    scale = np.array((w, h), dtype=np.float64)
+    pred_px = predicted[:, :, :2].astype(np.float64) * scale
+    det_px = detected[:, :, :2].astype(np.float64) * scale
+    centers = np.linalg.norm(pred_px.mean(axis=1)[:, None] - det_px.mean(axis=1)[None], axis=2)
+    errors = [np.linalg.norm(pred_px[p] - det_px[d], axis=1).mean() for p, d in linear_assignment(centers)]
+    return float(np.mean(errors))
+
+
+class FlowTracker:
+    '''
+    Detect-then-track: full FaceMesh every K frames (or when tracking confidence drops),
+    landmarks carried by optical flow in between. Hands are re-used from the last detection.
+    K follows face motion and the loop budget, see update_k.
+    '''
+    def __init__(self, parent):
+        self.parent = parent
+        self.state = {
+            "prev_gray": None,
+            "landmarks": None, # last faces handed out, (K, 478, 3) normalized
+            "hands": None,
+            "since_detect": 0,
+            "k": 1,
+            "motion_px": 0.0,
+            "detect_ms": 0.0,
+            "flow_ms": 0.0,
+            "confidence": 1.0,
+            "flow_error_px": None,
+            "error_samples": 0,
+            "detect_frames": 0,
+            "flow_frames": 0,
+            "forced_detects": 0,
+        }
+
+    def reset(self):
+        self.state['prev_gray'] = None
+        self.state['landmarks'] = None
+        self.state['since_detect'] = 0
+
+    def needs_detection(self):
+        s = self.state
+        # nobody in the last detection: keep detecting so someone walking in is picked up right away
+        return (s['prev_gray'] is None or s['landmarks'] is None or len(s['landmarks']) == 0
+                or s['since_detect'] + 1 >= s['k'])
+
+    @staticmethod
+    def _ema(old, new, first):
+        return new if first else 0.8 * old + 0.2 * new
+
+    def track(self, gray, w, h):
+        '''Flow frame, returns the moved faces or None if tracking is too unsure (caller should detect)'''
+        s = self.state
+        c = self.parent.controls
+        t0 = time.perf_counter()
+        moved, confidence, moves = flow_landmarks(s['prev_gray'], gray, s['landmarks'], w, h)
+        s['flow_ms'] = self._ema(s['flow_ms'], (time.perf_counter() - t0) * 1000, s['flow_frames'] == 0)
+        s['confidence'] = float(confidence.min()) if len(confidence) else 1.0
+        if s['confidence'] < c.get('FLOW_MIN_CONFIDENCE', 0.8):
+            s['forced_detects'] += 1
+            return None
+        if len(moves):
+            s['motion_px'] = self._ema(s['motion_px'], float(moves.max()), False)
+        s['prev_gray'] = gray
+        s['landmarks'] = moved
+        s['since_detect'] += 1
+        s['flow_frames'] += 1
+        return moved
+
+    def observe_detection(self, gray, faces, hands, detect_ms, w, h):
+        '''Detection frame: score how far flow alone would have been off, then re-seed from the detection'''
+        s = self.state
+        if s['prev_gray'] is not None and s['landmarks'] is not None and len(s['landmarks']):
+            predicted, _, moves = flow_landmarks(s['prev_gray'], gray, s['landmarks'], w, h)
+            error = landmark_error_px(predicted, faces, w, h)
+            if error is not None:
+                s['flow_error_px'] = self._ema(s['flow_error_px'], error, s['error_samples'] == 0)
+                s['error_samples'] += 1
+            if len(moves):
+                s['motion_px'] = self._ema(s['motion_px'], float(moves.max()), False)
+        s['detect_ms'] = self._ema(s['detect_ms'], detect_ms, s['detect_frames'] == 0)
+        s['prev_gray'] = gray
+        s['landmarks'] = faces
+        s['hands'] = hands
+        s['since_detect'] = 0
+        s['detect_frames'] += 1
+        self.update_k()
+
+    def update_k(self):
+        '''
+        Budget: smallest K whose average frame cost (detect + (K-1) flows) / K fits 1 / FLOW_TARGET_FPS.
+        Motion: the faster faces move the sooner flow drifts, K <= FLOW_MOTION_PX / per frame motion.
+        Budget asks for the K, motion caps it.
+        '''
+        s = self.state
+        c = self.parent.controls
+        max_k = c.get('FLOW_MAX_K', 6)
+        budget_ms = 1000.0 / c.get('FLOW_TARGET_FPS', 24)
+        detect_ms, flow_ms = s['detect_ms'], s['flow_ms']
+        if detect_ms <= budget_ms:
+            k_budget = 1
+        elif flow_ms >= budget_ms:
+            k_budget = max_k
+        else:
+            k_budget = int(np.ceil((detect_ms - flow_ms) / (budget_ms - flow_ms)))
+        k_motion = int(c.get('FLOW_MOTION_PX', 12.0) / max(s['motion_px'], 1e-3))
+        s['k'] = int(min(max(min(k_budget, k_motion), 1), max_k))
+
+    def stats(self):
+        s = self.state
+        c = self.parent.controls
+        return {
+            "enabled": c.get('FLOW_TRACKING', False),
+            "k": s['k'],
+            "detect_frames": s['detect_frames'],
+            "flow_frames": s['flow_frames'],
+            "forced_detects": s['forced_detects'],
+            "confidence": round(s['confidence'], 3),
+            "motion_px": round(s['motion_px'], 3),
+            "detect_ms": round(s['detect_ms'], 3),
+            "flow_ms": round(s['flow_ms'], 3),
+            # mean landmark error of flow vs full detection, measured on detection frames
+            "flow_error_px": round(s['flow_error_px'], 3) if s['flow_error_px'] is not None else None,
+            "error_samples": s['error_samples'],
+        }
@@ -0,0 +1,195 @@
+import asyncio
+import time
+from collections import deque
+
+
+class LatestQueue:
+    '''Small bounded queue between two pipeline stages.
+    drop policy when full:
+        "oldest" -> evict the queued item, newest frame wins (default)
+        "newest" -> refuse the incoming item, keep what is queued
+        "block"  -> producer waits for room (classic backpressure)
+    on_drop(item) is called for every evicted / refused item (e.g. to give back a frame buffer)
+    '''
+    DROP_POLICIES = ("oldest", "newest", "block")
+
+    def __init__(self, depth=1, drop="oldest", on_drop=None):
+        if depth < 1:
+            raise ValueError(f"Queue depth must be >= 1, got {depth}")
+        if drop not in self.DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop}")
+        self.depth = depth
+        self.drop = drop
+        self.items = deque()
+        self.dropped = 0
+        self.on_drop = on_drop
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def __len__(self):
+        return len(self.items)
+
+    async def put(self, item):
+        '''Returns False if the item was refused'''
+        while len(self.items) >= self.depth:
+            if self.drop == "oldest":
+                self._dropped(self.items.popleft())
+            elif self.drop == "newest":
+                self._dropped(item)
+                return False
+            else:
+                self._not_full.clear()
+                await self._not_full.wait()
+        self.items.append(item)
+        self._not_empty.set()
+        return True
+
+    def put_nowait(self, item):
+        '''put for the non blocking policies, callers that must never wait (e.g. network fan-out)'''
+        if self.drop == "block":
+            raise RuntimeError("put_nowait needs the oldest or newest drop policy")
+        if len(self.items) >= self.depth:
+            if self.drop == "newest":
+                self._dropped(item)
+                return False
+            self._dropped(self.items.popleft())
+        self.items.append(item)
+        self._not_empty.set()
+        return True
+
+    def _dropped(self, item):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(item)
+
+    async def get(self):
+        while not self.items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        item = self.items.popleft()
+        self._not_full.set()
+        return item
+
+
+class FramePipeline:
+    '''
+    Runs the frame stages (capture -> inference -> tracking -> annotate -> encode -> fanout)
+    as separate tasks joined by LatestQueues, so frame N+1 can be inferred while frame N is encoded/sent.
+    Each stage is func(packet) -> packet or None (None = drop this frame). The first stage gets None.
+    Blocking stages marked "thread" in the config run in a worker thread to keep the event loop free.
+    '''
+    def __init__(self, parent):
+        self.parent = parent
+        self.state = {
+            "stats": {},
+            "queues": {},
+            "started_ts": None,
+            "frames_out": 0,
+        }
+
+    @staticmethod
+    def default_config():
+        # depth/drop apply to each stage's input queue, capture has none
+        return {
+            "enabled": True,
+            "stages": {
+                "capture": {"thread": False},
+                "inference": {"depth": 1, "drop": "oldest", "thread": False}, # backend decides where models run
+                "tracking": {"depth": 1, "drop": "oldest", "thread": False},
+                "annotate": {"depth": 1, "drop": "oldest", "thread": True},
+                "encode": {"depth": 1, "drop": "oldest", "thread": True},
+                "fanout": {"depth": 1, "drop": "oldest", "thread": False},
+            },
+        }
+
+    async def run(self, stages, on_done=None):
+        '''
+        stages: ordered list of (name, func). Runs until shutdown_event is set or a stage raises.
+        on_done(packet) is called once for every packet that leaves: through the last stage, dropped by a queue,
+        or turned into None by a stage
+        '''
+        s = self.parent.state
+        config = s['pipeline']['stages']
+        self.state['stats'] = {}
+        self.state['queues'] = {}
+        self.state['started_ts'] = time.time()
+        self.state['frames_out'] = 0
+
+        tasks = []
+        inbox = None
+        for i, (name, func) in enumerate(stages):
+            stage_cfg = config.get(name, {})
+            outbox = None
+            if i + 1 < len(stages):
+                next_name = stages[i + 1][0]
+                next_cfg = config.get(next_name, {})
+                outbox = LatestQueue(next_cfg.get('depth', 1), next_cfg.get('drop', "oldest"), on_drop=on_done)
+                self.state['queues'][next_name] = outbox
+            self.state['stats'][name] = {"frames": 0, "avg_ms": 0.0, "busy_s": 0.0}
+            tasks.append(asyncio.create_task(
+                self._run_stage(name, func, inbox, outbox, stage_cfg.get('thread', False), on_done)))
+            inbox = outbox
+
+        shutdown = asyncio.create_task(s['shutdown_event'].wait())
+        try:
+            done, _ = await asyncio.wait(tasks + [shutdown], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is not shutdown and not task.cancelled() and task.exception():
+                    raise task.exception()
+        finally:
+            for task in tasks + [shutdown]:
+                task.cancel()
+            await asyncio.gather(*tasks, shutdown, return_exceptions=True)
+
+    async def _run_stage(self, name, func, inbox, outbox, in_thread, on_done=None):
+        stats = self.state['stats'][name]
+        is_async = asyncio.iscoroutinefunction(func)
+        while True:
+            packet = await inbox.get() if inbox is not None else None
+            incoming = packet
+            t0 = time.perf_counter()
+            try:
+                if is_async:
+                    packet = await func(packet)
+                elif in_thread and not (packet and name in packet.get('inline_stages', ())):
+                    packet = await asyncio.to_thread(func, packet)
+                else:
+                    packet = func(packet)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error in pipeline stage {name}: {e}")
+                raise
+            dt = time.perf_counter() - t0
+            stats['frames'] += 1
+            stats['busy_s'] += dt
+            # EMA so the debug view follows load changes
+            stats['avg_ms'] = dt * 1000 if stats['frames'] == 1 else 0.9 * stats['avg_ms'] + 0.1 * dt * 1000
+            if packet is None:
+                if incoming is not None and on_done is not None:
+                    on_done(incoming)
+                continue
+            if outbox is not None:
+                await outbox.put(packet)
+            else:
+                self.state['frames_out'] += 1
+                if on_done is not None:
+                    on_done(packet)
+
+    def stats(self):
+        '''Per stage timing / drops for the debug endpoint'''
+        started = self.state['started_ts']
+        elapsed = time.time() - started if started else 0.0
+        return {
+            "fps": self.state['frames_out'] / elapsed if elapsed > 0 else 0.0,
+            "stages": {
+                name: {
+                    "frames": st['frames'],
+                    "avg_ms": round(st['avg_ms'], 3),
+                    "queued": len(self.state['queues'][name]) if name in self.state['queues'] else 0,
+                    "dropped": self.state['queues'][name].dropped if name in self.state['queues'] else 0,
+                }
+                for name, st in self.state['stats'].items()
+            },
+        }
@@ -0,0 +1,132 @@
+import numpy as np
+
+
+class FrameSlot:
+    '''
+    One frame's worth of preallocated buffers (raw capture, flipped frame, pristine copy, rgb), made on first use
+    and reused while the frame size stays the same. generation moves every time the slot is handed out again.
+    '''
+    def __init__(self, index):
+        self.index = index
+        self.buffers = {}
+        self.refs = 0
+        self.generation = 0
+
+    def buffer(self, name, shape, ring_state=None):
+        buf = self.buffers.get(name)
+        if buf is None or buf.shape != shape:
+            buf = self.buffers[name] = np.empty(shape, dtype=np.uint8)
+            if ring_state is not None:
+                ring_state['allocations'] += 1
+        return buf
+
+    def ref(self, name):
+        return FrameRef(self, name)
+
+
+class FrameRef:
+    '''
+    Read-only handle on one buffer of a ring slot as of a generation. Anything that keeps it past the
+    current frame (the crop workers) copies out with crop(), which gives None once the slot was recycled.
+    '''
+    __slots__ = ("slot", "name", "generation")
+
+    def __init__(self, slot, name):
+        self.slot = slot
+        self.name = name
+        self.generation = slot.generation
+
+    @property
+    def valid(self):
+        return self.slot.generation == self.generation
+
+    @property
+    def shape(self):
+        return self.slot.buffers[self.name].shape
+
+    def view(self):
+        '''Read-only view, only safe while the slot is held (i.e. inside the frame's own stages)'''
+        view = self.slot.buffers[self.name].view()
+        view.flags.writeable = False
+        return view
+
+    def crop(self, x1, y1, x2, y2):
+        '''Copy of a region, None if the slot was handed out again before or during the copy'''
+        if not self.valid:
+            return None
+        crop = self.slot.buffers[self.name][max(0, y1):y2, max(0, x1):x2].copy()
+        return crop if self.valid else None
+
+    def copy(self):
+        return self.crop(0, 0, self.shape[1], self.shape[0])
+
+
+def frame_ref(array):
+    '''Wraps a standalone array (e.g. /test-broadcast grabbing a frame) so it reads like a ring frame'''
+    slot = FrameSlot(-1)
+    slot.buffers['frame'] = array
+    return slot.ref('frame')
+
+
+class FrameRing:
+    '''
+    Fixed set of reusable frame slots so capture doesn't allocate ~3 full frames every iteration.
+    The pipeline holds a slot from capture until the packet leaves (done or dropped), latest_frame holds one more.
+    A slot is only handed out again once nothing holds it, if every slot is busy the ring grows by one
+    (only happens while the pipeline fills up, after that the set stays the same size and RSS stays flat).
+    '''
+    def __init__(self, parent, slots=4):
+        self.parent = parent
+        self.slots = [FrameSlot(i) for i in range(slots)]
+        self.state = {
+            "next": 0,
+            "latest": None, # slot latest_frame points into
+            "acquired": 0,
+            "allocations": 0, # buffer (re)allocations, should stop growing after the first frames
+            "grown": 0,
+        }
+
+    def acquire(self):
+        s = self.state
+        for i in range(len(self.slots)):
+            slot = self.slots[(s['next'] + i) % len(self.slots)]
+            if slot.refs == 0:
+                s['next'] = (slot.index + 1) % len(self.slots)
+                break
+        else:
+            slot = FrameSlot(len(self.slots))
+            self.slots.append(slot)
+            s['grown'] += 1
+        slot.refs = 1
+        slot.generation += 1
+        s['acquired'] += 1
+        return slot
+
+    def release(self, slot):
+        if slot is not None and slot.refs > 0:
+            slot.refs -= 1
+
+    def release_packet(self, packet):
+        '''Pipeline hook: a packet finished or was dropped'''
+        if packet:
+            self.release(packet.get('slot'))
+
+    def set_latest(self, ref):
+        '''latest_frame for the crop workers, keeps its slot from being reused until the next frame replaces it'''
+        s = self.state
+        if ref.slot is not s['latest']:
+            if ref.slot.index >= 0:
+                ref.slot.refs += 1
+            self.release(s['latest'])
+            s['latest'] = ref.slot if ref.slot.index >= 0 else None
+        self.parent.state['latest_frame'] = ref
+
+    def stats(self):
+        s = self.state
+        return {
+            "slots": len(self.slots),
+            "in_use": sum(1 for slot in self.slots if slot.refs),
+            "frames": s['acquired'],
+            "allocations": s['allocations'],
+            "grown": s['grown'],
+        }
@@ -0,0 +1,279 @@
+import asyncio
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+from concurrent.futures import ThreadPoolExecutor
+
+import mediapipe as mp
+import numpy as np
+
+# Same settings the models always ran with
+MODEL_OPTIONS = {
+    "face_mesh": {
+        "static_image_mode": False,
+        "max_num_faces": 3,
+        "refine_landmarks": True, #more accurate lips
+        "min_detection_confidence": 0.6,
+    },
+    "hands": {
+        "min_detection_confidence": 0.8,
+        "min_tracking_confidence": 0.7,
+    },
+}
+
+# For models fed unrelated images call to call (ROI crops): no tracking state carried between them
+STATIC_IMAGE_OPTIONS = {
+    "face_mesh": {"static_image_mode": True},
+    "hands": {"static_image_mode": True},
+}
+
+def build_model(kind, options=None):
+    opts = dict(MODEL_OPTIONS[kind])
+    if options and kind in options:
+        opts.update(options[kind])
+    if kind == "face_mesh":
+        return mp.solutions.face_mesh.FaceMesh(**opts)
+    return mp.solutions.hands.Hands(**opts)
+
+
+def run_model(model, kind, image):
+    '''Runs one model, returns a float32 (K, N, 3) array of normalized landmarks (K = detections)'''
+    results = model.process(image)
+    found = results.multi_face_landmarks if kind == "face_mesh" else results.multi_hand_landmarks
+    if not found:
+        return np.empty((0, 0, 3), dtype=np.float32)
+    return np.array([[(p.x, p.y, p.z) for p in lm.landmark] for lm in found], dtype=np.float32)
+
+
+class InProcessBackend:
+    '''Runs both models on the calling thread, i.e. blocks the event loop while inferring'''
+    name = "inprocess"
+
+    def __init__(self, options=None):
+        self.models = {kind: build_model(kind, options) for kind in MODEL_OPTIONS}
+        self.timings = {"calls": 0, "concurrent": False, "hands_ms": 0.0, "faces_ms": 0.0, "wall_ms": 0.0}
+
+    def _timed_run(self, kind, image):
+        if image is None:
+            return np.empty((0, 0, 3), dtype=np.float32), 0.0
+        t0 = time.perf_counter()
+        landmarks = run_model(self.models[kind], kind, image)
+        return landmarks, (time.perf_counter() - t0) * 1000
+
+    def _record(self, hands_ms, faces_ms, wall_ms, concurrent):
+        t = self.timings
+        t['calls'] += 1
+        t['concurrent'] = concurrent
+        for key, value in (("hands_ms", hands_ms), ("faces_ms", faces_ms), ("wall_ms", wall_ms)):
+            t[key] = value if t['calls'] == 1 else 0.9 * t[key] + 0.1 * value
+
+    def stats(self):
+        '''overlap_gain = (hands + faces) / wall, 1.0 when run back to back, up to 2.0 when fully overlapped'''
+        t = self.timings
+        return {
+            "backend": self.name,
+            "concurrent": t['concurrent'],
+            "hands_ms": round(t['hands_ms'], 3),
+            "faces_ms": round(t['faces_ms'], 3),
+            "wall_ms": round(t['wall_ms'], 3),
+            "overlap_gain": round((t['hands_ms'] + t['faces_ms']) / t['wall_ms'], 3) if t['wall_ms'] > 0 else 1.0,
+        }
+
+    def infer_sync(self, hands_image, faces_image, concurrent=False):
+        '''Either image may be None to skip that model. Returns (hands, faces) landmark arrays'''
+        t0 = time.perf_counter()
+        hands, hands_ms = self._timed_run("hands", hands_image)
+        faces, faces_ms = self._timed_run("face_mesh", faces_image)
+        self._record(hands_ms, faces_ms, (time.perf_counter() - t0) * 1000, False)
+        return hands, faces
+
+    async def infer(self, hands_image, faces_image, concurrent=False):
+        # nothing to overlap with on the event loop thread
+        return self.infer_sync(hands_image, faces_image)
+
+    def close(self):
+        for model in self.models.values():
+            try:
+                model.close()
+            except Exception:
+                pass
+
+
+class ThreadBackend(InProcessBackend):
+    '''
+    Same models, each on its own dedicated thread so the event loop keeps serving sockets.
+    Mediapipe runs its graph in native code, so hands and face mesh overlap when concurrent.
+    '''
+    name = "thread"
+
+    def __init__(self, options=None):
+        super().__init__(options)
+        # mediapipe graphs are not re-entrant, one thread owns each model
+        self.executors = {kind: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"inference-{kind}")
+                          for kind in MODEL_OPTIONS}
+
+    def _submit(self, kind, image):
+        return self.executors[kind].submit(self._timed_run, kind, image)
+
+    def infer_sync(self, hands_image, faces_image, concurrent=True):
+        t0 = time.perf_counter()
+        if concurrent:
+            hands_future, faces_future = self._submit("hands", hands_image), self._submit("face_mesh", faces_image)
+            (hands, hands_ms), (faces, faces_ms) = hands_future.result(), faces_future.result()
+        else:
+            hands, hands_ms = self._submit("hands", hands_image).result()
+            faces, faces_ms = self._submit("face_mesh", faces_image).result()
+        self._record(hands_ms, faces_ms, (time.perf_counter() - t0) * 1000, concurrent)
+        return hands, faces
+
+    async def infer(self, hands_image, faces_image, concurrent=True):
+        t0 = time.perf_counter()
+        if concurrent:
+            hands_future, faces_future = self._submit("hands", hands_image), self._submit("face_mesh", faces_image)
+            (hands, hands_ms), (faces, faces_ms) = await asyncio.gather(
+                asyncio.wrap_future(hands_future), asyncio.wrap_future(faces_future))
+        else:
+            hands, hands_ms = await asyncio.wrap_future(self._submit("hands", hands_image))
+            faces, faces_ms = await asyncio.wrap_future(self._submit("face_mesh", faces_image))
+        self._record(hands_ms, faces_ms, (time.perf_counter() - t0) * 1000, concurrent)
+        return hands, faces
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=True)
+        super().close()
+
+
+def _model_worker_main(kind, conn, options):
+    '''Worker process: owns one model, reads frames out of shared memory, replies with landmark arrays'''
+    model = build_model(kind, options)
+    segments = {}
+    try:
+        while True:
+            msg = conn.recv()
+            if msg is None:
+                break
+            shm_name, shape = msg
+            if shm_name not in segments:
+                # parent keeps at most two live segments (full frame + crop), older names were resized away
+                while len(segments) >= 2:
+                    segments.pop(next(iter(segments))).close()
+                # spawned workers share the parent's resource tracker, the parent unlinks on close
+                segments[shm_name] = shared_memory.SharedMemory(name=shm_name)
+            image = np.ndarray(shape, dtype=np.uint8, buffer=segments[shm_name].buf)
+            try:
+                t0 = time.perf_counter()
+                landmarks = run_model(model, kind, image)
+                conn.send(("ok", landmarks, (time.perf_counter() - t0) * 1000))
+            except Exception as e:
+                conn.send(("error", repr(e), 0.0))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for seg in segments.values():
+            seg.close()
+        model.close()
+
+
+class ProcessBackend(InProcessBackend):
+    '''
+    FaceMesh and Hands each live in their own worker process.
+    Frames are copied once into shared memory, only the shm name/shape and the compact
+    float32 landmark arrays cross the pipes. Both workers run at the same time when concurrent.
+    '''
+    name = "process"
+
+    def __init__(self, options=None):
+        ctx = multiprocessing.get_context("spawn")
+        self.workers = {}
+        for kind in MODEL_OPTIONS:
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_model_worker_main, args=(kind, child_conn, options),
+                               name=f"inference-{kind}", daemon=True)
+            proc.start()
+            child_conn.close()
+            self.workers[kind] = {"conn": parent_conn, "proc": proc}
+        self.segments = [None, None] # one per distinct image in a call
+        self.timings = {"calls": 0, "concurrent": False, "hands_ms": 0.0, "faces_ms": 0.0, "wall_ms": 0.0}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference-ipc")
+
+    def _write_frame(self, slot, image):
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        seg = self.segments[slot]
+        if seg is None or seg.size < image.nbytes:
+            if seg is not None:
+                seg.close()
+                seg.unlink()
+            seg = shared_memory.SharedMemory(create=True, size=image.nbytes)
+            self.segments[slot] = seg
+        np.ndarray(image.shape, dtype=np.uint8, buffer=seg.buf)[...] = image
+        return (seg.name, image.shape)
+
+    def _receive(self, kind):
+        try:
+            status, payload, model_ms = self.workers[kind]["conn"].recv()
+        except EOFError:
+            raise RuntimeError(f"{kind} inference worker exited")
+        if status != "ok":
+            raise RuntimeError(f"{kind} inference failed: {payload}")
+        return payload, model_ms
+
+    def _send(self, kind, frame_ref):
+        self.workers[kind]["conn"].send(frame_ref)
+
+    def infer_sync(self, hands_image, faces_image, concurrent=True):
+        empty = (np.empty((0, 0, 3), dtype=np.float32), 0.0)
+        results = {"hands": empty, "face_mesh": empty}
+        t0 = time.perf_counter()
+        if hands_image is not None:
+            self._send("hands", self._write_frame(0, hands_image))
+            if not concurrent:
+                results['hands'] = self._receive("hands")
+        if faces_image is not None:
+            if faces_image is hands_image:
+                frame_ref = (self.segments[0].name, np.shape(faces_image))
+            else:
+                frame_ref = self._write_frame(1, faces_image)
+            self._send("face_mesh", frame_ref)
+        if concurrent and hands_image is not None:
+            results['hands'] = self._receive("hands")
+        if faces_image is not None:
+            results['face_mesh'] = self._receive("face_mesh")
+        (hands, hands_ms), (faces, faces_ms) = results['hands'], results['face_mesh']
+        self._record(hands_ms, faces_ms, (time.perf_counter() - t0) * 1000, concurrent)
+        return hands, faces
+
+    async def infer(self, hands_image, faces_image, concurrent=True):
+        # the pipe wait is blocking, park it off the event loop
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.infer_sync, hands_image, faces_image, concurrent)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for worker in self.workers.values():
+            try:
+                worker["conn"].send(None)
+            except Exception:
+                pass
+            worker["proc"].join(timeout=2.0)
+            if worker["proc"].is_alive():
+                worker["proc"].terminate()
+            worker["conn"].close()
+        for seg in self.segments:
+            if seg is not None:
+                seg.close()
+                seg.unlink()
+        self.segments = [None, None]
+
+
+BACKENDS = {
+    InProcessBackend.name: InProcessBackend,
+    ThreadBackend.name: ThreadBackend,
+    ProcessBackend.name: ProcessBackend,
+}
+
+
+def create_backend(name, options=None):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {name!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name](options)
@@ -0,0 +1,335 @@
+import asyncio
+import collections
+import datetime
+import os
+import sqlite3
+import threading
+import time
+
+from Crop_store import compact_segment, segment_refs
+
+ROLLUP_UPSERT = '''
+    INSERT INTO smile_rollups (face_id, hour, smiles) VALUES (?, ?, ?)
+    ON CONFLICT (face_id, hour) DO UPDATE SET smiles = smiles + excluded.smiles
+'''
+# written into images/ once the crops from before smiles.crop existed are matched to their rows
+ADOPTED_MARKER = ".retention_adopted"
+ADOPT_TOLERANCE = datetime.timedelta(seconds=1) # old worker: file stamped, imwrite, then the row logged
+
+
+def hour_of(capture_time):
+    '''"2026-03-01T12:34:56.789" -> "2026-03-01T12:00:00", the start of its hour bucket like Smile_queries' edges'''
+    return capture_time[:13] + ":00:00"
+
+
+class RetentionService:
+    '''
+    Keeps server/data within RETENTION_MAX_AGE_DAYS and RETENTION_DISK_BUDGET_MB (0 = no limit), a pass every interval_s:
+      adopt:   once, directory store only: smile crops saved before smiles.crop existed get matched to their rows,
+               so retention can find them
+      expire:  smiles past the max age are folded into smile_rollups (per face per hour counts, the hour histogram
+               adds them back) and deleted along with their crops. faces keeps its totals, old face crops go too
+      budget:  while the crop store is over budget the oldest crops go first, their rows stay with crop NULL.
+               The segment store gives up whole (oldest) segments
+      compact: segments that expired rows left mostly dead are rewritten (compact_segment)
+    Everything happens in slices of slice_rows rows (or one segment), each one short transaction on its own
+    connection in a worker thread with a pause after it, so neither the frame loop nor the db writer ever waits
+    on more than one slice.
+    '''
+    def __init__(self, parent, slice_rows=500, interval_s=60.0, pause_s=0.05, grace_s=300.0):
+        self.parent = parent
+        self.store = parent.CropStore
+        self.db_path = parent.DB_manager.state['DB_path']
+        self.slice_rows = slice_rows
+        self.interval_s = interval_s
+        self.pause_s = pause_s
+        self.grace_s = grace_s # segments written to this recently may still get rows from the db writer
+        self.lock = threading.Lock() # one slice at a time on the connection, close() waits for it
+        self.conn = None
+        self.task = None
+        self.stopping = False
+        self.state = {
+            "phase": "idle",
+            "passes": 0,
+            "last_pass": None,
+            "last_pass_s": 0.0,
+            "adopted": 0, # old crops matched to their rows
+            "unmatched": 0, # old crop files with no row to go with, left alone
+            "rolled_up": 0, # smiles rows folded into smile_rollups
+            "crops_evicted": 0,
+            "segments_dropped": 0,
+            "segments_compacted": 0,
+            "reclaimed_bytes": 0,
+            "usage_bytes": None,
+            "budget_bytes": None,
+            "slices": 0,
+            "slice_ms": 0.0, # EMA
+            "max_slice_ms": 0.0,
+            "errors": 0,
+        }
+
+    def start(self):
+        '''Pass loop, needs the running loop (lifespan)'''
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        shutdown = self.parent.state['shutdown_event']
+        while not shutdown.is_set() and not self.stopping:
+            if self.parent.controls.get('RETENTION', False):
+                try:
+                    await self.run_pass()
+                except sqlite3.Error as e: # e.g. locked past the timeout, the next pass picks up where this one was
+                    self.state['errors'] += 1
+                    self.state['phase'] = "idle"
+                    print(f"Retention pass failed: {e}")
+            try:
+                await asyncio.wait_for(shutdown.wait(), timeout=self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def locked(self, fn, *args):
+        with self.lock:
+            if self.conn is None:
+                self.conn = self.connect()
+            return fn(*args)
+
+    async def slice(self, fn, *args):
+        '''One unit of work in a worker thread, timed, then a pause. None once stopping'''
+        if self.stopping:
+            return None
+        s = self.state
+        t0 = time.perf_counter()
+        result = await asyncio.to_thread(self.locked, fn, *args)
+        ms = (time.perf_counter() - t0) * 1000
+        s['slice_ms'] = ms if s['slices'] == 0 else 0.9 * s['slice_ms'] + 0.1 * ms
+        s['max_slice_ms'] = max(s['max_slice_ms'], ms)
+        s['slices'] += 1
+        await asyncio.sleep(self.pause_s)
+        return result
+
+    async def run_pass(self, now=None):
+        c = self.parent.controls
+        s = self.state
+        t0 = time.perf_counter()
+        now = time.time() if now is None else now
+        face_dirs = await asyncio.to_thread(self.legacy_face_dirs) if self.store.backend == "directory" else None
+        if face_dirs is not None:
+            s['phase'] = "adopt"
+            for i in range(0, len(face_dirs), 20):
+                if await self.slice(self.adopt, face_dirs[i:i + 20]) is None:
+                    return
+            open(os.path.join(self.store.root, ADOPTED_MARKER), "w").close()
+        max_age_days = c.get('RETENTION_MAX_AGE_DAYS', 0)
+        if max_age_days > 0:
+            s['phase'] = "expire"
+            cutoff = (datetime.datetime.fromtimestamp(now) - datetime.timedelta(days=max_age_days)).isoformat()
+            while await self.slice(self.expire_smiles, cutoff) == self.slice_rows:
+                pass
+            while await self.slice(self.expire_faces, cutoff) == self.slice_rows:
+                pass
+        budget_mb = c.get('RETENTION_DISK_BUDGET_MB', 0)
+        s['budget_bytes'] = int(budget_mb * 1024 * 1024) if budget_mb > 0 else None
+        if s['budget_bytes'] is not None:
+            s['phase'] = "budget"
+            while await self.slice(self.evict, s['budget_bytes']):
+                pass
+        if self.store.backend == "segments":
+            s['phase'] = "compact"
+            for name in await asyncio.to_thread(self.store.sealed, self.grace_s):
+                if await self.slice(self.compact, name) is None:
+                    return
+        s['usage_bytes'] = await asyncio.to_thread(self.store.usage)
+        s['phase'] = "idle"
+        s['passes'] += 1
+        s['last_pass'] = datetime.datetime.now().isoformat()
+        s['last_pass_s'] = time.perf_counter() - t0
+
+    def drop_crops(self, locations):
+        s = self.state
+        for location in locations:
+            if location:
+                s['reclaimed_bytes'] += self.store.delete(location)
+                s['crops_evicted'] += 1
+
+    def drop_thumbs(self, kind, keys):
+        '''Thumbnails the /crops endpoints made of crops that are going, they mustn't outlive them'''
+        crop_server = getattr(self.parent, 'CropServer', None)
+        if crop_server is not None:
+            for key in keys:
+                self.state['reclaimed_bytes'] += crop_server.drop_thumbs(kind, key)
+
+    def expire_smiles(self, cutoff):
+        '''Oldest slice_rows smiles from before cutoff -> smile_rollups, then deleted with their crops. Rows done'''
+        conn = self.conn
+        rows = conn.execute('''
+            SELECT id, face_id, capture_time, crop FROM smiles WHERE capture_time < ? ORDER BY capture_time LIMIT ?
+        ''', (cutoff, self.slice_rows)).fetchall()
+        if not rows:
+            return 0
+        rollups = collections.Counter((face_id, hour_of(capture_time)) for _, face_id, capture_time, _ in rows)
+        # files first: a crash in between leaves rows pointing at nothing (reads give None), never orphaned files
+        self.drop_crops(crop for *_, crop in rows)
+        self.drop_thumbs("smile", (row[0] for row in rows if row[3]))
+        with conn:
+            conn.executemany(ROLLUP_UPSERT, [(face_id, hour, n) for (face_id, hour), n in rollups.items()])
+            conn.executemany("DELETE FROM smiles WHERE id = ?", [(row[0],) for row in rows])
+        self.state['rolled_up'] += len(rows)
+        return len(rows)
+
+    def expire_faces(self, cutoff):
+        '''Face crops of faces last seen before cutoff, the faces rows (totals) stay'''
+        conn = self.conn
+        faces = conn.execute('''
+            SELECT face_id, crop_path FROM faces WHERE last_seen < ? AND crop_path IS NOT NULL LIMIT ?
+        ''', (cutoff, self.slice_rows)).fetchall()
+        self.drop_crops(crop_path for _, crop_path in faces)
+        self.drop_thumbs("face", (face_id for face_id, _ in faces))
+        with conn:
+            conn.executemany("UPDATE faces SET crop_path = NULL WHERE face_id = ?", [(face_id,) for face_id, _ in faces])
+        return len(faces)
+
+    def evict(self, budget_bytes):
+        '''One slice of oldest-first eviction, False once under budget (or nothing is left to evict)'''
+        if self.store.usage() <= budget_bytes:
+            return False
+        if self.store.backend == "segments":
+            return self.evict_segment()
+        conn = self.conn
+        smiles = conn.execute('''
+            SELECT id, crop FROM smiles WHERE crop IS NOT NULL ORDER BY capture_time LIMIT ?
+        ''', (self.slice_rows,)).fetchall()
+        if smiles:
+            self.drop_crops(crop for _, crop in smiles)
+            self.drop_thumbs("smile", (row_id for row_id, _ in smiles))
+            with conn:
+                conn.executemany("UPDATE smiles SET crop = NULL WHERE id = ?", [(row_id,) for row_id, _ in smiles])
+            return True
+        # no smile crops left, face crops by last seen
+        faces = conn.execute('''
+            SELECT face_id, crop_path FROM faces WHERE crop_path IS NOT NULL ORDER BY last_seen LIMIT ?
+        ''', (self.slice_rows,)).fetchall()
+        self.drop_crops(crop_path for _, crop_path in faces)
+        self.drop_thumbs("face", (face_id for face_id, _ in faces))
+        with conn:
+            conn.executemany("UPDATE faces SET crop_path = NULL WHERE face_id = ?", [(face_id,) for face_id, _ in faces])
+        return bool(faces)
+
+    def evict_segment(self):
+        '''Detaches the oldest sealed segment's rows a slice at a time, then deletes the segment'''
+        sealed = self.store.sealed(self.grace_s)
+        if not sealed:
+            return False
+        name, conn, s = sealed[0], self.conn, self.state
+        refs = segment_refs(conn, name, self.slice_rows)
+        if refs:
+            for kind, table in (("smile", "smiles"), ("face", "faces")):
+                self.drop_thumbs(kind, (key for ref_table, key, *_ in refs if ref_table == table))
+            with conn:
+                conn.executemany("UPDATE smiles SET crop = NULL WHERE id = ?",
+                                 [(key,) for table, key, *_ in refs if table == "smiles"])
+                conn.executemany("UPDATE faces SET crop_path = NULL WHERE face_id = ?",
+                                 [(key,) for table, key, *_ in refs if table == "faces"])
+            s['crops_evicted'] += len(refs)
+            return True
+        s['reclaimed_bytes'] += os.path.getsize(os.path.join(self.store.root, name))
+        self.store.drop(name)
+        s['segments_dropped'] += 1
+        return True
+
+    def compact(self, name):
+        action, reclaimed = compact_segment(self.store, self.conn, name)
+        if action is not None:
+            self.state['segments_compacted'] += 1
+            self.state['reclaimed_bytes'] += reclaimed
+        return action
+
+    def legacy_face_dirs(self):
+        '''Face dirs still to adopt, None once that's done'''
+        root = self.store.root
+        if not os.path.isdir(root) or os.path.exists(os.path.join(root, ADOPTED_MARKER)):
+            return None
+        return sorted((name for name in os.listdir(root) if name.isdigit()), key=int)
+
+    def adopt(self, face_dirs):
+        '''
+        Old smile_<time>.jpg files no row points at, paired in time order with the face's rows that have no crop
+        (one file then one row per smile back then). Files with no row within ADOPT_TOLERANCE stay untracked.
+        '''
+        conn, s = self.conn, self.state
+        moves = []
+        for name in face_dirs:
+            face_id, face_dir = int(name), os.path.join(self.store.root, name)
+            known = {crop for (crop,) in conn.execute(
+                "SELECT crop FROM smiles WHERE face_id = ? AND crop IS NOT NULL", (face_id,))}
+            files = []
+            for entry in sorted(os.listdir(face_dir)):
+                path = os.path.join(face_dir, entry)
+                if not (entry.startswith("smile_") and entry.endswith(".jpg")) or path in known:
+                    continue
+                try:
+                    files.append((datetime.datetime.strptime(entry[6:-4], "%Y%m%d_%H%M%S_%f"), path))
+                except ValueError:
+                    continue
+            rows = conn.execute('''
+                SELECT id, capture_time FROM smiles WHERE face_id = ? AND crop IS NULL ORDER BY capture_time
+            ''', (face_id,)).fetchall()
+            i, matched = 0, 0
+            for row_id, capture_time in rows:
+                t = datetime.datetime.fromisoformat(capture_time)
+                while i < len(files) and files[i][0] < t - ADOPT_TOLERANCE:
+                    i += 1 # a file with no row
+                if i < len(files) and files[i][0] <= t + ADOPT_TOLERANCE:
+                    moves.append((files[i][1], row_id))
+                    i += 1
+                    matched += 1
+            s['unmatched'] += len(files) - matched
+        with conn:
+            conn.executemany("UPDATE smiles SET crop = ? WHERE id = ?", moves)
+        s['adopted'] += len(moves)
+        return len(moves)
+
+    async def close(self, timeout=5.0):
+        '''Stops after the slice in flight'''
+        self.stopping = True
+        if self.task is not None:
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self.task = None
+        await asyncio.to_thread(self.close_conn)
+
+    def close_conn(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+    def stats(self):
+        s = self.state
+        return {
+            "enabled": self.parent.controls.get('RETENTION', False),
+            "phase": s['phase'],
+            "passes": s['passes'],
+            "last_pass": s['last_pass'],
+            "last_pass_s": round(s['last_pass_s'], 3),
+            "adopted": s['adopted'],
+            "unmatched": s['unmatched'],
+            "rolled_up": s['rolled_up'],
+            "crops_evicted": s['crops_evicted'],
+            "segments_dropped": s['segments_dropped'],
+            "segments_compacted": s['segments_compacted'],
+            "reclaimed_bytes": s['reclaimed_bytes'],
+            "usage_bytes": s['usage_bytes'],
+            "budget_bytes": s['budget_bytes'],
+            "slices": s['slices'],
+            "slice_ms": round(s['slice_ms'], 3),
+            "max_slice_ms": round(s['max_slice_ms'], 3),
+            "errors": s['errors'],
+        }
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+from Inference_backend import STATIC_IMAGE_OPTIONS, create_backend
+
+
+def roi_around_boxes(boxes, margin, w, h):
+    '''
+    One square-ish region covering every box, grown by margin * box size on each side, clipped to the frame.
+    boxes = [(x_min, y_min, x_max, y_max)] in px, returns (x0, y0, x1, y1) or None
+    '''
+    if not boxes:
+        return None
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x0, y0 = boxes[:, 0].min(), boxes[:, 1].min()
+    x1, y1 = boxes[:, 2].max(), boxes[:, 3].max()
+    side = max(x1 - x0, y1 - y0) * (1 + 2 * margin)
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    roi = (int(max(0, cx - side / 2)), int(max(0, cy - side / 2)),
+           int(min(w, cx + side / 2)), int(min(h, cy + side / 2)))
+    if roi[2] - roi[0] < 2 or roi[3] - roi[1] < 2:
+        return None
+    return roi
+
+
+def crop_for_model(image, roi, size):
+    '''
+    Crop scaled into a fixed size x size canvas (aspect kept, padded at the right/bottom).
+    The models keep their buffers when the input size doesn't change from frame to frame.
+    Returns (canvas, extent), extent = frame px covered by the canvas side
+    '''
+    x0, y0, x1, y1 = roi
+    crop = image[y0:y1, x0:x1]
+    extent = max(crop.shape[0], crop.shape[1])
+    scale = size / extent
+    resized = cv2.resize(crop, (min(size, max(1, round(crop.shape[1] * scale))), min(size, max(1, round(crop.shape[0] * scale)))),
+                         interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    canvas = np.zeros((size, size, image.shape[2]), dtype=image.dtype)
+    canvas[:resized.shape[0], :resized.shape[1]] = resized
+    return canvas, extent
+
+
+def landmarks_to_frame(landmarks, roi, extent, w, h):
+    '''(K, N, 3) landmarks normalized to the model canvas -> normalized to the full frame'''
+    if len(landmarks) == 0:
+        return landmarks
+    x0, y0 = roi[0], roi[1]
+    out = landmarks.copy()
+    out[:, :, 0] = (landmarks[:, :, 0] * extent + x0) / w
+    out[:, :, 1] = (landmarks[:, :, 1] * extent + y0) / h
+    out[:, :, 2] = landmarks[:, :, 2] * extent / w # mediapipe z is scaled like x
+    return out
+
+
+class RoiInference:
+    '''
+    Runs the models on small crops around tracked faces instead of the whole frame.
+    Faces get a crop around the tracked face boxes, hands a wider one (only hands near a face can occlude it).
+    Full frame every ROI_FULL_FRAME_EVERY frames, when nothing is tracked, or after a crop lost a face.
+    Also when the faces are spread out so much that the one shared crop would shrink a face below ROI_MIN_FACE_PX
+    on the ROI_SIZE canvas (e.g. two people at opposite edges), then the models just run on the whole frame.
+    Full frames go through the caller's (tracking mode) backend, crops through a second backend of the same kind in
+    static image mode, so neither graph's landmark tracking sees images jump between crop and frame.
+    '''
+    def __init__(self, parent):
+        self.parent = parent
+        self.crop_backend = None # made on the first crop
+        self.state = {
+            "frames": 0,
+            "since_full": 0,
+            "force_full": True,
+            "full_frames": 0,
+            "roi_frames": 0,
+            "spread_out": 0, # full frames because the faces were too far apart for one crop
+            "model_pixels": 0, # pixels handed to the face model ...
+            "frame_pixels": 0, # ... vs what full frames would have been
+        }
+
+    def plan(self, boxes, w, h):
+        '''Returns (faces_roi, hands_roi), both None = full frame'''
+        s = self.state
+        c = self.parent.controls
+        if (not c.get('ROI_INFERENCE', False) or s['force_full'] or not boxes
+                or s['since_full'] + 1 >= c.get('ROI_FULL_FRAME_EVERY', 15)):
+            return None, None
+        faces_roi = roi_around_boxes(boxes, c.get('ROI_FACE_MARGIN', 0.3), w, h)
+        hands_roi = roi_around_boxes(boxes, c.get('ROI_HAND_MARGIN', 0.75), w, h)
+        if faces_roi is None or hands_roi is None:
+            return None, None
+        # smallest face as it would land on the model canvas
+        extent = max(faces_roi[2] - faces_roi[0], faces_roi[3] - faces_roi[1])
+        smallest = min(max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes)
+        if smallest * c.get('ROI_SIZE', 192) / extent < c.get('ROI_MIN_FACE_PX', 96):
+            s['spread_out'] += 1
+            return None, None
+        return faces_roi, hands_roi
+
+    async def infer(self, backend, rgb_frame, boxes, concurrent=True):
+        '''Same contract as backend.infer on the full frame: (hands, faces) normalized to the frame'''
+        s = self.state
+        c = self.parent.controls
+        h, w = rgb_frame.shape[:2]
+        faces_roi, hands_roi = self.plan(boxes, w, h)
+        s['frames'] += 1
+        if faces_roi is None:
+            hands, faces = await backend.infer(rgb_frame, rgb_frame, concurrent=concurrent)
+            s['since_full'] = 0
+            s['force_full'] = False
+            s['full_frames'] += 1
+            s['model_pixels'] += w * h
+            s['frame_pixels'] += w * h
+            return hands, faces
+
+        size = c.get('ROI_SIZE', 192)
+        faces_crop, faces_extent = crop_for_model(rgb_frame, faces_roi, size)
+        hands_crop, hands_extent = crop_for_model(rgb_frame, hands_roi, size)
+        if self.crop_backend is None:
+            self.crop_backend = create_backend(backend.name, STATIC_IMAGE_OPTIONS)
+        hands, faces = await self.crop_backend.infer(hands_crop, faces_crop, concurrent=concurrent)
+        s['since_full'] += 1
+        s['roi_frames'] += 1
+        s['model_pixels'] += size * size
+        s['frame_pixels'] += w * h
+        if len(faces) < len(boxes):
+            s['force_full'] = True # someone left the crop, look at the whole frame next time
+        return (landmarks_to_frame(hands, hands_roi, hands_extent, w, h),
+                landmarks_to_frame(faces, faces_roi, faces_extent, w, h))
+
+    def close(self):
+        if self.crop_backend is not None:
+            self.crop_backend.close()
+            self.crop_backend = None
+
+    def stats(self):
+        s = self.state
+        return {
+            "enabled": self.parent.controls.get('ROI_INFERENCE', False),
+            "full_frames": s['full_frames'],
+            "roi_frames": s['roi_frames'],
+            "spread_out": s['spread_out'],
+            "pixel_ratio": round(s['model_pixels'] / s['frame_pixels'], 4) if s['frame_pixels'] else 1.0,
+        }
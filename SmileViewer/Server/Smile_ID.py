@@ -3,34 +3,51 @@ import numpy as np
 from collections import deque
 import cv2
 import time
-import datetime
-import os 
+import math
 import asyncio
 
+from Inference_backend import create_backend
+from Face_tracker import MotionModel, match_faces, predict_bbox
+from Flow_tracker import FlowTracker
+from Roi_inference import RoiInference
+
+# landmark indices the mouth metrics read, order matches the unpacking in calculate_mar / check_smile
+MAR_POINTS = [61, 291, 13, 14]
+SMILE_POINTS = [61, 291, 13, 14, 0, 17]
+
+
+def as_landmark_array(landmarks):
+    '''Landmarks as a contiguous float32 (N, 3) array, a no-op for what the inference backend returns'''
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(p.x, p.y, getattr(p, 'z', 0.0)) for p in landmarks], dtype=np.float32)
+
+
 class SmileIDer:
     def __init__(self, parent):
         self.parent = parent
         self.LandmarksSubSets = {}
+        self.InferenceBackend = None
+        self.FlowTracker = FlowTracker(self)
+        self.RoiInference = RoiInference(self)
         self.init_media_pipe_face_hands()
         self.state = {
             "persistent_faces": {},
             }
-        self.images_dir = os.path.join(os.getcwd(), "server", "data", "images")
         pass
 
+    def init_inference_backend(self, name="inprocess", options=None):
+        '''Models are owned by the backend: inprocess (event loop), thread or process'''
+        if self.InferenceBackend is not None:
+            self.InferenceBackend.close()
+        self.RoiInference.close() # its crop backend follows the main one's kind
+        self.InferenceBackend = create_backend(name, options)
+        return self.InferenceBackend
+
     def init_media_pipe_face_hands(self):
-        # Initialize Mediapipe Face Mesh and Hand Mesh
-        self.mp_drawing = mp.solutions.drawing_utils # for hand connections
+        # Mediapipe handles, the Face Mesh and Hand models themselves live in the inference backend
         self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            static_image_mode=False,
-            max_num_faces=3,
-            refine_landmarks=True, #more accurate lips
-            min_detection_confidence=0.6
-        )
-
-        self.mp_hands = mp.solutions.hands
-        self.hands = self.mp_hands.Hands(min_detection_confidence=0.8, min_tracking_confidence=0.7)
+        self.mp_hands = mp.solutions.hands # for hand connections
         # Landmark subset definition, basic face features
         self.LandmarksSubSets['LeftI'] = [384, 385, 386, 387, 388, 390, 263, 362, 398, 466, 373, 374, 249, 380, 381, 382]
         self.LandmarksSubSets['LeftIBrow'] = [293, 295, 296, 300, 334, 336, 276, 282, 283, 285]
@@ -54,9 +71,13 @@ class SmileIDer:
         '''
         s = self.state
         w,h = s['w'], s['h']
-        # Select the landmarks by iterating through the list of indices
         # I tried focusing on other landmarks like eyes and noise or key features, but this is more robust 
-        points = np.array([(p.x * w, p.y * h) for p in landmarks], dtype=np.int32)
+        points = (as_landmark_array(landmarks)[:, :2].astype(np.float64) * (w, h)).astype(np.int32)
+        return SmileIDer.far_from_points(points)
+
+    @staticmethod
+    def far_from_points(points):
+        '''FAR and rotated rect from int32 pixel landmark points'''
         rect = cv2.minAreaRect(points)
         (width, height) = rect[1] 
         # assume all faces are taller than wide
@@ -74,14 +95,12 @@ class SmileIDer:
         '''effectively mouth openness
             varying openess = talking = false smiles? 
             '''
-        left_corner = landmarks[61]
-        right_corner = landmarks[291]
-        top_lip = landmarks[13]
-        bottom_lip = landmarks[14]
+        # one gather from the landmark array, the rest is a handful of scalar ops
+        (lc_x, lc_y), (rc_x, rc_y), (tl_x, tl_y), (bl_x, bl_y) = as_landmark_array(landmarks)[MAR_POINTS, :2].tolist()
 
         # Calculate the Euclidean distance (hypotnuess) between the points
-        horizontal_dist = np.linalg.norm(np.array([left_corner.x, left_corner.y]) - np.array([right_corner.x, right_corner.y]))
-        vertical_dist = np.linalg.norm(np.array([top_lip.x, top_lip.y]) - np.array([bottom_lip.x, bottom_lip.y]))
+        horizontal_dist = math.sqrt((lc_x - rc_x)**2 + (lc_y - rc_y)**2)
+        vertical_dist = math.sqrt((tl_x - bl_x)**2 + (tl_y - bl_y)**2)
 
         # Avoid division by zero
         if horizontal_dist == 0:
@@ -107,31 +126,27 @@ class SmileIDer:
                 thresh = 0.35
         if tilt <= 0:
             tilt = 1
-        left_corner = landmarks[61]
-        right_corner = landmarks[291]
-        inner_top_lip = landmarks[13]
-        inner_bottom_lip = landmarks[14]
-        outer_top_lip = landmarks[0]
-        outer_bottom_lip = landmarks[17]
-        
+        # corners, inner top/bottom lip, outer top/bottom lip
+        ((lc_x, lc_y), (rc_x, rc_y), (itl_x, itl_y), (ibl_x, ibl_y),
+            (otl_x, otl_y), (obl_x, obl_y)) = as_landmark_array(landmarks)[SMILE_POINTS, :2].tolist()
 
         # origin = inner center of the bottom lips
-        origin_x = inner_bottom_lip.x #(inner_top_lip.x + inner_bottom_lip.x) / 2
-        origin_y = inner_bottom_lip.y #(inner_top_lip.y + inner_bottom_lip.y) / 2
+        origin_x = ibl_x #(inner_top_lip.x + inner_bottom_lip.x) / 2
+        origin_y = ibl_y #(inner_top_lip.y + inner_bottom_lip.y) / 2
 
         # smile x y axes are mouth center lines
-        sx_axis = outer_bottom_lip.x - outer_top_lip.x
-        sy_axis = outer_bottom_lip.y - outer_top_lip.y
+        sx_axis = obl_x - otl_x
+        sy_axis = obl_y - otl_y
 
         # Normalize
-        mouth_height = np.sqrt(sy_axis**2 + sx_axis**2) #with lips
+        mouth_height = math.sqrt(sy_axis**2 + sx_axis**2) #with lips
         if mouth_height == 0: return -1 # bad detect
         sx_unit = sx_axis / mouth_height
         sy_unit = sy_axis / mouth_height
     
         # Vector from origin to corners
-        lc_vec_x, lc_vec_y = left_corner.x - origin_x, left_corner.y - origin_y
-        rc_vec_x, rc_vec_y = right_corner.x - origin_x, right_corner.y - origin_y
+        lc_vec_x, lc_vec_y = lc_x - origin_x, lc_y - origin_y
+        rc_vec_x, rc_vec_y = rc_x - origin_x, rc_y - origin_y
         # Projection / shadow / mag in new axes 
         lc_new_y = lc_vec_x * sx_unit + lc_vec_y * sy_unit
         rc_new_y = rc_vec_x * sx_unit + rc_vec_y * sy_unit
@@ -143,23 +158,20 @@ class SmileIDer:
         # tried using largest lip curl of the 2, but again avg  seemed better
         # use lip height becausd mouth could be open!
         # use these 2 measurements in case of open mouth
-        upper_lip_height = np.linalg.norm(
-                                np.array([outer_top_lip.x, outer_top_lip.y]) - np.array([inner_top_lip.x, inner_top_lip.y]))
-        lower_lip_height = np.linalg.norm(
-                                np.array([outer_bottom_lip.x, outer_bottom_lip.y]) - np.array([inner_bottom_lip.x, inner_bottom_lip.y]))
+        upper_lip_height = math.sqrt((otl_x - itl_x)**2 + (otl_y - itl_y)**2)
+        lower_lip_height = math.sqrt((obl_x - ibl_x)**2 + (obl_y - ibl_y)**2)
         lip_hieght= (upper_lip_height + lower_lip_height) /2
         scaled_thresh = lip_hieght * thresh / tilt**2 # if head is a little titled, threshold should be higher
 
         # Another check for like shouting or O faces that would give false positives 
         # Sum of lip curvature should be pointing upward
-        mouth_width = np.linalg.norm(
-                            np.array([left_corner.x, left_corner.y]) - np.array([right_corner.x, right_corner.y]))
+        mouth_width = math.sqrt((lc_x - rc_x)**2 + (lc_y - rc_y)**2)
         if mouth_width == 0: return -1 
-        upper_curve = ((right_corner.x - left_corner.x) * (inner_top_lip.y - left_corner.y) - 
-                    (right_corner.y - left_corner.y) * (inner_top_lip.x - left_corner.x))
+        upper_curve = ((rc_x - lc_x) * (itl_y - lc_y) - 
+                    (rc_y - lc_y) * (itl_x - lc_x))
         
-        lower_curve = ((right_corner.x - left_corner.x) * (inner_bottom_lip.y - left_corner.y) - 
-                    (right_corner.y - left_corner.y) * (inner_bottom_lip.x - left_corner.x))
+        lower_curve = ((rc_x - lc_x) * (ibl_y - lc_y) - 
+                    (rc_y - lc_y) * (ibl_x - lc_x))
         total_curvature = -((upper_curve) + lower_curve) / mouth_width
         
         if total_curvature < -scaled_thresh*(2.9*mar): # if probably not yelling, big open smiles should have more curveature 
@@ -167,6 +179,84 @@ class SmileIDer:
                 return 1
         else:
             return -1
+    @staticmethod
+    def calculate_mar_batch(xs, ys):
+        '''calculate_mar for F faces at once, xs / ys = (4+, F) float64 rows in MAR_POINTS order'''
+        horizontal = np.sqrt((xs[0] - xs[1])**2 + (ys[0] - ys[1])**2)
+        vertical = np.sqrt((xs[2] - xs[3])**2 + (ys[2] - ys[3])**2)
+        flat = horizontal == 0
+        return np.where(flat, 0.0, vertical / np.where(flat, 1.0, horizontal))
+
+    def check_smile_batch(self, xs, ys, tilts, mars, thresh=None):
+        '''
+        check_smile for F faces in one pass, same math and same 1 / -1 / None answers.
+        xs / ys = (6, F) float64 rows in SMILE_POINTS order, tilts and mars = (F,)
+        '''
+        c = self.controls
+        if thresh is None:
+            thresh = c.get('SMILE_THRESH', 0.35)
+        tilts = np.where(tilts <= 0, 1.0, tilts)
+        lc_x, rc_x, itl_x, ibl_x, otl_x, obl_x = xs
+        lc_y, rc_y, itl_y, ibl_y, otl_y, obl_y = ys
+
+        sx_axis = obl_x - otl_x
+        sy_axis = obl_y - otl_y
+        mouth_height = np.sqrt(sy_axis**2 + sx_axis**2)
+        mouth_width = np.sqrt((lc_x - rc_x)**2 + (lc_y - rc_y)**2)
+        bad_detect = (mouth_height == 0) | (mouth_width == 0)
+        # bad detects answer -1 regardless, keep their divisions finite
+        mouth_height = np.where(bad_detect, 1.0, mouth_height)
+        mouth_width = np.where(bad_detect, 1.0, mouth_width)
+
+        sx_unit = sx_axis / mouth_height
+        sy_unit = sy_axis / mouth_height
+        lc_new_y = (lc_x - ibl_x) * sx_unit + (lc_y - ibl_y) * sy_unit
+        rc_new_y = (rc_x - ibl_x) * sx_unit + (rc_y - ibl_y) * sy_unit
+        smile_score = (lc_new_y + rc_new_y) / 2
+
+        upper_lip_height = np.sqrt((otl_x - itl_x)**2 + (otl_y - itl_y)**2)
+        lower_lip_height = np.sqrt((obl_x - ibl_x)**2 + (obl_y - ibl_y)**2)
+        lip_hieght = (upper_lip_height + lower_lip_height) / 2
+        scaled_thresh = lip_hieght * thresh / tilts**2
+
+        upper_curve = ((rc_x - lc_x) * (itl_y - lc_y) -
+                    (rc_y - lc_y) * (itl_x - lc_x))
+        lower_curve = ((rc_x - lc_x) * (ibl_y - lc_y) -
+                    (rc_y - lc_y) * (ibl_x - lc_x))
+        total_curvature = -((upper_curve) + lower_curve) / mouth_width
+
+        curved = (total_curvature < -scaled_thresh * (2.9 * mars)) & ~bad_detect
+        smiling = curved & (smile_score < -scaled_thresh)
+        return [(1 if smile else None) if curve else -1 for curve, smile in zip(curved.tolist(), smiling.tolist())]
+
+    def face_metrics(self, landmarks, baseline_far):
+        '''FAR, rotated face rect, MAR and this frame's smile vote for one face'''
+        current_far, rotated_face_rect = self.calculate_far(landmarks)
+        mar = SmileIDer.calculate_mar(landmarks)
+        if baseline_far > 0 and current_far > 0:
+            smile_status = self.check_smile(landmarks, current_far/baseline_far, mar)
+        else:
+            smile_status = self.check_smile(landmarks, 1, mar) # assume tilt factor 1 when issues arise
+        return current_far, rotated_face_rect, mar, smile_status
+
+    def face_metrics_batch(self, landmarks_list, baseline_fars):
+        '''face_metrics for every face at once: one stacked array, vectorized MAR / thresholds / curvature'''
+        s = self.state
+        w,h = s['w'], s['h']
+        stack = np.stack([as_landmark_array(landmarks)[:, :2] for landmarks in landmarks_list])
+        # minAreaRect has no batched form, it gets one call per face on the already scaled points
+        pixel_points = (stack * np.array((w, h), dtype=np.float64)).astype(np.int32)
+        fars, rects = zip(*[SmileIDer.far_from_points(points) for points in pixel_points])
+        fars = np.array(fars, dtype=np.float64)
+        baselines = np.array(baseline_fars, dtype=np.float64)
+        # (6, F) rows of x and y, the mouth subset of every face
+        xs, ys = stack[:, SMILE_POINTS].astype(np.float64).transpose(2, 1, 0)
+        mars = SmileIDer.calculate_mar_batch(xs, ys)
+        tilted = (baselines > 0) & (fars > 0)
+        tilts = np.where(tilted, fars / np.where(tilted, baselines, 1.0), 1.0)
+        smiles = self.check_smile_batch(xs, ys, tilts, mars)
+        return list(zip(fars.tolist(), rects, mars.tolist(), smiles))
+
     #Make sure no hand is in our larger, cropping face frame
     @staticmethod
     def check_occlusion(face_bbox, hand_bbox):
@@ -177,89 +267,140 @@ class SmileIDer:
             return False
         return True
 
-    def get_hands(self, rgb_frame, target_frame):
+    async def infer_landmarks(self, rgb_frame):
+        '''Both models on the frame, or on crops around the tracked faces when ROI_INFERENCE is on'''
+        boxes = [face['face_bbox'] for face in self.state['persistent_faces'].values()]
+        return await self.RoiInference.infer(self.InferenceBackend, rgb_frame, boxes,
+                                             concurrent=self.controls.get('CONCURRENT_INFERENCE', True))
+
+    async def detect(self, rgb_frame):
+        '''Runs both models through the inference backend, returns (hands_in_frame, current_faces_in_frame)'''
+        if self.InferenceBackend is None:
+            self.init_inference_backend()
+        if not self.controls.get('FLOW_TRACKING', False):
+            self.FlowTracker.reset()
+            hand_landmarks, face_landmarks = await self.infer_landmarks(rgb_frame)
+            return self.get_hands(hand_landmarks), self.get_faces(face_landmarks)
+
+        # detect-then-track: optical flow carries the last landmarks between full model runs
+        s = self.state
+        w,h = s['w'], s['h']
+        gray = await asyncio.to_thread(cv2.cvtColor, rgb_frame, cv2.COLOR_RGB2GRAY)
+        face_landmarks = None
+        if not self.FlowTracker.needs_detection():
+            face_landmarks = await asyncio.to_thread(self.FlowTracker.track, gray, w, h)
+            hand_landmarks = self.FlowTracker.state['hands']
+        if face_landmarks is None:
+            t0 = time.perf_counter()
+            hand_landmarks, face_landmarks = await self.infer_landmarks(rgb_frame)
+            await asyncio.to_thread(self.FlowTracker.observe_detection, gray, face_landmarks, hand_landmarks,
+                                    (time.perf_counter() - t0) * 1000, w, h)
+        return self.get_hands(hand_landmarks), self.get_faces(face_landmarks)
+
+    def get_hands(self, hand_landmarks):
+        '''(K, 21, 3) normalized hand landmarks -> [{'landmarks', 'hand_bbox'}]'''
+        s = self.state
+        w, h = s['w'], s['h']
+        hands_in_frame = []
+        for landmarks in hand_landmarks:
+            points = (landmarks[:, :2].astype(np.float64) * (w, h)).astype(np.int32)
+            x_min, y_min = points.min(axis=0).tolist()
+            x_max, y_max = points.max(axis=0).tolist()
+            hands_in_frame.append({
+                'landmarks': landmarks,
+                'hand_bbox': (x_min, y_min, x_max, y_max)
+            })
+        return hands_in_frame
+
+    def draw_hands(self, target_frame, hands_in_frame):
         s = self.state
         c = self.controls
         w, h = s['w'], s['h']
-        hands_in_frame_temp = []
-        handIDer = self.hands.process
-        hand_results = handIDer(rgb_frame)
-        if hand_results.multi_hand_landmarks:
-            for hand_landmarks in hand_results.multi_hand_landmarks:
-                x_coords = []
-                y_coords = []
-                for landmark in hand_landmarks.landmark:
-                    px, py = int(landmark.x * w), int(landmark.y * h)
-                    x_coords.append(px)
-                    y_coords.append(py)
-                x_min, y_min = min(x_coords), min(y_coords)
-                x_max, y_max = max(x_coords), max(y_coords)
-                hands_in_frame_temp.append((x_min,y_min,x_max,y_max))
-                if c['DRAW_LANDMARKS']:
-                    self.mp_drawing.draw_landmarks(
-                        image=target_frame,
-                        landmark_list=hand_landmarks,
-                        connections=self.mp_hands.HAND_CONNECTIONS)
-                    #for hand BB
-                    x_coords = []
-                    y_coords = []
-                    for landmark in hand_landmarks.landmark:
-                        px, py = int(landmark.x * w), int(landmark.y * h)
-                        x_coords.append(px)
-                        y_coords.append(py)
-                        cv2.circle(target_frame, (px, py), 5, (200, 200, 200), cv2.FILLED)
-                    #Make hand BB
-                    x_min, y_min = min(x_coords), min(y_coords)
-                    x_max, y_max = max(x_coords), max(y_coords)
-                    cv2.rectangle(
-                        target_frame, 
-                        (x_min - c['HAND_PAD'], y_min - c['HAND_PAD']), 
-                        (x_max + c['HAND_PAD'], y_max + c['HAND_PAD']), 
-                        (0, 0, 255), # Red color for the box
-                        2            # Line thickness
-                    )
-        s['hands_in_frame'] = hands_in_frame_temp
-
-    def get_faces(self, rgb_frame, target_frame):
+        for hand in hands_in_frame:
+            points = (hand['landmarks'][:, :2].astype(np.float64) * (w, h)).astype(np.int32).tolist()
+            for start_idx, end_idx in self.mp_hands.HAND_CONNECTIONS:
+                cv2.line(target_frame, points[start_idx], points[end_idx], (224, 224, 224), 2)
+            for px, py in points:
+                cv2.circle(target_frame, (px, py), 5, (200, 200, 200), cv2.FILLED)
+            #Make hand BB
+            x_min, y_min, x_max, y_max = hand['hand_bbox']
+            cv2.rectangle(
+                target_frame, 
+                (x_min - c['HAND_PAD'], y_min - c['HAND_PAD']), 
+                (x_max + c['HAND_PAD'], y_max + c['HAND_PAD']), 
+                (0, 0, 255), # Red color for the box
+                2            # Line thickness
+            )
+
+    def get_faces(self, face_landmarks):
+        '''(K, 478, 3) normalized face landmarks -> [{'landmarks', 'center', 'face_bbox'}]'''
         s = self.state
         w,h = s['w'], s['h']
         c = self.controls
         current_faces_in_frame = []
-        FaceIDer = self.face_mesh.process
-        face_results = FaceIDer(rgb_frame)
-        if face_results.multi_face_landmarks: #if Faces
-            for face_landmarks in face_results.multi_face_landmarks: # for each face
-                all_x, all_y = zip(*[[(p.x * w),(p.y * h)] for p in face_landmarks.landmark])
-                #min and max x y for bounding boxing
-                x_min, x_max = int(min(all_x)), int(max(all_x))
-                y_min, y_max = int(min(all_y)), int(max(all_y))
-                
-                face_bbox= (max(0, x_min - c['FACE_PAD']), max(0, y_min - c['FACE_PAD']), 
-                        min(w, x_max + c['FACE_PAD']), min(h, y_max + c['FACE_PAD']))
-
-                # Store face data 
-                current_face_center = np.mean([[p.x, p.y] for p in face_landmarks.landmark], axis=0) # no need to scale, descale etc ... 
-                current_faces_in_frame.append({
-                    'landmarks': face_landmarks.landmark,
-                    'center': current_face_center,
-                    'face_bbox': face_bbox
-                })
-                if c['DRAW_LANDMARKS']:
-                    landmarks = face_landmarks.landmark
-                    for idx in self.LandmarksSubSets['face_mesh_subset']:
-                        if idx < len(landmarks):
-                            lm = landmarks[idx]
-                            x, y = int(lm.x * w), int(lm.y * h)
-                            if idx in [0, 1, 13, 14, 17, 61, 291]:
-                                cv2.circle(target_frame, (x, y), 2, (0, 0, 255), -1)
-                            elif idx in [ 78, 191, 80, 81, 82, 13, 312, 311, 310, 415]:
-                                cv2.circle(target_frame, (x, y), 2, (0, 255, 200), -1)
-                            elif idx in [ 308, 324, 318, 402, 317, 14, 87, 178, 88, 95]:
-                                cv2.circle(target_frame, (x, y), 2, (200, 255, 0), -1)
-                            else:
-                                cv2.circle(target_frame, (x, y), 2, (255, 0, 0), -1)
+        for landmarks in face_landmarks: # for each face
+            xs, ys = landmarks[:, 0], landmarks[:, 1]
+            #min and max x y for bounding boxing
+            x_min, x_max = int(float(xs.min()) * w), int(float(xs.max()) * w)
+            y_min, y_max = int(float(ys.min()) * h), int(float(ys.max()) * h)
+            
+            face_bbox= (max(0, x_min - c['FACE_PAD']), max(0, y_min - c['FACE_PAD']), 
+                    min(w, x_max + c['FACE_PAD']), min(h, y_max + c['FACE_PAD']))
+
+            # Store face data 
+            current_face_center = np.array([xs.mean(dtype=np.float64), ys.mean(dtype=np.float64)]) # no need to scale, descale etc ... 
+            current_faces_in_frame.append({
+                'landmarks': landmarks,
+                'center': current_face_center,
+                'face_bbox': face_bbox
+            })
         return current_faces_in_frame
 
+    def draw_faces(self, target_frame, current_faces_in_frame):
+        '''Draws the raw detected landmark subset'''
+        s = self.state
+        w,h = s['w'], s['h']
+        subset, colors = self.subset_draw_colors()
+        for face in current_faces_in_frame:
+            landmarks = as_landmark_array(face['landmarks'])
+            points = (landmarks[subset, :2].astype(np.float64) * (w, h)).astype(int).tolist()
+            for (x, y), color in zip(points, colors):
+                cv2.circle(target_frame, (x, y), 2, color, -1)
+
+    def subset_draw_colors(self):
+        '''face_mesh_subset as an index array plus one BGR color per point, built once'''
+        if 'face_mesh_subset_colors' not in self.LandmarksSubSets:
+            colors = []
+            for idx in self.LandmarksSubSets['face_mesh_subset']:
+                if idx in [0, 1, 13, 14, 17, 61, 291]:
+                    colors.append((0, 0, 255))
+                elif idx in [ 78, 191, 80, 81, 82, 13, 312, 311, 310, 415]:
+                    colors.append((0, 255, 200))
+                elif idx in [ 308, 324, 318, 402, 317, 14, 87, 178, 88, 95]:
+                    colors.append((200, 255, 0))
+                else:
+                    colors.append((255, 0, 0))
+            self.LandmarksSubSets['face_mesh_subset_idx'] = np.array(self.LandmarksSubSets['face_mesh_subset'])
+            self.LandmarksSubSets['face_mesh_subset_colors'] = colors
+        return self.LandmarksSubSets['face_mesh_subset_idx'], self.LandmarksSubSets['face_mesh_subset_colors']
+
+    def landmark_pixels(self, landmarks):
+        '''face_mesh_subset in pixel coords, (L, 2) int array'''
+        s = self.state
+        w, h = s['w'], s['h']
+        subset, _ = self.subset_draw_colors()
+        return (as_landmark_array(landmarks)[subset, :2].astype(np.float64) * (w, h)).astype(int)
+
+    def export_landmarks(self, landmarks):
+        '''face_mesh_subset in pixel coords as [[x, y], ...] for the frontend'''
+        return self.landmark_pixels(landmarks).tolist()
+
+    def mouth_points(self, landmarks):
+        s = self.state
+        w, h = s['w'], s['h']
+        mouth = self.LandmarksSubSets['Mouth']
+        return (as_landmark_array(landmarks)[mouth, :2].astype(np.float64) * (w, h)).astype(np.int32)
+
     def check_faces(self, current_faces_in_frame):
         s = self.state
         w,h = s['w'], s['h']
@@ -268,24 +409,41 @@ class SmileIDer:
         next_face_id = self.DB_manager.state['next_face_id']
         current_IDs = set()
 
-        for current_face in current_faces_in_frame: 
-            best_match_id = None
-            min_dist = float('inf')
-            # Find the closest existing face
-            for face_id, old_face in persistent_faces.items():
-                dist = np.linalg.norm(current_face['center'] - old_face['center'])
-                if dist < c['PF_SHIFT_BUFF'] and dist < min_dist: #if this face is pretty close to a prior face point, AND closest,
-                    min_dist = dist
-                    best_match_id = face_id # then the faces are probably the same
+        now = time.time()
+        # Where each track should be by now, so fast movers stay inside PF_SHIFT_BUFF of their prediction
+        track_ids = list(persistent_faces.keys())
+        predicted_centers, predicted_boxes = [], []
+        for face_id in track_ids:
+            face_data = persistent_faces[face_id]
+            motion = face_data.get('motion')
+            if motion is None:
+                motion = face_data['motion'] = MotionModel(face_data['center'], face_data.get('last_seen', now))
+            predicted = motion.predict(now)
+            predicted_centers.append(predicted)
+            predicted_boxes.append(predict_bbox(face_data['face_bbox'], face_data['center'], predicted, w, h))
+
+        # Best overall pairing of detections to tracks (center distance + box overlap), one detection per track
+        matches, unmatched = match_faces(
+            predicted_centers,
+            predicted_boxes,
+            [face['center'] for face in current_faces_in_frame],
+            [face['face_bbox'] for face in current_faces_in_frame],
+            c['PF_SHIFT_BUFF'], c.get('TRACK_IOU_WEIGHT', 0.1))
+        matched_ids = {face_idx: track_ids[track_idx] for track_idx, face_idx in matches}
+
+        for face_idx, current_face in enumerate(current_faces_in_frame): 
+            best_match_id = matched_ids.get(face_idx)
 
             if best_match_id is not None:
                 # since it's a match, update the existing face
                 face_data = persistent_faces[best_match_id]
+                face_data['motion'].update(current_face['center'], now)
                 face_data.update({
                     'landmarks': current_face['landmarks'],
                     'center': current_face['center'],
                     'face_bbox': current_face['face_bbox'],
-                    'last_seen': time.time()
+                    'last_seen': now,
+                    'missed_frames': 0,
                 })
                 face_data['visibility_count'] += 1 # Increment visibility
                 current_IDs.add(best_match_id)
@@ -305,42 +463,61 @@ class SmileIDer:
                     'rotated_bb_history': deque(maxlen=c['ROTATED_BB_FRAME_AVERAGE']),
                     'baseline_far': current_far,
                     'smile_status': "Detecting...",
-                    'last_seen': time.time(),
+                    'last_seen': now,
+                    'motion': MotionModel(current_face['center'], now),
+                    'missed_frames': 0, # frames in a row without a matching detection, coasting on the prediction
                     'visibility_count': 1, # Start counter at 1
-                    'worker_task': asyncio.create_task(self.image_saving_worker(new_id)) # Spin up worker
                 }
                 self.DB_manager.state['next_face_id'] = next_face_id
                 current_IDs.add(new_id) #not actually matched, maybe should be current_IDs 
+        for face_id in track_ids:
+            if face_id not in current_IDs:
+                persistent_faces[face_id]['missed_frames'] = persistent_faces[face_id].get('missed_frames', 0) + 1
         self.parent.state['persistent_faces'] = persistent_faces
         return current_IDs
 
     def process_faces(self, frame):
+        self.score_faces()
+        if not self.controls.get('OVERLAY_ONLY', False):
+            self.draw_tracked_faces(frame)
+
+    def score_faces(self):
+        '''Updates smile status / smile box of every tracked face, drops faces not seen for CLEAR_TIME'''
         s = self.state
         c = self.controls
         w,h = s['w'], s['h']
+        now = time.time()
+        live_ids, live_faces = [], []
         for face_id, face_data in list(s['persistent_faces'].items()):
-            # Remove old faces that haven't been seen for a bit
-            if time.time() - face_data['last_seen'] > c['CLEAR_TIME']:
+            # Remove old faces that haven't been seen for a bit, a frame or two of coasting is allowed even at low fps
+            if (time.time() - face_data['last_seen'] > c['CLEAR_TIME'] and
+                    face_data.get('missed_frames', 0) > c.get('TRACK_MAX_COAST_FRAMES', 2)):
                 del s['persistent_faces'][face_id]
                 continue
-                
-            landmarks = face_data['landmarks']
-            
-            #current face tilt check
-            current_far, rotated_face_rect = self.calculate_far(landmarks)
-            face_data['rotated_face_rect'] = rotated_face_rect
+            if face_data.get('missed_frames', 0) > 0:
+                # coasting on the motion model, its landmarks are last frame's: no scoring, no crops, no smiling time
+                face_data.pop('scored_at', None)
+                continue
+            live_ids.append(face_id)
+            live_faces.append(face_data)
+        if not live_faces:
+            return
+
+        # tilt (FAR), talking (MAR) and this frame's smile vote, every face in one pass or one face at a time
+        # numpy call overhead only pays off with a crowd, a few faces are quicker in plain floats
+        if len(live_faces) >= c.get('BATCH_SCORING_MIN_FACES', 6):
+            metrics = self.face_metrics_batch([f['landmarks'] for f in live_faces], [f['baseline_far'] for f in live_faces])
+        else:
+            metrics = [self.face_metrics(f['landmarks'], f['baseline_far']) for f in live_faces]
 
-            #check for current mar / talking
-            mar = SmileIDer.calculate_mar(landmarks)
+        for face_id, face_data, (current_far, rotated_face_rect, mar, smile_status) in zip(live_ids, live_faces, metrics):
+            face_data['rotated_face_rect'] = rotated_face_rect
             face_data['mar_history'].append(mar)
 
             is_not_tilted = True
             baseline = face_data['baseline_far']
             if baseline > 0 and current_far > 0:
                 is_not_tilted = current_far > (baseline * c['FAR_TILT_TOLERANCE'])
-                smile_status = self.check_smile(landmarks, current_far/baseline, mar)
-            else:
-                smile_status = self.check_smile(landmarks, 1, mar) # assume tilt factor 1 when issues arise
 
             if is_not_tilted:
                 face_data['smile_history'].append(smile_status)
@@ -363,82 +540,60 @@ class SmileIDer:
                         if self.check_occlusion(face_data['face_bbox'], hand_box): 
                             Status = 'Occluded'
                 face_data['smile_status'] = Status
-            # Bounding box only if face has been around a bit
-            if face_data['visibility_count'] >= c['MIN_VISIBILITY_FRAMES']:
-                if c['DRAW_FACE_BB']:
-                    x1, y1, x2, y2 = face_data['face_bbox']
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    # Smile status and Face ID text
-                    status_text = f"Face {face_id}: {face_data['smile_status']}" 
-                    cv2.putText(frame, status_text, (x1, y1 - 10),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                    
-                    if 'rotated_face_rect' in face_data and face_data['rotated_face_rect'] is not None and c['DRAW_ROTATED_BB']:
-                        box = cv2.boxPoints(face_data['rotated_face_rect'])
-                        box = np.int0(box) #for cv2 contour compatibiltity 
-                        cv2.drawContours(frame, [box], 0, (255, 0, 255), 2)
-                
-                # If smiling, draw a specific box around the mouth
-                if face_data['smile_status'] == "Smiling" :
-                    mouth_points = np.array([(landmarks[i].x * w, landmarks[i].y * h) for i in self.LandmarksSubSets['Mouth']], dtype=np.int32)
-                    all_x, all_y = zip(*mouth_points)
-                    x_min, x_max = int(min(all_x)), int(max(all_x))
-                    y_min, y_max = int(min(all_y)), int(max(all_y))
-                    
-                    x1, y1, x2, y2 = (max(0, x_min - c['SMILE_PAD']), max(0, y_min - c['SMILE_PAD']), 
-                            min(w, x_max + c['SMILE_PAD']), min(h, y_max + c['SMILE_PAD']))
-                    face_data['smile_bbox'] = (x1, y1, x2, y2)
-                    if c['DRAW_SMILE_BB']:
-                        cv2.rectangle(frame, (x1,y1),(x2,y2), (255, 50, 0), 2)
-                        if c['DRAW_ROTATED_BB']:
-                            rotated_mouth_rect = cv2.minAreaRect(mouth_points)
-                            mouth_box = cv2.boxPoints(rotated_mouth_rect)
-                            mouth_box = np.int0(mouth_box)
-                            cv2.drawContours(frame, [mouth_box], 0, (255, 255, 0), 2)
-                
-    async def image_saving_worker(self, face_id):
-        '''
-        saves the initial confirmed face crop
-        then saves smile crops periodically.
-        '''
+            # time spent smiling, the capture service logs it with the smile crops
+            if face_data['smile_status'] == "Smiling" and 'scored_at' in face_data:
+                face_data['smiling_s'] = face_data.get('smiling_s', 0.0) + now - face_data['scored_at']
+            face_data['scored_at'] = now
+            confirmed = face_data['visibility_count'] >= c['MIN_VISIBILITY_FRAMES']
+            if confirmed and not face_data.get('face_captured'):
+                face_data['face_captured'] = self.notify_capture("face", face_id, face_data)
+            # Smile box only if face has been around a bit
+            if confirmed and face_data['smile_status'] == "Smiling":
+                mouth_points = self.mouth_points(face_data['landmarks'])
+                x_min, y_min = mouth_points.min(axis=0).tolist()
+                x_max, y_max = mouth_points.max(axis=0).tolist()
+                face_data['smile_bbox'] = (max(0, x_min - c['SMILE_PAD']), max(0, y_min - c['SMILE_PAD']), 
+                        min(w, x_max + c['SMILE_PAD']), min(h, y_max + c['SMILE_PAD']))
+                self.notify_capture("smile", face_id, face_data)
+
+    def notify_capture(self, kind, face_id, face_data):
+        '''Crop events for the capture service (if there is one), True when the crop was queued'''
+        capture = getattr(self.parent, 'CaptureService', None)
+        return capture.notify(kind, face_id, face_data) if capture is not None else False
+
+    def snapshot_faces(self):
+        '''Shallow per face copy so later stages draw/send what was scored for this frame'''
+        return {face_id: dict(face_data) for face_id, face_data in self.state['persistent_faces'].items()}
+
+    def draw_tracked_faces(self, frame, tracked_faces=None):
         s = self.state
         c = self.controls
-        face_dir = os.path.join(self.images_dir, str(face_id))
-        os.makedirs(face_dir, exist_ok=True)
-        saved_initial_face = False
-        try:
-            #save initial face
-            while not saved_initial_face and not self.state['shutdown_event'].is_set():
-                if face_id not in s['persistent_faces']:
-                    return #kill worker if face lost 
-                face_data = s['persistent_faces'][face_id]
-                if face_data['visibility_count'] >= c['MIN_VISIBILITY_FRAMES'] and c['RECORD']: #save confirmed face
-                    if s['latest_frame'] is not None:
-                        x1, y1, x2, y2 = face_data['face_bbox']
-                        face_crop = s['latest_frame'][y1:y2, x1:x2]
-                        if face_crop.size > 0:
-                            await asyncio.to_thread(cv2.imwrite, os.path.join(face_dir, "face.jpg"), face_crop)
-                            saved_initial_face = True
-                await asyncio.sleep(0.125)
+        if tracked_faces is None:
+            tracked_faces = s['persistent_faces']
+        for face_id, face_data in tracked_faces.items():
+            # Bounding box only if face has been around a bit
+            if face_data['visibility_count'] < c['MIN_VISIBILITY_FRAMES']:
+                continue
+            if c['DRAW_FACE_BB']:
+                x1, y1, x2, y2 = face_data['face_bbox']
+                cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+                # Smile status and Face ID text
+                status_text = f"Face {face_id}: {face_data['smile_status']}" 
+                cv2.putText(frame, status_text, (x1, y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                 
-            while face_id in s['persistent_faces'] and not s['shutdown_event'].is_set() and c['RECORD']: #monitor for smiles while face is in frame, save them
-                if face_id not in s['persistent_faces']:
-                    return #kill worker if face lost face_data = persistent_faces[face_id]
-                face_data = s['persistent_faces'][face_id]
-                if face_data.get('smile_status') == "Smiling" and 'smile_bbox' in face_data:
-                    x1, y1, x2, y2 = face_data['smile_bbox']
-                    smile_crop = s['latest_frame'][y1:y2, x1:x2]
-                    
-                    if smile_crop.size > 0:
-                        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-                        filename = f"smile_{timestamp}.jpg"
-                        await asyncio.to_thread(cv2.imwrite, os.path.join(face_dir, filename), smile_crop)
-                        self.parent.DB_manager.log_smilemeta_to_db(face_id)
-                    await asyncio.sleep(0.25) # save @ 4Hz
-                else:
-                    await asyncio.sleep(0.125) #catch new smiles faster than 4Hz
-        except asyncio.CancelledError:
-            raise #approve upstream cancel basically 
-        except Exception as e:
-            print(f"Error in image saving worker for face {face_id}: {e}")
-            raise
+                if 'rotated_face_rect' in face_data and face_data['rotated_face_rect'] is not None and c['DRAW_ROTATED_BB']:
+                    box = cv2.boxPoints(face_data['rotated_face_rect'])
+                    box = np.int0(box) #for cv2 contour compatibiltity 
+                    cv2.drawContours(frame, [box], 0, (255, 0, 255), 2)
+            
+            # If smiling, draw a specific box around the mouth
+            if face_data['smile_status'] == "Smiling" and c['DRAW_SMILE_BB'] and face_data.get('smile_bbox'):
+                x1, y1, x2, y2 = face_data['smile_bbox']
+                cv2.rectangle(frame, (x1,y1),(x2,y2), (255, 50, 0), 2)
+                if c['DRAW_ROTATED_BB']:
+                    mouth_points = self.mouth_points(face_data['landmarks'])
+                    rotated_mouth_rect = cv2.minAreaRect(mouth_points)
+                    mouth_box = cv2.boxPoints(rotated_mouth_rect)
+                    mouth_box = np.int0(mouth_box)
+                    cv2.drawContours(frame, [mouth_box], 0, (255, 255, 0), 2)
@@ -0,0 +1,124 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+# (scale, jpeg quality, max fps), max fps 0 = every frame
+DEFAULT_PROFILE = (1.0, 80, 0)
+PROFILE_LIMITS = {
+    "scale": (0.1, 1.0),
+    "quality": (10, 95),
+    "max_fps": (0, 60),
+}
+
+
+def parse_profile(params, default=DEFAULT_PROFILE):
+    '''
+    Viewer stream profile from /video query params or a set_profile message,
+    missing / bad values keep the default. Profiles are tuples so equal requests share an encode.
+    '''
+    values = dict(zip(("scale", "quality", "max_fps"), default))
+    for key, cast in (("scale", float), ("quality", int), ("max_fps", int)):
+        if params.get(key) is None:
+            continue
+        try:
+            low, high = PROFILE_LIMITS[key]
+            values[key] = min(max(cast(params[key]), low), high)
+        except (TypeError, ValueError):
+            pass
+    return (round(values['scale'], 2), values['quality'], values['max_fps'])
+
+
+def encode_profile(frame, profile):
+    scale, quality, _ = profile
+    if scale < 1.0:
+        frame = cv2.resize(frame, (max(1, int(frame.shape[1] * scale)), max(1, int(frame.shape[0] * scale))),
+                           interpolation=cv2.INTER_AREA)
+    success, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        return None
+    return buffer.tobytes()
+
+
+class VideoEncoder:
+    '''
+    Encodes a frame once per distinct viewer profile (in a small thread pool, cv2 releases the GIL),
+    the bytes are shared by every viewer on that profile.
+    Viewer profiles and last send times live next to Video_Connections in the parent state.
+    '''
+    def __init__(self, parent, workers=2):
+        self.parent = parent
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-encode")
+        self.state = {
+            "frames": 0,
+            "encodes": 0,
+            "encode_ms": {}, # per profile, EMA
+        }
+
+    def add_client(self, client_id, profile):
+        s = self.parent.state
+        s['Video_Profiles'][client_id] = profile
+        s['Video_Last_Sent'][client_id] = 0.0
+
+    def remove_client(self, client_id):
+        s = self.parent.state
+        s['Video_Profiles'].pop(client_id, None)
+        s['Video_Last_Sent'].pop(client_id, None)
+
+    def due_clients(self, now):
+        '''Clients whose max_fps allows another frame now'''
+        s = self.parent.state
+        due = []
+        for client_id in list(s['Video_Connections']):
+            profile = s['Video_Profiles'].get(client_id, DEFAULT_PROFILE)
+            max_fps = profile[2]
+            if max_fps and now - s['Video_Last_Sent'].get(client_id, 0.0) < 1.0 / max_fps:
+                continue
+            due.append(client_id)
+        return due
+
+    def _timed_encode(self, frame, profile):
+        t0 = time.perf_counter()
+        jpeg = encode_profile(frame, profile)
+        return jpeg, (time.perf_counter() - t0) * 1000
+
+    def encode(self, frame, profiles):
+        '''{profile: jpeg bytes}, every profile encoded once, in parallel'''
+        profiles = set(profiles)
+        if not profiles:
+            return {}
+        futures = {profile: self.executor.submit(self._timed_encode, frame, profile) for profile in profiles}
+        encoded = {}
+        timings = self.state['encode_ms']
+        for profile, future in futures.items():
+            jpeg, ms = future.result()
+            key = "x".join(str(v) for v in profile)
+            timings[key] = ms if key not in timings else 0.9 * timings[key] + 0.1 * ms
+            if jpeg is not None:
+                encoded[profile] = jpeg
+        self.state['frames'] += 1
+        self.state['encodes'] += len(profiles)
+        return encoded
+
+    def encode_for_due(self, frame, now):
+        '''Encodes what the clients due this frame need, returns ({profile: bytes}, due client ids)'''
+        s = self.parent.state
+        due = self.due_clients(now)
+        profiles = {s['Video_Profiles'].get(client_id, DEFAULT_PROFILE) for client_id in due}
+        return self.encode(frame, profiles), due
+
+    def stats(self):
+        s = self.parent.state
+        profiles = {}
+        for profile in s['Video_Profiles'].values():
+            key = "x".join(str(v) for v in profile)
+            profiles[key] = profiles.get(key, 0) + 1
+        return {
+            "frames": self.state['frames'],
+            "encodes_per_frame": round(self.state['encodes'] / self.state['frames'], 3) if self.state['frames'] else 0.0,
+            "viewers_per_profile": profiles,
+            "encode_ms": {key: round(ms, 3) for key, ms in self.state['encode_ms'].items()},
+        }
+
+    def close(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+from Frame_pipeline import LatestQueue
+
+
+class VideoSender:
+    '''
+    One per video client: a small latest-wins mailbox and a task that drains it onto the socket.
+    The frame loop only ever offer()s, a slow viewer drops its own stale frames instead of stalling everyone.
+    A client whose mailbox stays full for evict_after_s (send stuck) is evicted.
+    '''
+    def __init__(self, client_id, websocket, depth=1, evict_after_s=5.0, on_evict=None):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.mailbox = LatestQueue(depth, "oldest")
+        self.evict_after_s = evict_after_s
+        self.on_evict = on_evict
+        self.task = None
+        self.state = {
+            "offered": 0,
+            "sent": 0,
+            "send_ms": 0.0,
+            "saturated_since": None, # first offer that found the mailbox full, None once it drains
+            "closed": False,
+        }
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def offer(self, data, now=None):
+        '''Never waits. Returns False once the client was evicted'''
+        s = self.state
+        if s['closed']:
+            return False
+        now = time.time() if now is None else now
+        if len(self.mailbox) >= self.mailbox.depth:
+            if s['saturated_since'] is None:
+                s['saturated_since'] = now
+            elif now - s['saturated_since'] > self.evict_after_s:
+                self.evict("Video client too slow")
+                return False
+        else:
+            s['saturated_since'] = None
+        s['offered'] += 1
+        self.mailbox.put_nowait(data)
+        return True
+
+    async def run(self):
+        s = self.state
+        try:
+            while True:
+                data = await self.mailbox.get()
+                t0 = time.perf_counter()
+                await self.websocket.send_bytes(data)
+                ms = (time.perf_counter() - t0) * 1000
+                s['send_ms'] = ms if s['sent'] == 0 else 0.9 * s['send_ms'] + 0.1 * ms
+                s['sent'] += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # socket gone, the endpoint's disconnect path would find out too, just quicker here
+            self.evict(None)
+
+    def evict(self, reason):
+        if self.state['closed']:
+            return
+        self.state['closed'] = True
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+        if reason is not None:
+            asyncio.create_task(self._close_socket(reason))
+        if self.on_evict is not None:
+            self.on_evict(self.client_id)
+
+    async def _close_socket(self, reason):
+        try:
+            await self.websocket.close(code=1008, reason=reason)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.state['closed'] = True
+        if self.task is not None:
+            self.task.cancel()
+
+    def stats(self, now=None):
+        s = self.state
+        now = time.time() if now is None else now
+        return {
+            "offered": s['offered'],
+            "sent": s['sent'],
+            "dropped": self.mailbox.dropped,
+            "queued": len(self.mailbox),
+            "send_ms": round(s['send_ms'], 3),
+            "saturated_s": round(now - s['saturated_since'], 3) if s['saturated_since'] is not None else 0.0,
+        }
@@ -1,29 +1,283 @@
 
 from fastapi import WebSocket
+import asyncio
+import json
 import time
 
+from Face_protocol import parse_format
+
+# faces     face rows (boxes, status, landmarks while DRAW_LANDMARKS), keyframes + deltas
+# landmarks landmark points only, {"t": "l"}, whatever DRAW_LANDMARKS is
+# smiles    smile status transitions only, {"t": "s"}, batched up to the client's rate
+# settings  settings_update broadcasts
+# metrics   server fps / lag / client counts, {"t": "m"}
+TOPICS = ("faces", "landmarks", "smiles", "settings", "metrics")
+# before a client subscribes it gets what every client got before topics existed
+DEFAULT_SUBSCRIPTION = {"faces": 0.0, "settings": 0.0}
+DEFAULT_TOPIC_HZ = {"metrics": 1.0} # when a client names a topic without a rate, 0 = every update
+MAX_PENDING_EVENTS = 100
+MAX_QUEUED_MESSAGES = 64 # per client mailbox, a client this far behind is dropped
+
+
+def parse_subscription(topics):
+    '''
+    {"faces": 10, "smiles": 0}, ["faces", "smiles"] or "faces,smiles" -> {topic: max hz}
+    unknown topics and bad rates are dropped
+    '''
+    if isinstance(topics, str):
+        topics = [t.strip() for t in topics.split(",") if t.strip()]
+    if isinstance(topics, (list, tuple)):
+        topics = {t: None for t in topics}
+    if not isinstance(topics, dict):
+        return dict(DEFAULT_SUBSCRIPTION)
+    subscription = {}
+    for topic, hz in topics.items():
+        if topic not in TOPICS:
+            continue
+        try:
+            subscription[topic] = max(0.0, float(hz)) if hz is not None else DEFAULT_TOPIC_HZ.get(topic, 0.0)
+        except (TypeError, ValueError):
+            continue
+    return subscription
+
+
+class ControlsSender:
+    '''
+    One per /controls client: an ordered mailbox and a task that writes it onto the socket, the fan-out only enqueues.
+    Unlike video nothing can be skipped (face deltas and smile events build on what came before), so instead of
+    dropping messages a client whose send is stuck past send_timeout or whose mailbox is full gets dropped.
+    '''
+    def __init__(self, websocket: WebSocket, send_timeout: float, on_error, max_queued: int = MAX_QUEUED_MESSAGES):
+        self.websocket = websocket
+        self.send_timeout = send_timeout
+        self.on_error = on_error
+        self.mailbox = asyncio.Queue(max_queued)
+        self.sending_since = None # monotonic start of the send in flight
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+        return self.task
+
+    def stuck(self, now: float):
+        return self.sending_since is not None and now - self.sending_since > self.send_timeout
+
+    def offer(self, message):
+        '''str -> text frame, bytes -> binary frame. Never waits, False if the mailbox is full'''
+        try:
+            self.mailbox.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def run(self):
+        while True:
+            message = await self.mailbox.get()
+            self.sending_since = time.monotonic()
+            try:
+                if isinstance(message, str):
+                    await self.websocket.send_text(message)
+                else:
+                    await self.websocket.send_bytes(message)
+            except Exception:
+                self.on_error(self.websocket, "send failed")
+                return
+            self.sending_since = None
+            self.mailbox.task_done()
+
+    def stop(self):
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+
 class ControlsManager:
-    def __init__(self):
+    def __init__(self, send_timeout: float = 1.0):
         self.active: set[WebSocket] = set()
         self.client_ping_times: dict[WebSocket, float] = {}
+        # face update encoding per client, json unless it asked for binary (/controls?format=binary or set_format)
+        self.formats: dict[WebSocket, str] = {}
+        # joined (or switched format) since the last face update, their next one has to be a keyframe
+        self.needs_keyframe: set[WebSocket] = set()
+        # topic -> max hz per client (/controls?topics=smiles,metrics or a subscribe message)
+        self.subscriptions: dict[WebSocket, dict[str, float]] = {}
+        self.last_sent: dict[WebSocket, dict[str, float]] = {}
+        # events waiting for a rate limited client's next slot, per topic
+        self.pending: dict[WebSocket, dict[str, list]] = {}
+        # per client mailbox + writer task, a send stuck this long gets the client dropped
+        self.senders: dict[WebSocket, ControlsSender] = {}
+        self.send_timeout = send_timeout
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active.add(websocket)
+        self.formats[websocket] = parse_format(websocket.query_params.get("format"))
+        self.needs_keyframe.add(websocket)
+        topics = websocket.query_params.get("topics")
+        self.subscribe(websocket, parse_subscription(topics) if topics else dict(DEFAULT_SUBSCRIPTION))
 
     def disconnect(self, websocket: WebSocket):
         self.active.discard(websocket)
         self.client_ping_times.pop(websocket, None)
+        self.formats.pop(websocket, None)
+        self.needs_keyframe.discard(websocket)
+        self.subscriptions.pop(websocket, None)
+        self.last_sent.pop(websocket, None)
+        self.pending.pop(websocket, None)
+        sender = self.senders.pop(websocket, None)
+        if sender is not None:
+            sender.stop()
 
-    async def send_json(self, data: dict):
-        stale = []
-        for ws in list(self.active):
-            try:
-                await ws.send_json(data)
-            except Exception:
-                stale.append(ws)
-        for s in stale:
-            self.disconnect(s)
+    def subscribe(self, websocket: WebSocket, subscription: dict):
+        '''Replaces the client's topics, {topic: max hz}'''
+        old = self.subscriptions.get(websocket, {})
+        self.subscriptions[websocket] = subscription
+        self.last_sent[websocket] = {}
+        self.pending[websocket] = {}
+        if "faces" in subscription and "faces" not in old:
+            self.needs_keyframe.add(websocket)
+        return subscription
+
+    def subscribers(self, topic: str):
+        return [ws for ws in list(self.active) if topic in self.subscriptions.get(ws, DEFAULT_SUBSCRIPTION)]
+
+    def has_subscribers(self, topic: str):
+        return any(topic in self.subscriptions.get(ws, DEFAULT_SUBSCRIPTION) for ws in self.active)
+
+    def _due(self, websocket: WebSocket, topic: str, now: float):
+        hz = self.subscriptions.get(websocket, DEFAULT_SUBSCRIPTION).get(topic, 0.0)
+        last = self.last_sent.setdefault(websocket, {})
+        if hz and now - last.get(topic, float("-inf")) < 1.0 / hz:
+            return False
+        last[topic] = now
+        return True
+
+    def set_format(self, websocket: WebSocket, fmt: str):
+        self.formats[websocket] = parse_format(fmt, self.formats.get(websocket, "json"))
+        self.needs_keyframe.add(websocket)
+        return self.formats[websocket]
+
+    async def send_json(self, data: dict, exclude: WebSocket = None):
+        """Serialize once, write to every client at the same time"""
+        clients = [ws for ws in list(self.active) if ws is not exclude]
+        if not clients:
+            return
+        text = json.dumps(data, separators=(",", ":"))
+        self._fanout({ws: text for ws in clients})
+
+    async def publish(self, topic: str, builder, now: float = None, exclude: WebSocket = None):
+        """builder() -> dict | None is only called if some subscriber is due, the json goes out once to all of them"""
+        now = time.time() if now is None else now
+        clients = [ws for ws in self.subscribers(topic) if ws is not exclude and self._due(ws, topic, now)]
+        if not clients:
+            return
+        data = builder()
+        if data is None:
+            return
+        text = json.dumps(data, separators=(",", ":"))
+        self._fanout({ws: text for ws in clients})
+
+    async def publish_events(self, topic: str, events: list, wrap, now: float = None):
+        """
+        Events are queued per subscriber and flushed when its rate allows, so a slow rate batches
+        instead of losing transitions. wrap(events) -> message dict
+        """
+        now = time.time() if now is None else now
+        texts = {} # clients with the same backlog share one serialization
+        sends = {}
+        for ws in self.subscribers(topic):
+            queue = self.pending.setdefault(ws, {}).setdefault(topic, [])
+            queue.extend(events)
+            del queue[:-MAX_PENDING_EVENTS]
+            if not queue or not self._due(ws, topic, now):
+                continue
+            key = id(events) if queue == events else None
+            if key is None or key not in texts:
+                text = json.dumps(wrap(queue), separators=(",", ":"))
+                if key is not None:
+                    texts[key] = text
+            else:
+                text = texts[key]
+            sends[ws] = text
+            self.pending[ws][topic] = []
+        if sends:
+            self._fanout(sends)
+
+    async def send_formats(self, builders: dict, keyframe_builders: dict = None, topic: str = "faces", now: float = None):
+        """
+        builders = {format: () -> dict | bytes | None}, only formats some due subscriber uses get built, each once.
+        Dicts go out as json text, bytes as binary frames, None = nothing to send.
+        Clients waiting for a keyframe get keyframe_builders instead (None = this update is one anyway),
+        a subscriber skipped by its rate missed a delta so it waits for a keyframe too
+        """
+        now = time.time() if now is None else now
+        by_format = {}
+        for ws in self.subscribers(topic):
+            if not self._due(ws, topic, now):
+                if keyframe_builders is not None:
+                    self.needs_keyframe.add(ws)
+                continue
+            keyframe = keyframe_builders is not None and ws in self.needs_keyframe
+            by_format.setdefault((self.formats.get(ws, "json"), keyframe), []).append(ws)
+            self.needs_keyframe.discard(ws)
+        sends = {}
+        for (fmt, keyframe), clients in by_format.items():
+            payload = (keyframe_builders if keyframe else builders)[fmt]()
+            if payload is None:
+                continue
+            if not isinstance(payload, (bytes, bytearray)):
+                payload = json.dumps(payload, separators=(",", ":"))
+            sends.update({ws: payload for ws in clients})
+        if sends:
+            self._fanout(sends)
+
+    def _fanout(self, messages: dict):
+        """
+        {websocket: text or bytes}, queued on each client's sender without waiting for any socket.
+        Clients stuck in a send past send_timeout or too far behind to queue more are dropped and closed
+        """
+        now = time.monotonic()
+        for ws, message in messages.items():
+            if ws not in self.active:
+                continue # dropped earlier in this tick
+            sender = self.senders.get(ws)
+            if sender is None:
+                sender = self.senders[ws] = ControlsSender(ws, self.send_timeout, self.drop)
+                sender.start()
+            if sender.stuck(now):
+                self.drop(ws, "send timed out")
+            elif not sender.offer(message):
+                self.drop(ws, "send queue full")
+
+    async def flush(self, timeout: float = 1.0):
+        """Waits (up to timeout) until every client's mailbox is on the wire"""
+        joins = [asyncio.create_task(sender.mailbox.join()) for sender in list(self.senders.values())]
+        if joins:
+            _, pending = await asyncio.wait(joins, timeout=timeout)
+            for task in pending:
+                task.cancel()
+
+    async def close(self):
+        """Stops every client's sender (shutdown), the sockets themselves are left to the caller"""
+        senders = list(self.senders.values())
+        self.senders.clear()
+        for sender in senders:
+            sender.stop()
+        await asyncio.gather(*(sender.task for sender in senders if sender.task is not None), return_exceptions=True)
+
+    def drop(self, websocket: WebSocket, reason: str):
+        """
+        Forget a client and close its socket (a cancelled send may have left half a frame on it),
+        so the frontend sees the close and reconnects instead of sitting on a socket that gets nothing
+        """
+        self.disconnect(websocket)
+        asyncio.create_task(self._close(websocket, reason))
+
+    @staticmethod
+    async def _close(websocket: WebSocket, reason: str):
+        try:
+            await websocket.close(code=1008, reason=reason)
+        except Exception:
+            pass
 
     async def recv_from(self, websocket: WebSocket):
         try:
@@ -2,6 +2,7 @@
 
 
 import asyncio 
+import itertools
 import time
 import json
 import cv2
@@ -9,13 +10,18 @@ import cv2
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
-from WS_controls import ControlsManager
+from WS_controls import ControlsManager, parse_subscription
+from Video_encoder import DEFAULT_PROFILE, parse_profile
+from Video_sender import VideoSender
+from Frame_ring import frame_ref
 
 class MultiSocketManager:
     def __init__(self, parent):
         self.ControlsManager = ControlsManager()
         self.parent = parent
         self.video_ping_times: dict[WebSocket, float] = {}
+        self.video_evictions = 0
+        self.video_client_ids = itertools.count(1) # senders and profiles are keyed by it, a timestamp could repeat
 
     def cleanup_resources(self):
         """Clean up all resources before exit"""
@@ -28,15 +34,21 @@ class MultiSocketManager:
                     asyncio.create_task(websocket.close(code=1000, reason="Server shutting down"))
                 except Exception as e:
                     print(f"Error closing data WebSocket: {e}")
+            asyncio.create_task(manager.close())
             manager.active.clear()
         
         # Close video WebSocket connections
+        for sender in s['Video_Senders'].values():
+            sender.stop()
+        s['Video_Senders'].clear()
         for client_id, websocket in list(s['Video_Connections'].items()):
             try:
                 asyncio.create_task(websocket.close(code=1000, reason="Server shutting down"))
             except Exception as e:
                 print(f"Error closing video WebSocket {client_id}: {e}")
         s['Video_Connections'].clear()
+        s['Video_Profiles'].clear()
+        s['Video_Last_Sent'].clear()
         print("Sockets cleanup completed.")
 
     # Frame encoding utilities
@@ -52,6 +64,32 @@ class MultiSocketManager:
             print(f"Error encoding frame to JPEG: {e}")
             return None
 
+    def new_video_client_id(self):
+        return f"client_{next(self.video_client_ids)}"
+
+    def add_video_client(self, client_id, websocket, profile):
+        s = self.parent.state
+        sender = VideoSender(client_id, websocket, depth=s['video_mailbox_depth'],
+                             evict_after_s=s['video_evict_after_s'], on_evict=self._evicted)
+        self.parent.VideoEncoder.add_client(client_id, profile)
+        s['Video_Senders'][client_id] = sender
+        s['Video_Connections'][client_id] = websocket
+        sender.start()
+
+    def remove_video_client(self, client_id):
+        s = self.parent.state
+        websocket = s['Video_Connections'].pop(client_id, None)
+        sender = s['Video_Senders'].pop(client_id, None)
+        if sender is not None:
+            sender.stop()
+        self.parent.VideoEncoder.remove_client(client_id)
+        if websocket is not None:
+            self.video_ping_times.pop(websocket, None)
+
+    def _evicted(self, client_id):
+        self.video_evictions += 1
+        self.remove_video_client(client_id)
+
     def register(self, app: FastAPI, analysis_instance):
         self.analysis = analysis_instance
         app.add_middleware(
@@ -98,12 +136,7 @@ class MultiSocketManager:
                                     settings_update = {"type":"settings_update","key":key,"value":c[key]}
                                     
                                     # Send to other data WebSocket clients (not the sender)
-                                    for ws_client in list(self.ControlsManager.active):
-                                        if ws_client != websocket:  # Don't send back to sender
-                                            try:
-                                                await ws_client.send_json(settings_update)
-                                            except Exception as e:
-                                                print(f"Error sending settings update to data client: {e}")
+                                    await self.ControlsManager.publish("settings", lambda: settings_update, exclude=websocket)
                                     
                                     # Do not send settings over the video WebSocket
                                 elif key == "RESET_TILT":
@@ -123,12 +156,21 @@ class MultiSocketManager:
                                     "RECORD": c['RECORD'],
                                     "ROTATED_BB_FRAME_AVERAGE": c['ROTATED_BB_FRAME_AVERAGE'],
                                     "TEST_MODE": c.get('TEST_MODE', False),
+                                    "OVERLAY_ONLY": c.get('OVERLAY_ONLY', False),
                                 }
                                 await websocket.send_json({"type": "current_settings", "settings": settings})
                             elif payload.get("type") == "ping":
                                 #print("Received ping from data WebSocket - sending pong")
                                 self.ControlsManager.update_ping_time(websocket)
                                 await websocket.send_json({"type": "pong"})
+                            elif payload.get("type") == "set_format":
+                                # face updates as json (default) or the binary layout in Face_protocol
+                                fmt = self.ControlsManager.set_format(websocket, payload.get("format"))
+                                await websocket.send_json({"type": "format", "format": fmt})
+                            elif payload.get("type") == "subscribe":
+                                # {"topics": {"faces": 10, "smiles": 0}} or ["smiles", "metrics"], rates in Hz, 0 = every update
+                                topics = self.ControlsManager.subscribe(websocket, parse_subscription(payload.get("topics")))
+                                await websocket.send_json({"type": "subscribed", "topics": topics})
                         except Exception as e:
                             print(f"Error processing data WebSocket message: {e}")
                             pass
@@ -147,8 +189,9 @@ class MultiSocketManager:
             s = self.parent.state
             c = self.parent.controls
             await websocket.accept()
-            client_id = f"client_{int(time.time() * 1000)}"
-            s['Video_Connections'][client_id] = websocket
+            client_id = self.new_video_client_id()
+            # stream profile from the url, e.g. /video?scale=0.5&quality=60&max_fps=10
+            self.add_video_client(client_id, websocket, parse_profile(websocket.query_params))
             
             #print(f"Video client connected: {client_id}")
             #print(f"Video WebSocket connected. Active video connections: {len(Video_Connections)}")
@@ -166,6 +209,11 @@ class MultiSocketManager:
                                 #print("Received ping from video WebSocket - sending pong")
                                 self.video_ping_times[websocket] = time.time()
                                 await websocket.send_json({"type": "pong"})
+                            elif payload.get("type") == "set_profile":
+                                profile = parse_profile(payload, s['Video_Profiles'].get(client_id, DEFAULT_PROFILE))
+                                self.parent.VideoEncoder.add_client(client_id, profile)
+                                await websocket.send_json({"type": "profile", "scale": profile[0],
+                                                           "quality": profile[1], "max_fps": profile[2]})
                             # do not handle settings on video websocket
                         except Exception as e:
                             print(f"Error processing video WebSocket message: {e}")
@@ -179,8 +227,7 @@ class MultiSocketManager:
             except Exception as e:
                 print(f"Error in video stream: {e}")
             finally:
-                s['Video_Connections'].pop(client_id, None)
-                self.video_ping_times.pop(websocket, None)
+                self.remove_video_client(client_id)
 
         @app.get("/")
         async def root():
@@ -191,13 +238,14 @@ class MultiSocketManager:
         async def test_frame():
             """Test endpoint to verify frame encoding (binary length only, no base64)"""
             s = self.parent.state
-            if s['latest_frame'] is not None:
-                jpeg_bytes = MultiSocketManager.cvframe_to_jpeg_bytes(s['latest_frame'])
+            latest = s['latest_frame'].copy() if s['latest_frame'] is not None else None
+            if latest is not None:
+                jpeg_bytes = MultiSocketManager.cvframe_to_jpeg_bytes(latest)
                 if jpeg_bytes:
                     return {
                         "status": "success",
                         "byte_length": len(jpeg_bytes),
-                        "frame_shape": s['latest_frame'].shape if hasattr(s['latest_frame'], 'shape') else "unknown"
+                        "frame_shape": latest.shape
                     }
             return {"status": "no_frame_available"}
 
@@ -211,13 +259,29 @@ class MultiSocketManager:
                 "latest_frame_available": s['latest_frame'] is not None,
                 "webcam_opened": s['webcam'].isOpened() if s['webcam'] else False,
                 "shutdown_event_set": s['shutdown_event'].is_set(),
+                "inference": self.parent.SmileIDer.InferenceBackend.stats() if self.parent.SmileIDer.InferenceBackend else None,
+                "loop_lag_ms": round(s.get('loop_lag_ms', 0.0), 3),
+                "flow": self.parent.SmileIDer.FlowTracker.stats(),
+                "roi": self.parent.SmileIDer.RoiInference.stats(),
+                "video_encode": self.parent.VideoEncoder.stats(),
+                "face_delta": self.parent.FaceDelta.stats(),
+                "frame_ring": self.parent.FrameRing.stats(),
+                "capture": self.parent.CaptureService.stats(),
+                "crop_store": self.parent.CropStore.stats(),
+                "db_writer": self.parent.DB_manager.stats(),
+                "retention": self.parent.RetentionService.stats(),
+                "crop_server": self.parent.CropServer.stats(),
+                "video_senders": {client_id: sender.stats() for client_id, sender in s['Video_Senders'].items()},
+                "video_evictions": self.video_evictions,
                 "global_settings": {
                     "DRAW_LANDMARKS": c['DRAW_LANDMARKS'],
                     "DRAW_FACE_BB": c['DRAW_FACE_BB'],
                     "DRAW_SMILE_BB": c['DRAW_SMILE_BB'],
                     "DRAW_ROTATED_BB": c['DRAW_ROTATED_BB'],
-                    "RECORD": c['RECORD']
-                }
+                    "RECORD": c['RECORD'],
+                    "OVERLAY_ONLY": c.get('OVERLAY_ONLY', False),
+                },
+                "pipeline": self.parent.FramePipeline.stats() if hasattr(self.parent, 'FramePipeline') else None,
             }
 
         @app.get("/test-broadcast")
@@ -230,12 +294,13 @@ class MultiSocketManager:
                     ret, frame = s['webcam'].read()
                     if ret:
                         frame = cv2.flip(frame, 1)
-                        s['latest_frame'] = frame.copy()
+                        self.parent.FrameRing.set_latest(frame_ref(frame))
                         s['h'], s['w'], _ = frame.shape
             except Exception:
                 pass
-            if s['latest_frame'] is not None and s['Video_Connections']:
-                await self.broadcast_video_frame(s['latest_frame'])
+            latest = s['latest_frame'].copy() if s['latest_frame'] is not None else None
+            if latest is not None and s['Video_Connections']:
+                await self.broadcast_video_frame(latest)
                 return {"status": "frame_broadcasted", "clients": len(s['Video_Connections'])}
             return {"status": "no_frame_or_clients", "frame_available": s['latest_frame'] is not None, "clients": len(s['Video_Connections'])}
 
@@ -243,18 +308,22 @@ class MultiSocketManager:
         s = self.parent.state
         if not s['Video_Connections']:
             return
-        jpeg_bytes = MultiSocketManager.cvframe_to_jpeg_bytes(frame)
-        if jpeg_bytes is None:
-            return
-        disconnected_clients = []
-        for client_id, websocket in s['Video_Connections'].items():
-            try:
-                # Send raw JPEG bytes over the binary WebSocket channel
-                await websocket.send_bytes(jpeg_bytes)
-            except Exception:
-                disconnected_clients.append(client_id)
-        for client_id in disconnected_clients:
-            s['Video_Connections'].pop(client_id, None)
+        # encode off the event loop, once per viewer profile
+        now = time.time()
+        encoded, due = await asyncio.to_thread(self.parent.VideoEncoder.encode_for_due, frame, now)
+        self.broadcast_video_profiles(encoded, due, now)
+
+    def broadcast_video_profiles(self, encoded, client_ids, frame_ts):
+        '''encoded = {profile: jpeg bytes}, each client's mailbox gets the bytes of its own profile'''
+        s = self.parent.state
+        for client_id in client_ids:
+            sender = s['Video_Senders'].get(client_id)
+            jpeg_bytes = encoded.get(s['Video_Profiles'].get(client_id, DEFAULT_PROFILE))
+            if sender is None or jpeg_bytes is None:
+                continue
+            if sender.offer(jpeg_bytes):
+                # frame time, not send time, so max_fps is measured on the same clock due_clients uses
+                s['Video_Last_Sent'][client_id] = frame_ts
 
     async def _cleanup_task(self):
         """Background task to cleanup stale connections every 10 seconds"""
@@ -285,7 +354,7 @@ class MultiSocketManager:
             s = self.parent.state
             for client_id, ws in list(s['Video_Connections'].items()):
                 if ws == websocket:
-                    s['Video_Connections'].pop(client_id, None)
+                    self.remove_video_client(client_id)
                     break
             self.video_ping_times.pop(websocket, None)
             try:
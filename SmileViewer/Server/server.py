@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import time
 import signal
 import argparse
@@ -12,6 +13,15 @@ import glob
 from WS_multi_socket import MultiSocketManager
 from DB_manager import DBmanager
 from Smile_ID import SmileIDer
+from Frame_pipeline import FramePipeline
+from Video_encoder import VideoEncoder
+from Frame_ring import FrameRing
+from Capture_service import CaptureService
+from Crop_store import create_crop_store
+from Smile_queries import SmileQueries
+from Retention_service import RetentionService
+from Crop_server import CropServer
+from Face_protocol import FaceDelta, delta_binary, delta_json, faces_binary, faces_json
 
 class SmileAnalysisServer:
     def __init__(self):
@@ -25,10 +35,24 @@ class SmileAnalysisServer:
         self.SmileIDer.DB_manager = DBmanager()
         self.DB_manager = self.SmileIDer.DB_manager
         self.SmileIDer.state = self.state
+        self.SmileIDer.init_inference_backend(self.state['inference_backend'])
         self.app = FastAPI(lifespan=self.lifespan)
         # Register websockets against this app
         self.MultiSocketManager = MultiSocketManager(self)
         self.MultiSocketManager.register(self.app, self)
+        self.SmileQueries = SmileQueries(self, readers=self.state['db_readers'])
+        self.SmileQueries.register(self.app)
+        self.FramePipeline = FramePipeline(self)
+        self.VideoEncoder = VideoEncoder(self, workers=self.state['video_encode_workers'])
+        self.FaceDelta = FaceDelta(self)
+        self.FrameRing = FrameRing(self, slots=self.state['frame_ring_slots'])
+        self.CropStore = create_crop_store(self.state['crop_store'], os.path.join(os.getcwd(), "server", "data"))
+        self.CaptureService = CaptureService(self, workers=self.state['capture_workers'],
+                                             depth=self.state['capture_queue_depth'], store=self.CropStore)
+        self.RetentionService = RetentionService(self, slice_rows=self.state['retention_slice_rows'],
+                                                 interval_s=self.state['retention_interval_s'])
+        self.CropServer = CropServer(self, cache_mb=self.state['crop_cache_mb'], thumb_cache_mb=self.state['thumb_cache_mb'])
+        self.CropServer.register(self.app)
 
     def signal_handler(self, signum, frame):
         """Handle shutdown signals gracefully"""
@@ -57,8 +81,30 @@ class SmileAnalysisServer:
             "latest_frame": None,
             "shutdown_event": asyncio.Event(),
             "persistent_faces": {},
+            "smile_status_sent": {}, # face_id -> status as of the last controls update, for the smiles topic
             "hands_in_frame": [],
             "Video_Connections": {},
+            # per video client: (scale, quality, max_fps) profile and last send time, keyed like Video_Connections
+            "Video_Profiles": {},
+            "Video_Last_Sent": {},
+            "video_encode_workers": 2,
+            "frame_ring_slots": 4, # reusable capture buffers, the ring grows by itself if the pipeline holds more
+            # crop writers for RECORD, crops past the queue depth are dropped (and counted)
+            "capture_workers": 2,
+            "capture_queue_depth": 32,
+            # "directory": a jpeg file per crop under data/images, "segments": crops packed into hourly files
+            "crop_store": "directory",
+            "db_readers": 2, # read-only connections for the /smiles analytics endpoints
+            # retention passes (see RETENTION controls), rows per slice / transaction
+            "retention_interval_s": 60.0,
+            "retention_slice_rows": 500,
+            # /crops endpoints: recently served crops kept in memory, thumbnails kept on disk (server/data/thumbs)
+            "crop_cache_mb": 64,
+            "thumb_cache_mb": 256,
+            # per video client sender task: latest-wins mailbox, evicted when it stays full this long
+            "Video_Senders": {},
+            "video_mailbox_depth": 1,
+            "video_evict_after_s": 5.0,
             # Test mode state
             "test_images": None,
             "test_image_index": 0,
@@ -69,6 +115,13 @@ class SmileAnalysisServer:
             # Camera Configuration
             "webcam": webcam,
             "max_fps": max_fps,
+
+            # Inference: "inprocess" (blocks the event loop), "thread" or "process" (worker processes, shared memory frames)
+            "inference_backend": "thread",
+            "loop_lag_ms": 0.0,
+
+            # Frame stages: pipelined (overlapping) or one frame at a time
+            "pipeline": FramePipeline.default_config(),
         }
         controls = {
             # Face and Smile Detection controlsuration
@@ -76,6 +129,8 @@ class SmileAnalysisServer:
             "MIN_VISIBILITY_FRAMES": MIN_VISIBILITY_FRAMES,
             "FRAME_HISTORY_LEN": MIN_VISIBILITY_FRAMES,
             "PF_SHIFT_BUFF": 0.15,
+            "TRACK_IOU_WEIGHT": 0.1, # how much box overlap counts next to center distance when matching faces
+            "TRACK_MAX_COAST_FRAMES": 2, # missed detections a face survives on its predicted motion
             "MAR_VAR_THRESHOLD": 0.005,
             "SMILE_THRESH": 0.35,
             "SMILE_CONFIDENCE": 0.9,
@@ -91,7 +146,40 @@ class SmileAnalysisServer:
             "DRAW_SMILE_BB": True,
             "DRAW_ROTATED_BB": False,
             "RECORD": False,
+            "CAPTURE_SMILE_HZ": 4, # smile crops saved per face per second while smiling
+            # skip smile crops that look like the face's last saved one (8x8 thumbnail difference), still keep one every N s
+            "CAPTURE_DEDUP": True,
+            "CAPTURE_DEDUP_DISTANCE": 0.3,
+            "CAPTURE_DEDUP_KEEP_EVERY_S": 2.0,
+            # background cleanup of server/data: smiles older than the max age get rolled up into per hour counts,
+            # past the disk budget the oldest crops go first (0 = no limit). It deletes data: off until an operator sets it
+            "RETENTION": False,
+            "RETENTION_MAX_AGE_DAYS": 0,
+            "RETENTION_DISK_BUDGET_MB": 0,
             "ROTATED_BB_FRAME_AVERAGE": 3,
+            # No cv2 drawing, video goes out clean and the frontend overlay draws boxes from the controls data
+            "OVERLAY_ONLY": False,
+            # Run hands and face mesh at the same time (thread/process backends), False = one after the other
+            "CONCURRENT_INFERENCE": True,
+            # Infer on small crops around tracked faces, whole frame every ROI_FULL_FRAME_EVERY frames
+            "ROI_INFERENCE": False,
+            "ROI_SIZE": 192, # crops are scaled onto a fixed ROI_SIZE square, the face mesh model input is 192 anyway
+            "ROI_FACE_MARGIN": 0.3, # crop margin around the face boxes, fraction of their size
+            "ROI_HAND_MARGIN": 0.75, # hands only matter when near a face
+            "ROI_FULL_FRAME_EVERY": 15,
+            "ROI_MIN_FACE_PX": 96, # faces would come out smaller than this on the shared crop: full frame instead
+            # Detect-then-track: full FaceMesh every K frames, optical flow in between
+            "FLOW_TRACKING": False,
+            "FLOW_MAX_K": 6,
+            "FLOW_TARGET_FPS": 24, # loop budget K is sized for
+            "FLOW_MOTION_PX": 12.0, # per frame face motion (px) at which every frame gets a full detection
+            "FLOW_MIN_CONFIDENCE": 0.8, # share of landmarks flow must keep, else detect now
+            # Score all tracked faces in one vectorized pass once this many are tracked
+            "BATCH_SCORING_MIN_FACES": 6,
+            # Face updates: keyframe every FACE_KEYFRAME_EVERY, in between only faces that changed
+            "FACE_DELTA": True,
+            "FACE_DELTA_TOLERANCE_PX": 2, # box / landmark movement below this isn't resent
+            "FACE_KEYFRAME_EVERY": 30,
             # QOL controls
             "TEST_MODE": False,
         }
@@ -102,12 +190,26 @@ class SmileAnalysisServer:
         "smile_metadata_queue": Queue(),'''
         return state, controls
 
+    async def monitor_loop_lag(self, interval=0.1):
+        '''How late the event loop wakes up, anything blocking it (e.g. inprocess inference) shows here'''
+        s = self.state
+        loop = asyncio.get_running_loop()
+        while not s['shutdown_event'].is_set():
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            s['loop_lag_ms'] = 0.9 * s['loop_lag_ms'] + 0.1 * lag_ms
+
     @asynccontextmanager
     async def lifespan(self, app: FastAPI):
         task = asyncio.create_task(self.loop())
+        lag_task = asyncio.create_task(self.monitor_loop_lag())
+        self.CaptureService.start()
+        self.RetentionService.start()
         try:
             yield
         finally:
+            lag_task.cancel()
             print("FastAPI lifespan: Starting shutdown process...")
             try:
                 await asyncio.wait_for(self.state['shutdown_event'].wait(), timeout=2.0)
@@ -120,19 +222,15 @@ class SmileAnalysisServer:
                     await asyncio.wait_for(task, timeout=3.0)
                 except (asyncio.CancelledError, asyncio.TimeoutError):
                     print("Main loop task cancelled or timed out")
+            await self.CaptureService.close()
+            await self.RetentionService.close()
+            self.CropStore.close()
             self.cleanup_resources()
             print("FastAPI lifespan: Shutdown process completed")
 
     def flush_persistent_faces(self):
-        """Cancel workers and remove all tracked faces."""
-        s = self.state
-        for face_id, face_data in list(s['persistent_faces'].items()):
-            try:
-                if 'worker_task' in face_data and face_data['worker_task'] and not face_data['worker_task'].done():
-                    face_data['worker_task'].cancel()
-            except Exception:
-                pass
-        s['persistent_faces'].clear()
+        """Remove all tracked faces, crops already queued still get written."""
+        self.state['persistent_faces'].clear()
 
     def init_test_images(self):
         """Initialize and return test images from Samples/Faces directory."""
@@ -184,65 +282,184 @@ class SmileAnalysisServer:
     
         return frame
 
-    async def Send_Data_update(self):
+    async def Send_Data_update(self, tracked_faces=None):
         now = time.time()
         s = self.state
         c = self.controls
-        if len(self.MultiSocketManager.ControlsManager.active) > 0:
-            compact = []
-            for  face_id, f in s['persistent_faces'].items():
-                x1, y1, x2, y2 = f['face_bbox']
-                if f.get('smile_bbox'):
-                    sx1, sy1, sx2, sy2 = f['smile_bbox']
-                else:
-                    sx1, sy1, sx2, sy2 = (-1, -1, -1, -1)
-                row = [face_id, x1, y1, x2, y2, sx1, sy1, sx2, sy2, f['smile_status'] ]
-                if c['DRAW_LANDMARKS']:
-                    w, h = s['w'], s['h']
-                    all_landparks = f['landmarks']
-                    subset = self.SmileIDer.LandmarksSubSets['face_mesh_subset']
-                    landmarks = [[int(all_landparks[i].x * w), int(all_landparks[i].y * h)] for i in subset]
-                    row.append(landmarks)
-                compact.append(row)
-            faces_msg = {"t": "f", "ts": now, "f": compact}
-            await self.MultiSocketManager.ControlsManager.send_json(faces_msg)
+        if tracked_faces is None:
+            tracked_faces = s['persistent_faces']
+        manager = self.MultiSocketManager.ControlsManager
+        # transitions are followed even with nobody listening, a new subscriber starts from the current statuses
+        transitions = [[face_id, s['smile_status_sent'].get(face_id), f['smile_status']]
+                       for face_id, f in tracked_faces.items() if s['smile_status_sent'].get(face_id) != f['smile_status']]
+        s['smile_status_sent'] = {face_id: f['smile_status'] for face_id, f in tracked_faces.items()}
+        if len(manager.active) == 0:
+            return
+        # every topic is only built when it has a subscriber due, landmark pixels once for faces + landmarks
+        pixels = None
+        def landmark_pixels():
+            nonlocal pixels
+            if pixels is None:
+                pixels = {face_id: self.SmileIDer.landmark_pixels(f['landmarks']) for face_id, f in tracked_faces.items()}
+            return pixels
+        if manager.has_subscribers("faces"):
+            await self.send_face_rows(manager, tracked_faces, now, landmark_pixels() if c['DRAW_LANDMARKS'] else None)
+        await manager.publish("landmarks", lambda: {
+            "t": "l", "ts": now, "l": [[face_id, points.tolist()] for face_id, points in landmark_pixels().items()],
+        }, now)
+        if transitions:
+            await manager.publish_events("smiles", transitions, lambda events: {"t": "s", "ts": now, "e": events}, now)
+        await manager.publish("metrics", lambda: self.metrics_message(now, len(tracked_faces)), now)
 
-    async def loop(self):
+    async def send_face_rows(self, manager, tracked_faces, now, landmarks):
+        keyframe, faces, face_landmarks, removed = self.FaceDelta.update(tracked_faces, landmarks)
+        # each format is only built if some client uses it
+        if keyframe:
+            await manager.send_formats({
+                "json": lambda: faces_json(faces, now, face_landmarks),
+                "binary": lambda: faces_binary(faces, now, face_landmarks),
+            }, now=now)
+            return
+        # deltas carry only what moved past FACE_DELTA_TOLERANCE_PX, late joiners get the baseline instead
+        changed = bool(faces or removed)
+        baseline, baseline_landmarks = self.FaceDelta.keyframe()
+        await manager.send_formats({
+            "json": lambda: delta_json(faces, removed, now, face_landmarks) if changed else None,
+            "binary": lambda: delta_binary(faces, removed, now, face_landmarks) if changed else None,
+        }, keyframe_builders={
+            "json": lambda: faces_json(baseline, now, baseline_landmarks),
+            "binary": lambda: faces_binary(baseline, now, baseline_landmarks),
+        }, now=now)
+
+    def metrics_message(self, now, face_count):
+        s = self.state
+        return {
+            "t": "m",
+            "ts": now,
+            "fps": round(self.FramePipeline.stats()['fps'], 2),
+            "loop_lag_ms": round(s.get('loop_lag_ms', 0.0), 3),
+            "faces": face_count,
+            "video_clients": len(s['Video_Connections']),
+            "controls_clients": len(self.MultiSocketManager.ControlsManager.active),
+        }
+
+    # Frame stages, each takes and returns a packet dict (None = skip this frame)
+    # run back to back by loop() or overlapped by FramePipeline
+    async def read_webcam(self, into=None):
+        '''Reads straight into a ring buffer when it fits, cv2 hands back a new array when it doesn't'''
+        s = self.state
+        if into is None:
+            ret, frame = await asyncio.to_thread(s['webcam'].read)
+        else:
+            ret, frame = await asyncio.to_thread(s['webcam'].read, into)
+        return frame if ret else None
+
+    async def capture_frame(self, _packet=None):
         s = self.state
         c = self.controls
+        # every buffer below lives in a recycled ring slot, the pipeline gives it back when the packet is done
+        slot = self.FrameRing.acquire()
+        ring = self.FrameRing.state
+        # Decide frame source: webcam or test images
+        frame = None
+        if c.get('TEST_MODE', False):
+            # Try to get test frame, fallback to webcam if needed
+            frame = await self.get_next_test_frame()
+        if frame is None:
+            frame = await self.read_webcam(slot.buffers.get('raw'))
+            if frame is None:
+                self.FrameRing.release(slot)
+                return None
+            slot.buffers['raw'] = frame # same array unless the size changed
+        shape = frame.shape
+        # front faceing so flip -> more like a mirror
+        flipped = cv2.flip(frame, 1, dst=slot.buffer('frame', shape, ring))
+        # annotations are only for video viewers, and in OVERLAY_ONLY the browser draws them from the controls data.
+        # decided per frame here so a toggle mid-pipeline can't draw on a frame the workers share
+        draw = bool(s['Video_Connections']) and not c.get('OVERLAY_ONLY', False)
+        pristine_name = "frame"
+        if draw: # un-annotated copy for async workers, only needed if we draw
+            pristine_name = "pristine"
+            np.copyto(slot.buffer('pristine', shape, ring), flipped)
+        #need h,w for scale info on mediapipe outputs
+        s['h'], s['w'], _ = shape
+        #BGR -> RGB
+        rgb_frame = cv2.cvtColor(flipped, cv2.COLOR_BGR2RGB, dst=slot.buffer('rgb', shape, ring))
+        # stages with nothing to do for this frame skip their thread hop in the pipeline
+        inline_stages = () if draw else ("annotate",) if s['Video_Connections'] else ("annotate", "encode")
+        return {"ts": time.time(), "frame": flipped, "pristine": slot.buffers[pristine_name], "rgb": rgb_frame,
+                "draw": draw, "inline_stages": inline_stages, "slot": slot, "pristine_ref": slot.ref(pristine_name)}
+
+    async def infer_frame(self, packet):
+        #get hands and faces, faces in frame don't need to persist
+        packet['hands'], packet['faces'] = await self.SmileIDer.detect(packet['rgb'])
+        return packet
+
+    def track_frame(self, packet):
+        s = self.state
+        # crops must come from the frame the tracked boxes belong to
+        self.FrameRing.set_latest(packet['pristine_ref'])
+        s['hands_in_frame'] = [hand['hand_bbox'] for hand in packet['hands']]
+        #Match, Update, Add Faces to persistent faces
+        self.SmileIDer.check_faces(packet['faces'])
+        #Score tracked Faces
+        self.SmileIDer.score_faces()
+        packet['tracked_faces'] = self.SmileIDer.snapshot_faces()
+        return packet
+
+    def annotate_frame(self, packet):
+        c = self.controls
+        if not packet.get('draw', True):
+            return packet
+        frame = packet['frame']
+        if c['DRAW_LANDMARKS']:
+            self.SmileIDer.draw_hands(frame, packet['hands'])
+            self.SmileIDer.draw_faces(frame, packet['faces'])
+        self.SmileIDer.draw_tracked_faces(frame, packet['tracked_faces'])
+        return packet
+
+    def encode_frame(self, packet):
+        s = self.state
+        # one encode per distinct viewer profile, only for viewers whose max_fps lets them have this frame
+        packet['video'], packet['video_due'] = {}, []
+        if s['Video_Connections']:
+            packet['video'], packet['video_due'] = self.VideoEncoder.encode_for_due(packet['frame'], packet['ts'])
+        return packet
+
+    async def fanout_frame(self, packet):
+        # Broadcast annotated video frame to video clients
+        if packet['video']:
+            self.MultiSocketManager.broadcast_video_profiles(packet['video'], packet['video_due'], packet['ts'])
+        await self.Send_Data_update(packet['tracked_faces'])
+        return packet
+
+    def pipeline_stages(self):
+        return [
+            ("capture", self.capture_frame),
+            ("inference", self.infer_frame),
+            ("tracking", self.track_frame),
+            ("annotate", self.annotate_frame),
+            ("encode", self.encode_frame),
+            ("fanout", self.fanout_frame),
+        ]
+
+    async def loop(self):
+        s = self.state
         #ct = time.time()
         try:
+            if s['pipeline']['enabled']:
+                await self.FramePipeline.run(self.pipeline_stages(), on_done=self.FrameRing.release_packet)
+                return
             while not s['shutdown_event'].is_set():
-                # Decide frame source: webcam or test images
-                if not c.get('TEST_MODE', False):
-                    ret, frame = await asyncio.to_thread(s['webcam'].read)
-                    if not ret:
-                        continue
-                else:
-                    # Try to get test frame, fallback to webcam if needed
-                    frame = await self.get_next_test_frame()
-                    if frame is None:
-                        ret, frame = await asyncio.to_thread(s['webcam'].read)
-                        if not ret:
-                            continue
-                # front faceing so flip -> more like a mirror
-                frame = cv2.flip(frame, 1)
-                s['latest_frame'] = frame.copy() # Store a copy for async workers
-                #need h,w for scale info on mediapipe outputs
-                s['h'], s['w'], _ = frame.shape
-                #BGR -> RGB
-                rgb_frame = cv2.cvtColor(s['latest_frame'], cv2.COLOR_BGR2RGB)
-                #get hands and faces
-                self.SmileIDer.get_hands(rgb_frame, frame)
-                #check faces in frame, no need for them to persist
-                current_faces_in_frame = self.SmileIDer.get_faces(rgb_frame, frame)
-                #Match, Update, Add Faces to persistent faces
-                self.SmileIDer.check_faces(current_faces_in_frame)
-                #Process and Draw tracked Faces
-                self.SmileIDer.process_faces(frame)
-                # Broadcast annotated video frame to WebRTC clients
-                await self.MultiSocketManager.broadcast_video_frame(frame)
-                await self.Send_Data_update()
+                packet = await self.capture_frame()
+                if packet is None:
+                    continue
+                packet = await self.infer_frame(packet)
+                packet = self.track_frame(packet)
+                packet = self.annotate_frame(packet)
+                packet = self.encode_frame(packet)
+                await self.fanout_frame(packet)
+                self.FrameRing.release_packet(packet)
                 
                 #ut = time.time() 
                 #fps = 1.0 / (ut - ct) if (ut - ct) > 0 else 0
@@ -259,15 +476,15 @@ class SmileAnalysisServer:
     def cleanup_resources(self):
         """Clean up all resources before exit"""
         s = self.state
-        persistent_faces = s['persistent_faces']
         webcam = s['webcam']
+        self.SmileQueries.close()
         self.DB_manager.cleanup_resources()
         self.MultiSocketManager.cleanup_resources()
-        # Cancel all running tasks
-        print("Cancelling background tasks...")
-        for face_id, face_data in list(persistent_faces.items()):
-            if 'worker_task' in face_data and not face_data['worker_task'].done():
-                face_data['worker_task'].cancel()
+        if self.SmileIDer.InferenceBackend is not None:
+            self.SmileIDer.InferenceBackend.close()
+            print("Inference backend closed.")
+        self.SmileIDer.RoiInference.close()
+        self.VideoEncoder.close()
         
         # Release camera
         if webcam and webcam.isOpened():
@@ -290,12 +507,14 @@ def main():
     args = parser.parse_args()
 
     import uvicorn
+    # no per-message deflate: JPEG frames don't compress and it was zlib-ing every frame once per viewer
     if args.reload:
         # In reload mode, uvicorn requires an import string; use factory
-        uvicorn.run("server:create_app", factory=True, host=args.host, port=args.port, reload=True)
+        uvicorn.run("server:create_app", factory=True, host=args.host, port=args.port, reload=True,
+                    ws_per_message_deflate=False)
     else:
         app = create_app()
-        uvicorn.run(app, host=args.host, port=args.port, reload=False)
+        uvicorn.run(app, host=args.host, port=args.port, reload=False, ws_per_message_deflate=False)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
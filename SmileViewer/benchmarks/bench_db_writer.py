@@ -0,0 +1,89 @@
+'''
+Smile metadata inserts: batched writer thread (WAL) vs the old INSERT + commit per row.
+
+    python benchmarks/bench_db_writer.py --rows 5000
+    python benchmarks/bench_db_writer.py --rows 5000 --rate 200   # paced, like N smiling faces at 4 Hz
+
+Both run against a fresh database in a temp directory. Reports sustained inserts/sec and how long
+the caller (the event loop in the server) was blocked per logged smile.
+'''
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+from DB_manager import DBmanager  # noqa: E402
+
+
+def legacy(rows, rate):
+    # what log_smilemeta_to_db did before: default journal, commit on the caller for every row
+    conn = sqlite3.connect(os.path.join("server", "data", "legacy.db"))
+    conn.execute("CREATE TABLE smiles (id INTEGER PRIMARY KEY AUTOINCREMENT, face_id INTEGER NOT NULL, capture_time TEXT NOT NULL)")
+    conn.commit()
+    cursor = conn.cursor()
+
+    def log(face_id):
+        cursor.execute("INSERT INTO smiles (face_id, capture_time) VALUES (?, ?)", (face_id, datetime.datetime.now().isoformat()))
+        conn.commit()
+
+    result = run(log, rows, rate, lambda: None)
+    conn.close()
+    return result
+
+
+def batched(rows, rate):
+    mgr = DBmanager()
+    result = run(mgr.log_smilemeta_to_db, rows, rate, mgr.flush)
+    result['batches'] = mgr.stats()['batches']
+    mgr.cleanup_resources()
+    return result
+
+
+def run(log, rows, rate, flush):
+    call_ms = []
+    period = 1.0 / rate if rate else 0.0
+    start = time.perf_counter()
+    next_tick = start
+    for i in range(rows):
+        t0 = time.perf_counter()
+        log(i % 50)
+        call_ms.append((time.perf_counter() - t0) * 1000)
+        if period:
+            next_tick += period
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+    flush()
+    elapsed = time.perf_counter() - start
+    return {
+        "inserts_per_s": rows / elapsed,
+        "call_ms_p50": float(np.percentile(call_ms, 50)),
+        "call_ms_p99": float(np.percentile(call_ms, 99)),
+        "call_ms_max": float(np.max(call_ms)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0, help="rows per second, 0 = as fast as possible")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs(os.path.join("server", "data"))
+        results = {"per-row commit": legacy(args.rows, args.rate), "batched writer": batched(args.rows, args.rate)}
+    pace = f"at {args.rate:g} rows/s" if args.rate else "unpaced"
+    print(f"{args.rows} smile rows, {pace}")
+    for name, r in results.items():
+        batches = f"  ({r['batches']} commits)" if 'batches' in r else ""
+        print(f"{name:15s} {r['inserts_per_s']:10.0f} inserts/s   caller blocked per row p50 {r['call_ms_p50']:.3f} ms"
+              f"  p99 {r['call_ms_p99']:.3f} ms  max {r['call_ms_max']:.3f} ms{batches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+'''
+Fan-out scaling: N video viewers + N controls viewers on real websockets over loopback.
+
+    python benchmarks/bench_fanout.py --viewers 200 --fps 30 --seconds 10
+    python benchmarks/bench_fanout.py --viewers 200 --legacy   # the old serial loops, for comparison
+
+A server subprocess runs the real ControlsManager / VideoSender fan-out and pushes a ~30 KB
+"jpeg" plus a faces message every frame. It reports how long each frame's fan-out held the
+event loop and the frame rate it kept. The clients live in this process and count what arrives.
+Target (README): 200 + 200 viewers at 30 FPS, most of the server CPU spent in socket writes.
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+
+FACES_MSG = {"t": "f", "ts": 0.0, "f": [[i, 100, 120, 220, 260, 140, 210, 190, 230, "Smiling"] for i in range(3)]}
+
+
+def serve(args):
+    import uvicorn
+    from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+    from WS_controls import ControlsManager
+    from Video_sender import VideoSender
+
+    app = FastAPI()
+    controls = ControlsManager()
+    senders = {}
+    video_sockets = {}
+    jpeg = np.random.default_rng(0).integers(0, 255, args.jpeg_kb * 1024, dtype=np.uint8).tobytes()
+    expected = args.viewers
+    ready = asyncio.Event()
+
+    def check_ready():
+        if len(controls.active) >= expected and len(video_sockets) >= expected:
+            ready.set()
+
+    @app.websocket("/video")
+    async def video(websocket: WebSocket):
+        await websocket.accept()
+        client_id = id(websocket)
+        video_sockets[client_id] = websocket
+        if not args.legacy:
+            senders[client_id] = VideoSender(client_id, websocket, on_evict=lambda cid: senders.pop(cid, None))
+            senders[client_id].start()
+        check_ready()
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            video_sockets.pop(client_id, None)
+            sender = senders.pop(client_id, None)
+            if sender:
+                sender.stop()
+
+    @app.websocket("/controls")
+    async def controls_endpoint(websocket: WebSocket):
+        await controls.connect(websocket)
+        check_ready()
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            controls.disconnect(websocket)
+
+    async def legacy_fanout(msg):
+        # what the server did before: one awaited send after another, json per client
+        for ws in list(video_sockets.values()):
+            try:
+                await ws.send_bytes(jpeg)
+            except Exception:
+                pass
+        for ws in list(controls.active):
+            try:
+                await ws.send_json(msg)
+            except Exception:
+                pass
+
+    async def broadcaster():
+        await asyncio.wait_for(ready.wait(), timeout=60)
+        period = 1.0 / args.fps
+        fanout_ms = []
+        next_tick = time.perf_counter()
+        start = next_tick
+        cpu_start = time.process_time()
+        frames = 0
+        while time.perf_counter() - start < args.seconds:
+            msg = dict(FACES_MSG, ts=time.time())
+            t0 = time.perf_counter()
+            if args.legacy:
+                await legacy_fanout(msg)
+            else:
+                for sender in list(senders.values()):
+                    sender.offer(jpeg)
+                await controls.send_json(msg)
+            fanout_ms.append((time.perf_counter() - t0) * 1000)
+            frames += 1
+            next_tick += period
+            await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        elapsed = time.perf_counter() - start
+        # sender tasks finish their writes outside the timed section, CPU time catches all of it
+        cpu_ms_per_frame = (time.process_time() - cpu_start) * 1000 / frames
+        dropped = sum(s.mailbox.dropped for s in senders.values())
+        print(json.dumps({
+            "frames": frames,
+            "fps": round(frames / elapsed, 2),
+            "fanout_ms_p50": round(float(np.percentile(fanout_ms, 50)), 3),
+            "fanout_ms_p95": round(float(np.percentile(fanout_ms, 95)), 3),
+            "fanout_ms_max": round(float(np.max(fanout_ms)), 3),
+            "cpu_ms_per_frame": round(cpu_ms_per_frame, 3),
+            "video_dropped": dropped,
+        }), flush=True)
+        server.should_exit = True
+
+    # same socket settings as server.py, --legacy also brings back the old per-message deflate
+    config = uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning",
+                            ws_per_message_deflate=args.legacy)
+    server = uvicorn.Server(config)
+
+    async def run():
+        task = asyncio.create_task(broadcaster())
+        await server.serve()
+        await task
+
+    asyncio.run(run())
+
+
+async def run_clients(args):
+    import websockets
+
+    counts = {"video": 0, "controls": 0}
+
+    async def client(path):
+        async with websockets.connect(f"ws://127.0.0.1:{args.port}/{path}", max_size=None) as ws:
+            try:
+                async for _ in ws:
+                    counts[path] += 1
+            except websockets.ConnectionClosed:
+                pass
+
+    tasks = []
+    for _ in range(args.viewers):
+        tasks.append(asyncio.create_task(client("video")))
+        tasks.append(asyncio.create_task(client("controls")))
+    t0 = time.perf_counter()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return counts, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=200, help="video viewers, and as many controls viewers")
+    parser.add_argument("--fps", type=float, default=30)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--jpeg-kb", type=int, default=30)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--legacy", action="store_true", help="serial per-client sends, as before")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    cmd = [sys.executable, __file__, "--serve"] + sys.argv[1:]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    time.sleep(2.0) # uvicorn startup
+    try:
+        counts, elapsed = asyncio.run(run_clients(args))
+        out, _ = proc.communicate(timeout=30)
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+    report = json.loads(out.strip().splitlines()[-1])
+    mode = "legacy serial" if args.legacy else "concurrent"
+    print(f"{mode} fan-out, {args.viewers} video + {args.viewers} controls viewers, target {args.fps} fps")
+    print(f"server kept        {report['fps']} fps over {report['frames']} frames")
+    print(f"server CPU         {report['cpu_ms_per_frame']} ms per frame "
+          f"({report['cpu_ms_per_frame'] * args.fps / 10:.0f}% of a core at {args.fps} fps)")
+    print(f"fan-out per frame  p50 {report['fanout_ms_p50']} ms  p95 {report['fanout_ms_p95']} ms  max {report['fanout_ms_max']} ms")
+    print(f"received per viewer  video {counts['video'] / args.viewers:.1f}  controls {counts['controls'] / args.viewers:.1f}"
+          f"  (video frames dropped for slow readers: {report['video_dropped']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+'''
+Detect-then-track vs full FaceMesh on recorded footage.
+
+    python benchmarks/bench_flow.py path/to/clip.mp4 [--target-fps 24] [--max-k 6]
+
+Every frame gets a full detection as ground truth; the flow mode only pays for the
+detections it would have run. Reports the model-time FPS of both and the landmark error
+of the flow frames against the ground truth.
+'''
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+from Flow_tracker import FlowTracker, landmark_error_px  # noqa: E402
+from Inference_backend import create_backend  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("video")
+    parser.add_argument("--target-fps", type=float, default=24)
+    parser.add_argument("--max-k", type=int, default=6)
+    parser.add_argument("--motion-px", type=float, default=12.0)
+    parser.add_argument("--frames", type=int, default=0, help="stop after this many frames, 0 = whole clip")
+    args = parser.parse_args()
+
+    controls = {"FLOW_TARGET_FPS": args.target_fps, "FLOW_MAX_K": args.max_k,
+                "FLOW_MOTION_PX": args.motion_px, "FLOW_MIN_CONFIDENCE": 0.8}
+    tracker = FlowTracker(SimpleNamespace(controls=controls))
+    backend = create_backend("inprocess")
+    capture = cv2.VideoCapture(args.video)
+    full_ms, flow_mode_ms, errors = [], [], []
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok or (args.frames and len(full_ms) >= args.frames):
+                break
+            h, w, _ = frame.shape
+            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+            t0 = time.perf_counter()
+            hands, truth = backend.infer_sync(rgb, rgb)
+            detect_ms = (time.perf_counter() - t0) * 1000
+            full_ms.append(detect_ms)
+
+            faces = None
+            if not tracker.needs_detection():
+                t0 = time.perf_counter()
+                faces = tracker.track(gray, w, h)
+                flow_ms = (time.perf_counter() - t0) * 1000
+            if faces is None:
+                tracker.observe_detection(gray, truth, hands, detect_ms, w, h)
+                flow_mode_ms.append(detect_ms)
+            else:
+                flow_mode_ms.append(flow_ms)
+                error = landmark_error_px(faces, truth, w, h)
+                if error is not None:
+                    errors.append(error)
+    finally:
+        capture.release()
+        backend.close()
+
+    if not full_ms:
+        print("no frames read")
+        return
+    stats = tracker.stats()
+    print(f"frames              {len(full_ms)}")
+    print(f"full detection fps  {1000 / np.mean(full_ms):.1f}")
+    print(f"detect+track fps    {1000 / np.mean(flow_mode_ms):.1f}  (final K {stats['k']}, "
+          f"{stats['flow_frames']} flow / {stats['detect_frames']} detect, {stats['forced_detects']} forced)")
+    if errors:
+        print(f"flow error px       mean {np.mean(errors):.2f}  p95 {np.percentile(errors, 95):.2f}  max {np.max(errors):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+'''
+Retention pass over an aged crop directory while a 30 fps "frame loop" ticks and the db writer keeps logging smiles.
+
+    python benchmarks/bench_retention.py --rows 40000
+    python benchmarks/bench_retention.py --rows 40000 --slice-rows 1000000   # everything in one slice, for comparison
+
+Seeds --rows smiles (a 2 KB crop file each) spread over the last 60 days, then runs one RetentionService pass with
+a 30 day max age and a budget of a quarter of what's left. Reports how late the 33 ms ticks were (the frame loop's
+hitches) and the writer's commit times (how long it was held up by retention's transactions).
+'''
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "Server"))
+from Crop_store import DirectoryStore  # noqa: E402
+from DB_manager import DBmanager  # noqa: E402
+from Retention_service import RetentionService  # noqa: E402
+
+
+def seed(mgr, store, rows):
+    now = datetime.datetime.now()
+    conn = mgr.state['DB_conn']
+    batch = []
+    for i in range(rows):
+        ts = now - datetime.timedelta(days=60) + datetime.timedelta(seconds=i * 60 * 86400 / rows)
+        face_id = i % 200
+        batch.append((face_id, ts.isoformat(), store.put("smile", face_id, ts.timestamp(), b"j" * 2048)))
+    conn.executemany("INSERT INTO smiles (face_id, capture_time, crop) VALUES (?, ?, ?)", batch)
+    conn.commit()
+
+
+async def frame_loop(lateness, done, period=1 / 30):
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        expected = loop.time() + period
+        await asyncio.sleep(period)
+        lateness.append((loop.time() - expected) * 1000)
+
+
+async def smiles(mgr, done, rate=100):
+    while not done.is_set():
+        mgr.log_smilemeta_to_db(7, 0.25, None)
+        await asyncio.sleep(1 / rate)
+
+
+def time_commits(writer):
+    commit_ms, write = [], writer.write
+
+    def timed(conn, rows):
+        t0 = time.perf_counter()
+        write(conn, rows)
+        commit_ms.append((time.perf_counter() - t0) * 1000)
+    writer.write = timed
+    return commit_ms
+
+
+async def measure(retention, mgr):
+    lateness, done = [], asyncio.Event()
+    tasks = [asyncio.create_task(frame_loop(lateness, done)), asyncio.create_task(smiles(mgr, done))]
+    t0 = time.perf_counter()
+    await retention.run_pass()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await asyncio.gather(*tasks)
+    await retention.close()
+    return elapsed, lateness
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=40000)
+    parser.add_argument("--slice-rows", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        os.makedirs(os.path.join("server", "data", "images"))
+        mgr = DBmanager()
+        store = DirectoryStore(os.path.join("server", "data", "images"))
+        seed(mgr, store, args.rows)
+        budget_mb = args.rows // 2 * 2048 / 4 / (1024 * 1024)
+        parent = SimpleNamespace(state={"shutdown_event": asyncio.Event()}, DB_manager=mgr, CropStore=store,
+                                 controls={"RETENTION_MAX_AGE_DAYS": 30, "RETENTION_DISK_BUDGET_MB": budget_mb})
+        retention = RetentionService(parent, slice_rows=args.slice_rows)
+        commit_ms = time_commits(mgr.Writer)
+        elapsed, lateness = asyncio.run(measure(retention, mgr))
+        stats = retention.stats()
+        mgr.cleanup_resources()
+
+    print(f"{args.rows} smiles, slices of {args.slice_rows}: pass took {elapsed:.2f} s in {stats['slices']} slices"
+          f" (slowest {stats['max_slice_ms']:.1f} ms), rolled up {stats['rolled_up']}, evicted {stats['crops_evicted']} crops,"
+          f" reclaimed {stats['reclaimed_bytes'] / 1e6:.1f} MB")
+    print(f"frame loop lateness p50 {np.percentile(lateness, 50):.2f} ms  p99 {np.percentile(lateness, 99):.2f} ms"
+          f"  max {np.max(lateness):.2f} ms")
+    print(f"db writer commits p50 {np.percentile(commit_ms, 50):.2f} ms  max {np.max(commit_ms):.2f} ms"
+          f" ({len(commit_ms)} batches)")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,11 @@ import time
 
 import pytest
 
+# Server modules import each other by bare name (they run from inside Server/)
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Server")
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
 
 def _wait_for_port(host: str, port: int, timeout: float = 5.0) -> bool:
     deadline = time.time() + timeout
@@ -0,0 +1,60 @@
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Inference_backend import create_backend
+from Server.Smile_ID import SmileIDer
+
+FACES_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "Samples", "Faces")
+
+
+@pytest.fixture(scope="module")
+def sample_landmarks():
+    backend = create_backend("inprocess")
+    faces = []
+    try:
+        for name in sorted(os.listdir(FACES_DIR)):
+            image = cv2.imread(os.path.join(FACES_DIR, name))
+            _, found = backend.infer_sync(None, cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+            faces.extend(found)
+    finally:
+        backend.close()
+    assert faces, "no faces found in the samples"
+    rng = np.random.default_rng(0)
+    variants = list(faces)
+    # jittered copies push some faces across the smile thresholds
+    for face in faces:
+        for _ in range(3):
+            variants.append(face + rng.normal(0, 0.004, face.shape).astype(np.float32))
+    # degenerate mouths: zero height and zero width -> bad detect
+    flat = faces[0].copy()
+    flat[[0, 17]] = flat[13]
+    variants.append(flat)
+    pinched = faces[0].copy()
+    pinched[291] = pinched[61]
+    variants.append(pinched)
+    return variants
+
+
+@pytest.mark.parametrize("thresh", [0.0, 0.2, 0.35, 0.6])
+def test_batch_scoring_matches_scalar(sample_landmarks, thresh):
+    sid = SmileIDer(parent=SimpleNamespace())
+    sid.controls = {"SMILE_THRESH": thresh}
+    sid.state = {"w": 640, "h": 480}
+    baselines = [0.0, 0.5, 0.8, 1.0, 1.3] * (len(sample_landmarks) // 5 + 1)
+    baselines = baselines[:len(sample_landmarks)]
+
+    batch = sid.face_metrics_batch(sample_landmarks, baselines)
+    scalar = [sid.face_metrics(lm, base) for lm, base in zip(sample_landmarks, baselines)]
+
+    assert len(batch) == len(scalar)
+    for (b_far, b_rect, b_mar, b_smile), (far, rect, mar, smile) in zip(batch, scalar):
+        assert b_far == far
+        assert b_rect == rect
+        assert b_mar == mar
+        assert b_smile == smile
+    # the samples should exercise every outcome, not just one branch
+    assert {result[3] for result in scalar} >= {1, -1}
@@ -0,0 +1,126 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Capture_service import CaptureService
+from Server.Frame_ring import FrameRing, frame_ref
+
+
+class FakeDB:
+    def __init__(self):
+        self.logged = []
+        self.crops = {}
+
+    def log_smilemeta_to_db(self, face_id, smiling_s=0.0, crop=None):
+        self.logged.append(face_id)
+
+    def log_face_crop(self, face_id, path):
+        self.crops[face_id] = path
+
+
+def _parent(record=True, dedup=False):
+    parent = SimpleNamespace(state={"latest_frame": None},
+                             controls={"RECORD": record, "CAPTURE_SMILE_HZ": 4, "CAPTURE_DEDUP": dedup},
+                             DB_manager=FakeDB())
+    parent.FrameRing = FrameRing(parent)
+    return parent
+
+
+def _set_frame(parent, value=90):
+    slot = parent.FrameRing.acquire()
+    frame = slot.buffer('frame', (60, 80, 3))
+    frame[...] = value
+    parent.FrameRing.set_latest(slot.ref('frame'))
+    parent.FrameRing.release(slot)
+    return slot
+
+
+def _face():
+    return {"face_bbox": (10, 10, 40, 50), "smile_bbox": (20, 35, 30, 45)}
+
+
+@pytest.mark.asyncio
+async def test_face_and_rate_limited_smile_crops_are_written(tmp_path):
+    parent = _parent()
+    capture = CaptureService(parent, workers=2, depth=8, images_dir=str(tmp_path))
+    capture.start()
+    _set_frame(parent)
+    face = _face()
+    assert capture.notify("face", 7, face, now=100.0)
+    assert capture.notify("smile", 7, face, now=100.0)
+    assert not capture.notify("smile", 7, face, now=100.1) # 4 Hz
+    assert capture.notify("smile", 7, face, now=100.3)
+    await capture.close()
+
+    saved = sorted(os.listdir(tmp_path / "7"))
+    assert saved[0] == "face.jpg" and len(saved) == 3
+    assert cv2.imread(str(tmp_path / "7" / "face.jpg")).shape == (40, 30, 3)
+    assert parent.DB_manager.logged == [7, 7]
+    assert parent.DB_manager.crops == {7: str(tmp_path / "7" / "face.jpg")}
+    assert capture.stats()['written'] == 3
+
+
+def test_nothing_is_queued_when_not_recording_or_frame_is_stale(tmp_path):
+    parent = _parent(record=False)
+    capture = CaptureService(parent, images_dir=str(tmp_path))
+    _set_frame(parent)
+    assert not capture.notify("face", 1, _face())
+    parent.controls['RECORD'] = True
+    ref = parent.state['latest_frame']
+    ref.slot.generation += 1 # recycled under it
+    assert not capture.notify("face", 1, _face())
+    assert capture.stats()['stale'] == 1 and capture.stats()['queued'] == 0
+    capture.executor.shutdown()
+
+
+def test_full_queue_drops_and_counts_instead_of_blocking(tmp_path):
+    parent = _parent()
+    capture = CaptureService(parent, depth=2, images_dir=str(tmp_path)) # writers not started, disk "stuck"
+    _set_frame(parent)
+    results = [capture.notify("face", face_id, _face()) for face_id in range(5)]
+    assert results == [True, True, False, False, False]
+    assert capture.stats()['dropped'] == {"face": 3, "smile": 0}
+    assert capture.stats()['backlog'] == 2
+    capture.executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_counted(tmp_path):
+    parent = _parent()
+    blocker = tmp_path / "3"
+    blocker.write_text("not a directory")
+    capture = CaptureService(parent, images_dir=str(tmp_path))
+    capture.start()
+    _set_frame(parent)
+    assert capture.notify("face", 3, _face())
+    await asyncio.sleep(0.2)
+    await capture.close()
+    assert capture.stats()['failed'] == 1 and capture.stats()['written'] == 0
+
+
+def test_dedup_skips_near_identical_smiles_but_keeps_changes_and_a_minimum_rate(tmp_path):
+    parent = _parent(dedup=True)
+    capture = CaptureService(parent, depth=100, images_dir=str(tmp_path))
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur(rng.integers(0, 255, (60, 80, 3), dtype=np.uint8), (7, 7), 0)
+    face = _face()
+    saved = []
+    for i in range(40): # 10 s of smiling at 4 Hz
+        frame = scene.copy()
+        if i >= 20: # expression changes halfway
+            frame[35:45, 20:30] = 255 - frame[35:45, 20:30]
+        noisy = np.clip(frame + rng.normal(0, 3, frame.shape), 0, 255).astype(np.uint8)
+        parent.state['latest_frame'] = frame_ref(noisy)
+        face['smiling_s'] = 0.25 * (i + 1)
+        if capture.notify("smile", 1, face, now=100.0 + 0.25 * i):
+            saved.append(i)
+    # first one, every 2 s (CAPTURE_DEDUP_KEEP_EVERY_S) while nothing changes, and the change right away
+    assert saved == [0, 8, 16, 20, 28, 36]
+    assert capture.stats()['deduped'] == 34
+    # skipped smiles don't lose their smiling time, the next saved one carries it
+    assert capture.queue.items[-1][4] == pytest.approx(2.0)
+    capture.executor.shutdown()
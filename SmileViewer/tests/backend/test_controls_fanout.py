@@ -0,0 +1,133 @@
+import asyncio
+import json
+
+import pytest
+
+from Server.WS_controls import DEFAULT_SUBSCRIPTION, MAX_QUEUED_MESSAGES, ControlsManager, parse_subscription
+
+
+class FakeControlsSocket:
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.sent = []
+        self.closed = None
+
+    async def close(self, code=1000, reason=""):
+        self.closed = code
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+    async def send_text(self, text):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        await asyncio.sleep(self.delay)
+        self.sent.append(text)
+
+
+@pytest.mark.asyncio
+async def test_send_json_same_text_to_everyone_but_excluded():
+    manager = ControlsManager()
+    sockets = [FakeControlsSocket() for _ in range(3)]
+    manager.active.update(sockets)
+    await manager.send_json({"type": "settings_update", "key": "DRAW_FACE_BB", "value": True}, exclude=sockets[0])
+    await manager.flush()
+    assert sockets[0].sent == []
+    assert sockets[1].sent == sockets[2].sent
+    assert sockets[1].sent[0] is sockets[2].sent[0] # serialized once
+    assert json.loads(sockets[1].sent[0]) == {"type": "settings_update", "key": "DRAW_FACE_BB", "value": True}
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_slow_and_broken_clients_are_dropped_without_holding_the_rest():
+    manager = ControlsManager(send_timeout=0.05)
+    fast, slow, broken = FakeControlsSocket(), FakeControlsSocket(delay=5.0), FakeControlsSocket(fail=True)
+    manager.active.update([fast, slow, broken])
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    await manager.send_json({"t": "f", "f": []})
+    assert loop.time() - t0 < 0.02 # only queued, no socket awaited
+    await asyncio.sleep(0.1)
+    # broken failed its send, slow is still stuck in its send past the timeout
+    assert len(fast.sent) == 1 and manager.active == {fast, slow}
+    await manager.send_json({"t": "f", "f": []}) # the next tick finds it stuck
+    assert manager.active == {fast}
+    await asyncio.sleep(0) # closes are scheduled, not awaited by the fanout
+    # closed, not just forgotten: the frontend reconnects instead of waiting on a socket that gets nothing
+    assert slow.closed == 1008 and broken.closed == 1008 and fast.closed is None
+    await manager.close()
+
+
+
+@pytest.mark.asyncio
+async def test_client_too_far_behind_is_dropped():
+    manager = ControlsManager(send_timeout=60.0)
+    fast, behind = FakeControlsSocket(), FakeControlsSocket(delay=1.0)
+    manager.active.update([fast, behind])
+    # messages are never skipped (deltas build on each other), a full mailbox means the client has to go
+    for i in range(MAX_QUEUED_MESSAGES + 2):
+        await manager.send_json({"i": i})
+        await asyncio.sleep(0.001) # ticks
+    await manager.flush()
+    assert manager.active == {fast} and len(fast.sent) == MAX_QUEUED_MESSAGES + 2
+    await asyncio.sleep(0)
+    assert behind.closed == 1008 and fast.closed is None
+    await manager.close()
+
+
+def test_parse_subscription():
+    assert parse_subscription({"faces": 10, "smiles": "0", "bogus": 1, "metrics": "fast"}) == {"faces": 10.0, "smiles": 0.0}
+    assert parse_subscription(["smiles", "metrics"]) == {"smiles": 0.0, "metrics": 1.0}
+    assert parse_subscription("smiles, settings") == {"smiles": 0.0, "settings": 0.0}
+    assert parse_subscription(None) == DEFAULT_SUBSCRIPTION
+
+
+@pytest.mark.asyncio
+async def test_payloads_only_built_for_due_subscribers():
+    manager = ControlsManager()
+    overlay, dashboard = FakeControlsSocket(), FakeControlsSocket()
+    manager.active.update([overlay, dashboard])
+    manager.subscribe(dashboard, {"metrics": 1.0, "settings": 0.0})
+    built = []
+
+    def metrics():
+        built.append(1)
+        return {"t": "m"}
+
+    await manager.publish("landmarks", lambda: built.append("landmarks"), now=0.0)
+    for i in range(30): # one second of frames
+        await manager.publish("metrics", metrics, now=i / 30)
+    await manager.flush()
+    assert built == [1] and len(dashboard.sent) == 1 and overlay.sent == []
+    # settings go to both (overlay has the default subscription), never back to the sender
+    await manager.publish("settings", lambda: {"type": "settings_update"}, exclude=overlay)
+    await manager.flush()
+    assert overlay.sent == [] and json.loads(dashboard.sent[-1])['type'] == "settings_update"
+    await manager.close()
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_faces_get_keyframes_and_events_batch():
+    manager = ControlsManager()
+    fast, slow = FakeControlsSocket(), FakeControlsSocket()
+    manager.active.update([fast, slow])
+    manager.subscribe(fast, {"faces": 0.0, "smiles": 0.0})
+    manager.subscribe(slow, {"faces": 10.0, "smiles": 10.0})
+    builders = {"json": lambda: {"t": "d"}, "binary": lambda: None}
+    keyframes = {"json": lambda: {"t": "f"}, "binary": lambda: None}
+    for i in range(6):
+        now = i / 30
+        await manager.send_formats(builders, keyframes, now=now)
+        await manager.publish_events("smiles", [[i, "Not Smiling", "Smiling"]], lambda e: {"t": "s", "e": e}, now=now)
+    await manager.flush()
+    faces = lambda ws: [json.loads(m)['t'] for m in ws.sent if json.loads(m)['t'] in ("f", "d")]
+    events = lambda ws: [[e[0] for e in json.loads(m)['e']] for m in ws.sent if json.loads(m)['t'] == "s"]
+    # subscribe() asks for a keyframe first, deltas after
+    assert faces(fast) == ["f", "d", "d", "d", "d", "d"]
+    # 10 Hz of a 30 Hz stream: it missed deltas in between, so every update it gets is a keyframe
+    assert faces(slow) == ["f", "f"]
+    assert events(fast) == [[0], [1], [2], [3], [4], [5]]
+    assert events(slow) == [[0], [1, 2, 3]] # nothing lost, batched into its slots, 4 and 5 still pending
+    await manager.close()
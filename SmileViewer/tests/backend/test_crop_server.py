@@ -0,0 +1,128 @@
+import datetime
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from Server.Crop_server import ByteLRU, CropServer, make_thumbnail
+from Server.Crop_store import DirectoryStore
+from Server.DB_manager import DBmanager
+from Server.Smile_queries import SmileQueries
+
+T0 = datetime.datetime(2026, 3, 1, 12, 0)
+
+
+def _jpeg(h, w, value):
+    ok, jpeg = cv2.imencode(".jpg", np.full((h, w, 3), value, dtype=np.uint8))
+    return jpeg.tobytes()
+
+
+@pytest.fixture
+def crops(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    mgr = DBmanager()
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr.Writer.log(("crop", 5, T0.isoformat(), 0.0, store.put("face", 5, T0.timestamp(), _jpeg(120, 80, 60))))
+    for i in range(3):
+        ts = T0 + datetime.timedelta(seconds=i)
+        mgr.Writer.log(("smile", 5, ts.isoformat(), 0.25, store.put("smile", 5, ts.timestamp(), _jpeg(40, 60, 100 + i))))
+    mgr.Writer.log(("smile", 6, T0.isoformat(), 0.25, None)) # its crop was evicted
+    assert mgr.flush()
+    parent = SimpleNamespace(DB_manager=mgr, CropStore=store)
+    parent.SmileQueries = SmileQueries(parent)
+    server = CropServer(parent, cache_mb=1, thumbs_dir=str(tmp_path / "thumbs"))
+    app = FastAPI()
+    server.register(app)
+    yield TestClient(app), server, store
+    parent.SmileQueries.close()
+    mgr.cleanup_resources()
+
+
+def test_crops_by_face_and_smile_id_with_revalidation(crops):
+    client, server, store = crops
+    face = client.get("/crops/faces/5")
+    assert face.status_code == 200 and face.headers['content-type'] == "image/jpeg"
+    assert cv2.imdecode(np.frombuffer(face.content, np.uint8), cv2.IMREAD_COLOR).shape == (120, 80, 3)
+    assert face.headers['last-modified'].endswith("GMT") and face.headers['cache-control'] == "private, no-cache"
+    smile = client.get("/crops/smiles/2")
+    assert smile.content == store.read(store.path_for("smile", 5, (T0 + datetime.timedelta(seconds=1)).timestamp()))
+    assert smile.headers['etag'] != face.headers['etag']
+    # browsers revalidating get a 304 without the body
+    again = client.get("/crops/smiles/2", headers={"If-None-Match": smile.headers['etag']})
+    assert again.status_code == 304 and again.content == b"" and again.headers['etag'] == smile.headers['etag']
+    since = client.get("/crops/smiles/2", headers={"If-Modified-Since": smile.headers['last-modified']})
+    assert since.status_code == 304
+    assert client.get("/crops/smiles/2", headers={"If-None-Match": '"other"'}).status_code == 200
+    assert server.stats()['not_modified'] == 2
+    assert client.get("/crops/smiles/4").status_code == 404 # no crop left
+    assert client.get("/crops/smiles/99").status_code == 404
+    assert client.get("/crops/faces/6").status_code == 404
+
+
+def test_recent_crops_are_served_from_memory(crops):
+    client, server, store = crops
+    first = client.get("/crops/smiles/1").content
+    os.remove(store.path_for("smile", 5, T0.timestamp()))
+    for _ in range(3):
+        assert client.get("/crops/smiles/1").content == first
+    stats = server.stats()
+    assert stats['store_reads'] == 1 and stats['cache']['hits'] == 3 and stats['served'] == 4
+
+
+def test_thumbnails_are_made_once_and_kept_on_disk(crops, tmp_path):
+    client, server, store = crops
+    thumb = client.get("/crops/faces/5", params={"size": 48})
+    assert cv2.imdecode(np.frombuffer(thumb.content, np.uint8), cv2.IMREAD_COLOR).shape == (48, 32, 3)
+    assert thumb.headers['etag'] != client.get("/crops/faces/5").headers['etag']
+    assert len(os.listdir(tmp_path / "thumbs" / "face" / "5")) == 1 and server.stats()['thumbs_made'] == 1
+    # a new server (empty memory cache) reads the thumbnail back instead of making it again
+    fresh = CropServer(server.parent, thumbs_dir=str(tmp_path / "thumbs"))
+    app = FastAPI()
+    fresh.register(app)
+    assert TestClient(app).get("/crops/faces/5", params={"size": 48}).content == thumb.content
+    assert fresh.stats()['thumbs_made'] == 0 and fresh.stats()['store_reads'] == 0
+    # never scaled up
+    small = client.get("/crops/smiles/1", params={"size": 512})
+    assert cv2.imdecode(np.frombuffer(small.content, np.uint8), cv2.IMREAD_COLOR).shape == (40, 60, 3)
+    assert client.get("/crops/faces/5", params={"size": 4}).status_code == 400
+
+
+def test_thumbnails_trim_least_recently_used_without_rescanning(crops, tmp_path, monkeypatch):
+    client, server, store = crops
+    walks = []
+    real_walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda *args, **kw: walks.append(args) or real_walk(*args, **kw))
+    location = store.path_for("face", 5, T0.timestamp())
+    when = T0.isoformat()
+
+    def thumb(size):
+        return server.load("face", 5, location, size, server.etag(location, when, size))
+
+    sizes = {size: len(thumb(size)) for size in (16, 32, 48)}
+    assert thumb(16) is not None # read back from disk, now the most recently used
+    # the next one puts the dir just over budget: the least recently used (32) goes, the one just read stays
+    server.thumb_max_bytes = sum(sizes.values()) + len(make_thumbnail(store.read(location), 64)) - 1
+    thumb(64)
+    names = sorted(int(name.split("_")[0]) for name in os.listdir(tmp_path / "thumbs" / "face" / "5"))
+    assert 32 not in names and 16 in names and 64 in names
+    assert server.stats()['thumbs_trimmed'] >= 1
+    assert server.thumb_bytes == sum(os.path.getsize(tmp_path / "thumbs" / "face" / "5" / name)
+                                     for name in os.listdir(tmp_path / "thumbs" / "face" / "5"))
+    assert len(walks) == 1 # the thumbs dir was walked once, trimming used the index
+
+
+def test_byte_lru_is_bounded_by_size():
+    lru = ByteLRU(100)
+    lru.put("a", b"a" * 40)
+    lru.put("b", b"b" * 40)
+    assert lru.get("a") is not None # a is now the most recent
+    lru.put("c", b"c" * 40)
+    assert lru.get("b") is None and lru.get("a") is not None and lru.get("c") is not None
+    lru.put("huge", b"x" * 101)
+    assert lru.get("huge") is None and lru.bytes == 80
+    assert lru.stats()['evictions'] == 1 and lru.stats()['entries'] == 2
@@ -0,0 +1,78 @@
+import os
+import time
+
+import pytest
+
+from Server.Crop_store import DirectoryStore, SegmentStore, compact_segments, create_crop_store
+from Server.DB_manager import DBmanager
+
+TS = time.mktime((2026, 3, 1, 12, 30, 0, 0, 0, -1))
+
+
+def test_directory_store_keeps_the_old_layout(tmp_path):
+    store = create_crop_store("directory", str(tmp_path))
+    assert isinstance(store, DirectoryStore)
+    location = store.put("face", 3, TS, b"face-jpeg")
+    assert location == str(tmp_path / "images" / "3" / "face.jpg")
+    assert store.read(location) == b"face-jpeg"
+    assert os.path.basename(store.put("smile", 3, TS, b"x")).startswith("smile_20260301_123000")
+
+
+def test_segment_store_appends_per_hour_and_reads_back(tmp_path):
+    store = SegmentStore(str(tmp_path), segment_max_bytes=200)
+    locations = [store.put("smile", 1, TS + i, bytes([i]) * 40) for i in range(6)]
+    locations.append(store.put("smile", 1, TS + 3600, b"next hour"))
+    # 40 B crops + 21 B headers, three to a 200 B segment, then a new file for the next hour
+    assert store.segments() == ["20260301_12_0.seg", "20260301_12_1.seg", "20260301_13_0.seg"]
+    for i, location in enumerate(locations[:6]):
+        assert store.read(location) == bytes([i]) * 40
+    assert store.read(locations[-1]) == b"next hour"
+    # reading the active segment, then appending past the mapped size remaps
+    more = store.put("smile", 2, TS + 3601, b"later")
+    assert store.read(more) == b"later" and store.stats()['remaps'] >= 1
+    assert [(kind, face_id, length) for kind, face_id, _, _, length in store.records("20260301_13_0.seg")] == \
+        [("smile", 1, 9), ("smile", 2, 5)]
+    # files from the directory backend still read
+    old = tmp_path / "face.jpg"
+    old.write_bytes(b"old")
+    assert store.read(str(old)) == b"old"
+    assert store.read("seg:missing.seg@0+3") is None
+    store.close()
+
+
+def test_compaction_rewrites_mostly_dead_segments_and_moves_db_locations(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    mgr = DBmanager()
+    store = SegmentStore(str(tmp_path / "segments"))
+    face = store.put("face", 1, TS, b"F" * 100)
+    mgr.log_face_crop(1, face)
+    for i in range(10):
+        mgr.log_smilemeta_to_db(1, 0.25, store.put("smile", 1, TS + i, bytes([i]) * 100))
+    store.put("smile", 2, TS + 3600, b"active")
+    assert mgr.flush()
+    conn = mgr.state['DB_conn']
+    # retention removed 8 of the 10 smiles
+    conn.execute("DELETE FROM smiles WHERE id NOT IN (SELECT id FROM smiles ORDER BY id DESC LIMIT 2)")
+    conn.commit()
+    old = tmp_path / "segments" / "20260301_12_0.seg"
+    size = old.stat().st_size
+
+    assert compact_segments(store, mgr.state['DB_path'], grace_s=60)['rewritten'] == 0 # just written
+    os.utime(old, (time.time() - 600, time.time() - 600))
+    result = compact_segments(store, mgr.state['DB_path'], grace_s=60)
+    assert result['rewritten'] == 1 and result['reclaimed_bytes'] == size - 3 * (21 + 100)
+    assert not old.exists()
+    rows = conn.execute("SELECT crop FROM smiles ORDER BY id").fetchall()
+    assert [store.read(crop) for (crop,) in rows] == [bytes([8]) * 100, bytes([9]) * 100]
+    (face_location,) = conn.execute("SELECT crop_path FROM faces WHERE face_id = 1").fetchone()
+    assert face_location.startswith("seg:20260301_12_0.c0.seg") and store.read(face_location) == b"F" * 100
+    # the active hour's segment is never touched
+    assert "20260301_13_0.seg" in store.segments()
+    store.close()
+    mgr.cleanup_resources()
+
+
+def test_unknown_store_name():
+    with pytest.raises(ValueError):
+        create_crop_store("s3", "/tmp")
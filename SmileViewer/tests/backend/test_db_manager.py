@@ -16,8 +16,9 @@ def test_db_setup_and_insert(tmp_path, monkeypatch):
     cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='smiles'")
     assert cur.fetchone() is not None
 
-    # Insert a row
+    # Insert a row, the writer thread commits it
     mgr.log_smilemeta_to_db(face_id=1)
+    assert mgr.flush()
     cur.execute("SELECT COUNT(*) FROM smiles")
     count = cur.fetchone()[0]
     assert count >= 1
@@ -25,3 +26,91 @@ def test_db_setup_and_insert(tmp_path, monkeypatch):
     mgr.cleanup_resources()
 
 
+def test_writer_batches_and_flushes_on_cleanup(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+
+    mgr = DBmanager(batch_size=50, flush_interval_s=10.0)
+    for i in range(120):
+        mgr.log_smilemeta_to_db(face_id=i % 4)
+    assert mgr.flush()
+    stats = mgr.stats()
+    assert stats['written'] == 120 and stats['pending'] == 0
+    assert stats['batches'] == 3 # 50 + 50 + the flushed 20
+
+    # rows still waiting for their batch window go in on shutdown
+    for _ in range(7):
+        mgr.log_smilemeta_to_db(face_id=9)
+    mgr.cleanup_resources()
+    conn = sqlite3.connect(tmp_path / 'server' / 'data' / 'smile_metadata.db')
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("SELECT COUNT(*) FROM smiles WHERE face_id = 9").fetchone()[0] == 7
+    conn.close()
+
+
+def test_writer_stats_count_smiles_and_failed_batches(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+
+    mgr = DBmanager()
+    mgr.log_face_crop(1, "images/1/face.jpg")
+    for _ in range(4):
+        mgr.log_smilemeta_to_db(face_id=1)
+    assert mgr.flush()
+    stats = mgr.stats()
+    assert stats['written'] == 5 and stats['smiles_written'] == 4 and stats['pending'] == 0
+
+    # a batch that can't commit is counted as failed, not left pending forever
+    mgr.state['DB_conn'].execute("DROP TABLE smiles")
+    mgr.state['DB_conn'].commit()
+    for _ in range(3):
+        mgr.log_smilemeta_to_db(face_id=2)
+    assert mgr.flush()
+    stats = mgr.stats()
+    assert stats['failed'] == 3 and stats['errors'] == 1 and stats['pending'] == 0
+    assert stats['written'] == 5 and stats['smiles_written'] == 4
+    mgr.cleanup_resources()
+
+
+def test_faces_table_tracks_smiles_and_gives_next_face_id(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+
+    mgr = DBmanager()
+    assert mgr.state['next_face_id'] is None
+    mgr.log_face_crop(4, "images/4/face.jpg")
+    for _ in range(3):
+        mgr.log_smilemeta_to_db(face_id=4, smiling_s=0.5)
+    mgr.log_smilemeta_to_db(face_id=6, smiling_s=0.25)
+    assert mgr.flush()
+    cur = mgr.state['DB_cusor']
+    cur.execute("SELECT face_id, smile_count, crop_path, smiling_s FROM faces ORDER BY face_id")
+    assert cur.fetchall() == [(4, 3, "images/4/face.jpg", 1.5), (6, 1, None, 0.25)]
+    mgr.cleanup_resources()
+
+    # next start: ids continue after the last recorded face
+    mgr = DBmanager()
+    assert mgr.state['next_face_id'] == 7
+    mgr.cleanup_resources()
+
+
+def test_faces_backfill_from_an_older_db(tmp_path, monkeypatch):
+    data = tmp_path / 'server' / 'data'
+    (data / 'images' / '2').mkdir(parents=True)
+    (data / 'images' / '2' / 'face.jpg').write_bytes(b"jpg")
+    monkeypatch.chdir(tmp_path)
+    conn = sqlite3.connect(data / 'smile_metadata.db')
+    conn.execute("CREATE TABLE smiles (id INTEGER PRIMARY KEY AUTOINCREMENT, face_id INTEGER NOT NULL, capture_time TEXT NOT NULL)")
+    conn.executemany("INSERT INTO smiles (face_id, capture_time) VALUES (?, ?)",
+                     [(1, "2026-01-01T10:00:00"), (2, "2026-01-01T10:05:00"), (2, "2026-01-01T10:06:00")])
+    conn.commit()
+    conn.close()
+
+    mgr = DBmanager()
+    cur = mgr.state['DB_cusor']
+    cur.execute("SELECT face_id, first_seen, last_seen, smile_count, crop_path FROM faces ORDER BY face_id")
+    assert cur.fetchall() == [(1, "2026-01-01T10:00:00", "2026-01-01T10:00:00", 1, None),
+                              (2, "2026-01-01T10:05:00", "2026-01-01T10:06:00", 2,
+                               os.path.join(os.getcwd(), "server", "data", "images", "2", "face.jpg"))]
+    assert mgr.state['next_face_id'] == 3
+    mgr.cleanup_resources()
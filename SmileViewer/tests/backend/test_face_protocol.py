@@ -0,0 +1,175 @@
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from Server.Face_protocol import (HEADER, RECORD_FIELDS, STATUS_CODES, FaceDelta, decode_delta_binary, decode_faces_binary,
+                                  delta_binary, delta_json, faces_binary, faces_json)
+from Server.WS_controls import ControlsManager
+
+
+def _faces():
+    return {
+        7: {"face_bbox": (100, 120, 220, 260), "smile_bbox": (140, 210, 190, 230), "smile_status": "Smiling"},
+        70000: {"face_bbox": (300, 40, 380, 150), "smile_bbox": None, "smile_status": "Detecting..."},
+    }
+
+
+def test_every_status_survives_binary():
+    for status in ("Detecting...", "Smiling", "Not Smiling", "Tilted", "Occluded"):
+        assert status in STATUS_CODES
+        faces = {1: {"face_bbox": (0, 0, 10, 10), "smile_bbox": None, "smile_status": status}}
+        assert decode_faces_binary(faces_binary(faces, 0.0))[1][0][9] == status
+
+
+def _landmarks(count=40):
+    rng = np.random.default_rng(0)
+    return {7: rng.integers(0, 640, (count, 2)), 70000: rng.integers(0, 480, (count, 2))}
+
+
+def test_binary_matches_json_rows():
+    faces, landmarks = _faces(), _landmarks()
+    for lm in (None, landmarks):
+        msg = faces_json(faces, 12.5, lm)
+        data = faces_binary(faces, 12.5, lm)
+        ts, rows = decode_faces_binary(data)
+        assert ts == 12.5
+        assert rows == msg['f']
+    assert msg['f'][1][5:9] == [-1, -1, -1, -1]
+    # fixed layout, every int16 view lands on an even offset
+    assert len(data) == HEADER.size + 2 * (RECORD_FIELDS * 2 + 40 * 2 * 2)
+    assert len(data) < len(json.dumps(msg, separators=(",", ":"))) / 2
+
+
+def test_no_faces_is_just_a_header():
+    data = faces_binary({}, 1.0)
+    assert len(data) == HEADER.size
+    assert decode_faces_binary(data) == (1.0, [])
+
+
+class FakeControlsSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+@pytest.mark.asyncio
+async def test_send_formats_builds_each_used_format_once():
+    manager = ControlsManager()
+    json_a, json_b, binary = FakeControlsSocket(), FakeControlsSocket(), FakeControlsSocket()
+    manager.active.update([json_a, json_b, binary])
+    manager.set_format(binary, "binary")
+    manager.set_format(json_b, "nonsense") # unknown keeps json
+    built = []
+
+    def build(fmt, fn):
+        def wrapped():
+            built.append(fmt)
+            return fn()
+        return wrapped
+
+    await manager.send_formats({
+        "json": build("json", lambda: faces_json(_faces(), 3.0)),
+        "binary": build("binary", lambda: faces_binary(_faces(), 3.0)),
+    })
+    await manager.flush()
+    assert sorted(built) == ["binary", "json"]
+    assert json.loads(json_a.sent[0])['t'] == "f" and json_a.sent == json_b.sent
+    assert isinstance(binary.sent[0], bytes)
+    assert decode_faces_binary(binary.sent[0])[1] == json.loads(json_a.sent[0])['f']
+
+    # nobody on binary -> never built
+    manager.set_format(binary, "json")
+    built.clear()
+    await manager.send_formats({
+        "json": build("json", lambda: faces_json(_faces(), 4.0)),
+        "binary": build("binary", lambda: faces_binary(_faces(), 4.0)),
+    })
+    assert built == ["json"]
+    await manager.close()
+
+
+def _delta(**controls):
+    return FaceDelta(SimpleNamespace(controls={"FACE_DELTA": True, "FACE_DELTA_TOLERANCE_PX": 2,
+                                               "FACE_KEYFRAME_EVERY": 30, **controls}))
+
+
+def _moved(faces, face_id, dx):
+    faces = {k: dict(v) for k, v in faces.items()}
+    x1, y1, x2, y2 = faces[face_id]['face_bbox']
+    faces[face_id]['face_bbox'] = (x1 + dx, y1, x2 + dx, y2)
+    return faces
+
+
+def test_delta_sends_only_what_moved_past_tolerance():
+    delta = _delta()
+    keyframe, faces, _, removed = delta.update(_faces())
+    assert keyframe and set(faces) == {7, 70000}
+
+    # jitter under the tolerance, twice in the same direction: measured against what was sent, not the last frame
+    assert delta.update(_moved(_faces(), 7, 1))[:2] == (False, {})
+    keyframe, faces, _, removed = delta.update(_moved(_faces(), 7, 3))
+    assert not keyframe and list(faces) == [7] and removed == []
+    assert delta.keyframe()[0][7]['face_bbox'] == (103, 120, 223, 260)
+
+    # status change goes out even without movement
+    changed = _moved(_faces(), 7, 3)
+    changed[70000]['smile_status'] = "Not Smiling"
+    assert list(delta.update(changed)[1]) == [70000]
+
+    # face left, new face arrived
+    later = {7: changed[7], 9: dict(changed[70000])}
+    _, faces, _, removed = delta.update(later)
+    assert list(faces) == [9] and removed == [70000]
+    assert set(delta.keyframe()[0]) == {7, 9}
+    assert delta.stats()['suppressed_ratio'] > 0
+
+
+def test_periodic_keyframes_and_landmark_toggle():
+    delta = _delta(FACE_KEYFRAME_EVERY=3)
+    kinds = [delta.update(_faces())[0] for _ in range(6)]
+    assert kinds == [True, False, False, True, False, False]
+    # turning landmarks on changes what every row carries, so everyone gets a keyframe
+    assert delta.update(_faces(), _landmarks())[0]
+    lm = _landmarks()
+    lm[7] = lm[7] + 5
+    _, faces, landmarks, _ = delta.update(_faces(), lm)
+    assert list(faces) == [7] and list(landmarks) == [7]
+    assert _delta(FACE_DELTA=False).update(_faces())[0] and _delta(FACE_DELTA=False).update(_faces())[0]
+
+
+def test_binary_delta_matches_json():
+    faces, landmarks = _faces(), _landmarks()
+    msg = delta_json({7: faces[7]}, [70000, 123456], 2.0, {7: landmarks[7]})
+    ts, rows, removed = decode_delta_binary(delta_binary({7: faces[7]}, [70000, 123456], 2.0, {7: landmarks[7]}))
+    assert (ts, rows, removed) == (2.0, msg['f'], msg['r'])
+    with pytest.raises(ValueError):
+        decode_faces_binary(delta_binary({}, [1], 2.0))
+
+
+@pytest.mark.asyncio
+async def test_late_joiner_gets_keyframe_then_deltas():
+    manager = ControlsManager()
+    old, late = FakeControlsSocket(), FakeControlsSocket()
+    manager.active.add(old)
+    builders = {"json": lambda: {"t": "d"}, "binary": lambda: None}
+    keyframes = {"json": lambda: {"t": "f"}, "binary": lambda: None}
+    await manager.send_formats(builders, keyframes)
+    manager.active.add(late)
+    manager.needs_keyframe.add(late) # what connect() does
+    await manager.send_formats(builders, keyframes)
+    await manager.send_formats(builders, keyframes)
+    await manager.flush()
+    assert [json.loads(m)['t'] for m in old.sent] == ["d", "d", "d"]
+    assert [json.loads(m)['t'] for m in late.sent] == ["f", "d"]
+    # empty delta: nothing goes out
+    await manager.send_formats({"json": lambda: None, "binary": lambda: None}, keyframes)
+    await manager.flush()
+    assert len(old.sent) == 3
+    await manager.close()
@@ -0,0 +1,96 @@
+import itertools
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+from Server.Face_tracker import MotionModel, iou_matrix, linear_assignment, match_faces
+from Server.Smile_ID import SmileIDer
+
+
+def _brute_force_cost(cost):
+    rows, cols = cost.shape
+    if rows <= cols:
+        return min(sum(cost[r, c] for r, c in zip(range(rows), perm))
+                   for perm in itertools.permutations(range(cols), rows))
+    return _brute_force_cost(cost.T)
+
+
+def test_linear_assignment_is_optimal():
+    rng = np.random.default_rng(1)
+    for shape in [(1, 1), (3, 3), (2, 4), (4, 2), (5, 5)]:
+        cost = rng.random(shape)
+        pairs = linear_assignment(cost)
+        assert len(pairs) == min(shape)
+        assert len({r for r, _ in pairs}) == len(pairs) and len({c for _, c in pairs}) == len(pairs)
+        assert abs(sum(cost[r, c] for r, c in pairs) - _brute_force_cost(cost)) < 1e-9
+    assert linear_assignment(np.zeros((0, 3))) == []
+
+
+def test_iou_matrix():
+    iou = iou_matrix([(0, 0, 10, 10)], [(0, 0, 10, 10), (5, 0, 15, 10), (20, 20, 30, 30)])
+    np.testing.assert_allclose(iou, [[1.0, 50 / 150, 0.0]])
+
+
+def test_match_faces_gates_far_detections():
+    matches, unmatched = match_faces([(0.2, 0.5)], [(0, 0, 10, 10)],
+                                     [(0.8, 0.5), (0.25, 0.5)], [(50, 0, 60, 10), (0, 0, 10, 10)], gate=0.15)
+    assert matches == [(0, 1)]
+    assert unmatched == [0]
+
+
+def test_check_faces_close_faces_keep_their_ids():
+    # two faces side by side both step right; greedy nearest-center would hand both detections to face 2
+    sid = SmileIDer(parent=SimpleNamespace(state={}))
+    sid.controls = {"PF_SHIFT_BUFF": 0.15}
+    sid.DB_manager = SimpleNamespace(state={"next_face_id": 3})
+    now = time.time()
+    sid.state = {"w": 100, "h": 100, "persistent_faces": {
+        1: {"center": np.array([0.40, 0.5]), "face_bbox": (30, 40, 50, 60), "visibility_count": 5, "last_seen": now},
+        2: {"center": np.array([0.52, 0.5]), "face_bbox": (42, 40, 62, 60), "visibility_count": 5, "last_seen": now},
+    }}
+    detections = [
+        {"landmarks": None, "center": np.array([0.47, 0.5]), "face_bbox": (37, 40, 57, 60)},
+        {"landmarks": None, "center": np.array([0.58, 0.5]), "face_bbox": (48, 40, 68, 60)},
+    ]
+    current_ids = sid.check_faces(detections)
+    faces = sid.state["persistent_faces"]
+    assert current_ids == {1, 2}
+    np.testing.assert_allclose(faces[1]["center"], [0.47, 0.5])
+    np.testing.assert_allclose(faces[2]["center"], [0.58, 0.5])
+    assert sid.DB_manager.state["next_face_id"] == 3 # no id burned
+
+
+def test_motion_model_learns_velocity():
+    motion = MotionModel((0.1, 0.5), ts=0.0)
+    for step in range(1, 5):
+        motion.update((0.1 + 0.2 * step, 0.5), ts=step * 0.1)
+    np.testing.assert_allclose(motion.velocity, [2.0, 0.0], atol=0.05)
+    np.testing.assert_allclose(motion.predict(0.5), [1.1, 0.5], atol=0.01)
+
+
+def test_check_faces_fast_mover_keeps_id_and_coasts(monkeypatch):
+    # 0.2 per frame is beyond PF_SHIFT_BUFF from the last center, but close to the predicted one
+    clock = {"now": 100.0}
+    monkeypatch.setattr("Server.Smile_ID.time.time", lambda: clock["now"])
+    sid = SmileIDer(parent=SimpleNamespace(state={}))
+    sid.controls = {"PF_SHIFT_BUFF": 0.15}
+    sid.DB_manager = SimpleNamespace(state={"next_face_id": 2})
+    sid.state = {"w": 100, "h": 100, "persistent_faces": {
+        1: {"center": np.array([0.1, 0.5]), "face_bbox": (0, 40, 20, 60), "visibility_count": 1,
+            "last_seen": clock["now"], "motion": MotionModel((0.1, 0.5), clock["now"])},
+    }}
+    faces = sid.state["persistent_faces"]
+    # the first step is within reach, it teaches the filter the velocity
+    positions = [0.2, 0.4, 0.6, 0.8]
+    for step, x in enumerate(positions, start=1):
+        clock["now"] += 0.1
+        box = (int(x * 100) - 10, 40, int(x * 100) + 10, 60)
+        if step == 3:
+            assert sid.check_faces([]) == set() # missed detection, track coasts
+            assert faces[1]["missed_frames"] == 1
+            continue
+        assert sid.check_faces([{"landmarks": None, "center": np.array([x, 0.5]), "face_bbox": box}]) == {1}
+    assert list(faces) == [1]
+    assert faces[1]["missed_frames"] == 0
+    assert sid.DB_manager.state["next_face_id"] == 2
@@ -0,0 +1,84 @@
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from Server.Flow_tracker import FlowTracker, flow_landmarks, landmark_error_px
+from Server.Inference_backend import create_backend
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "Samples", "Faces", "Sam1.jpeg")
+
+
+def _shifted(image, dx, dy):
+    h, w = image.shape[:2]
+    return cv2.warpAffine(image, np.float32([[1, 0, dx], [0, 1, dy]]), (w, h), borderMode=cv2.BORDER_REPLICATE)
+
+
+def test_flow_follows_a_moving_face():
+    image = cv2.imread(SAMPLE)
+    h, w = image.shape[:2]
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    backend = create_backend("inprocess")
+    try:
+        _, faces = backend.infer_sync(None, rgb)
+    finally:
+        backend.close()
+    assert len(faces) == 1
+    prev_gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(_shifted(image, 6, -3), cv2.COLOR_BGR2GRAY)
+    moved, confidence, moves = flow_landmarks(prev_gray, gray, faces, w, h)
+    assert moved.shape == faces.shape and moved.dtype == np.float32
+    assert confidence[0] > 0.9
+    assert abs(moves[0] - np.hypot(6, -3)) < 1.0
+    expected = faces.copy()
+    expected[:, :, 0] += 6 / w
+    expected[:, :, 1] -= 3 / h
+    assert landmark_error_px(moved, expected, w, h) < 1.0
+
+
+def test_k_follows_budget_and_motion():
+    controls = {"FLOW_MAX_K": 6, "FLOW_TARGET_FPS": 25, "FLOW_MOTION_PX": 12.0}
+    tracker = FlowTracker(SimpleNamespace(controls=controls))
+    s = tracker.state
+    # detection fits the 40 ms budget -> detect every frame
+    s.update(detect_ms=30.0, flow_ms=4.0, motion_px=0.5)
+    tracker.update_k()
+    assert s['k'] == 1
+    # 100 ms detections need (100 - 4) / (40 - 4) -> 3 frames per detection
+    s.update(detect_ms=100.0)
+    tracker.update_k()
+    assert s['k'] == 3
+    # fast motion caps it
+    s.update(motion_px=8.0)
+    tracker.update_k()
+    assert s['k'] == 1
+    # never past FLOW_MAX_K
+    s.update(detect_ms=1000.0, motion_px=0.0)
+    tracker.update_k()
+    assert s['k'] == 6
+
+
+def test_low_confidence_forces_detection():
+    controls = {"FLOW_MIN_CONFIDENCE": 0.8}
+    tracker = FlowTracker(SimpleNamespace(controls=controls))
+    w, h = 64, 64
+    blank = np.zeros((h, w), dtype=np.uint8)
+    # every landmark off the frame, nothing to track
+    faces = np.full((1, 10, 3), 2.0, dtype=np.float32)
+    tracker.observe_detection(blank, faces, None, 50.0, w, h)
+    assert tracker.track(blank, w, h) is None
+    assert tracker.state['forced_detects'] == 1
+
+
+def test_empty_scene_is_detected_every_frame():
+    tracker = FlowTracker(SimpleNamespace(controls={}))
+    blank = np.zeros((64, 64), dtype=np.uint8)
+    tracker.state['k'] = 6
+    # nobody found: flow has nothing to follow, the next frame has to detect again
+    tracker.observe_detection(blank, np.empty((0, 478, 3), dtype=np.float32), None, 200.0, 64, 64)
+    tracker.state['k'] = 6
+    assert tracker.needs_detection()
+    tracker.observe_detection(blank, np.full((1, 10, 3), 0.5, dtype=np.float32), None, 200.0, 64, 64)
+    tracker.state['k'] = 6
+    assert not tracker.needs_detection()
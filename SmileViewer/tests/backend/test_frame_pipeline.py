@@ -0,0 +1,105 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from Server.Frame_pipeline import FramePipeline, LatestQueue
+
+
+@pytest.mark.asyncio
+async def test_latest_queue_drop_oldest_keeps_newest():
+    q = LatestQueue(depth=1, drop="oldest")
+    await q.put(1)
+    await q.put(2)
+    assert q.dropped == 1
+    assert await q.get() == 2
+
+
+@pytest.mark.asyncio
+async def test_latest_queue_drop_newest_refuses_incoming():
+    q = LatestQueue(depth=2, drop="newest")
+    assert await q.put(1) is True
+    assert await q.put(2) is True
+    assert await q.put(3) is False
+    assert [await q.get(), await q.get()] == [1, 2]
+
+
+def test_latest_queue_rejects_bad_config():
+    with pytest.raises(ValueError):
+        LatestQueue(depth=0)
+    with pytest.raises(ValueError):
+        LatestQueue(drop="sometimes")
+
+
+@pytest.mark.asyncio
+async def test_pipeline_throughput_tracks_slowest_stage():
+    stage_s = 0.02
+    config = FramePipeline.default_config()
+    for name in ("inference", "annotate", "encode"):
+        config['stages'][name]['thread'] = True
+    parent = SimpleNamespace(state={
+        "shutdown_event": asyncio.Event(),
+        "pipeline": config,
+    })
+    pipeline = FramePipeline(parent)
+    latencies = []
+
+    async def capture(_):
+        await asyncio.sleep(0.002)
+        return {"ts": time.perf_counter()}
+
+    def blocking(packet):
+        time.sleep(stage_s)
+        return packet
+
+    async def fanout(packet):
+        latencies.append(time.perf_counter() - packet['ts'])
+        return packet
+
+    stages = [
+        ("capture", capture),
+        ("inference", blocking),
+        ("tracking", lambda p: p),
+        ("annotate", blocking),
+        ("encode", blocking),
+        ("fanout", fanout),
+    ]
+    run_s = 0.6
+    task = asyncio.create_task(pipeline.run(stages))
+    await asyncio.sleep(run_s)
+    parent.state['shutdown_event'].set()
+    await asyncio.wait_for(task, timeout=2.0)
+
+    serial_frames = run_s / (3 * stage_s)
+    # overlapped stages should clearly beat running the three blocking stages back to back
+    assert len(latencies) > 1.5 * serial_frames
+    # latest-wins queues: a frame never waits behind more than one other frame per stage
+    assert max(latencies[2:]) < 2 * 3 * stage_s + 0.05
+    assert pipeline.stats()['stages']['inference']['dropped'] > 0
+
+
+@pytest.mark.asyncio
+async def test_inline_stages_skip_the_thread_hop():
+    import threading
+    config = FramePipeline.default_config()
+    config['stages']['work'] = {"depth": 1, "drop": "oldest", "thread": True}
+    parent = SimpleNamespace(state={"pipeline": config, "shutdown_event": asyncio.Event()})
+    pipeline = FramePipeline(parent)
+    seen = []
+    frames = iter([(), ("work",), ()])
+
+    async def capture(_):
+        await asyncio.sleep(0.05) # slow enough that the latest-wins queue never drops one
+        try:
+            return {"inline_stages": next(frames)}
+        except StopIteration:
+            parent.state['shutdown_event'].set()
+            await asyncio.sleep(1)
+
+    def work(packet):
+        seen.append(threading.current_thread() is threading.main_thread())
+        return packet
+
+    await asyncio.wait_for(pipeline.run([("capture", capture), ("work", work)]), timeout=5)
+    assert seen == [False, True, False]
@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from Server.Frame_pipeline import LatestQueue
+from Server.Frame_ring import FrameRing, frame_ref
+
+
+def _ring(slots=4):
+    parent = SimpleNamespace(state={"latest_frame": None})
+    return parent, FrameRing(parent, slots=slots)
+
+
+def _capture(ring, frame):
+    # what capture_frame does with a slot
+    slot = ring.acquire()
+    flipped = cv2.flip(frame, 1, dst=slot.buffer('frame', frame.shape, ring.state))
+    rgb = cv2.cvtColor(flipped, cv2.COLOR_BGR2RGB, dst=slot.buffer('rgb', frame.shape, ring.state))
+    assert flipped is slot.buffers['frame'] and rgb is slot.buffers['rgb']
+    return slot
+
+
+def test_slots_are_reused_without_new_allocations():
+    parent, ring = _ring()
+    frame = np.random.default_rng(0).integers(0, 255, (48, 64, 3), dtype=np.uint8)
+    for _ in range(50):
+        slot = _capture(ring, frame)
+        ring.set_latest(slot.ref('frame'))
+        ring.release(slot)
+    stats = ring.stats()
+    assert stats['frames'] == 50
+    assert stats['slots'] == 4 and stats['grown'] == 0
+    assert stats['allocations'] == 8 # frame + rgb for each slot, once
+    assert np.array_equal(parent.state['latest_frame'].copy(), cv2.flip(frame, 1))
+
+
+def test_busy_slots_are_not_handed_out():
+    _, ring = _ring(slots=2)
+    held = [ring.acquire(), ring.acquire()]
+    third = ring.acquire()
+    assert third not in held
+    assert ring.stats()['grown'] == 1
+    ring.release(held[0])
+    assert ring.acquire() is held[0]
+
+
+def test_latest_frame_holds_its_slot_and_crops_go_stale_on_reuse():
+    parent, ring = _ring(slots=2)
+    frame = np.full((10, 10, 3), 5, dtype=np.uint8)
+    first = _capture(ring, frame)
+    ring.set_latest(first.ref('frame'))
+    ring.release(first)
+    ref = parent.state['latest_frame']
+    assert ref.crop(2, 2, 6, 6).shape == (4, 4, 3)
+
+    # latest still points at the first slot, so the next two frames can't take it
+    second = _capture(ring, frame)
+    third = _capture(ring, frame)
+    assert first not in (second, third)
+    assert ref.valid
+
+    # once latest moves on, the slot is recycled and the old ref stops handing out pixels
+    ring.set_latest(third.ref('frame'))
+    ring.release(second)
+    ring.release(third)
+    assert _capture(ring, frame) in (first, second)
+    assert ring.acquire() in (first, second)
+    assert not ref.valid
+    assert ref.crop(2, 2, 6, 6) is None
+
+
+def test_view_is_read_only_and_frame_ref_wraps_plain_arrays():
+    _, ring = _ring()
+    slot = _capture(ring, np.zeros((8, 8, 3), dtype=np.uint8))
+    assert not slot.ref('frame').view().flags.writeable
+    ref = frame_ref(np.ones((4, 4, 3), dtype=np.uint8))
+    ring.set_latest(ref)
+    assert ref.copy().sum() == 48
+    assert ring.stats()['in_use'] == 1 # only the captured slot, the wrapped array isn't part of the ring
+
+
+def test_dropped_packets_give_their_slot_back():
+    _, ring = _ring(slots=2)
+    q = LatestQueue(depth=1, drop="oldest", on_drop=ring.release_packet)
+    first, second = ring.acquire(), ring.acquire()
+    q.put_nowait({"slot": first})
+    q.put_nowait({"slot": second})
+    assert first.refs == 0 and second.refs == 1
@@ -0,0 +1,53 @@
+import asyncio
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Inference_backend import create_backend
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "Samples", "Faces", "Sam1.jpeg")
+
+
+def test_unknown_backend_rejected():
+    with pytest.raises(ValueError):
+        create_backend("gpu")
+
+
+def test_process_backend_matches_inprocess_on_sample():
+    rgb = cv2.cvtColor(cv2.imread(SAMPLE), cv2.COLOR_BGR2RGB)
+    reference = create_backend("inprocess")
+    workers = create_backend("process")
+    try:
+        ref_hands, ref_faces = reference.infer_sync(rgb, rgb)
+        hands, faces = asyncio.run(workers.infer(rgb, rgb))
+        assert faces.dtype == np.float32 and faces.shape == ref_faces.shape
+        assert faces.shape[1:] == (478, 3)
+        np.testing.assert_allclose(faces, ref_faces, atol=1e-5)
+        assert hands.shape == ref_hands.shape
+        # skipping a model sends nothing to its worker
+        hands, faces = workers.infer_sync(None, rgb)
+        assert hands.shape[0] == 0 and faces.shape[0] == ref_faces.shape[0]
+    finally:
+        workers.close()
+        reference.close()
+
+
+@pytest.mark.asyncio
+async def test_thread_backend_concurrent_matches_sequential():
+    rgb = cv2.cvtColor(cv2.imread(SAMPLE), cv2.COLOR_BGR2RGB)
+    backend = create_backend("thread")
+    try:
+        seq_hands, seq_faces = await backend.infer(rgb, rgb, concurrent=False)
+        assert backend.stats()['concurrent'] is False
+        # static sample frame: the tracking graph settles after a couple of frames
+        for _ in range(3):
+            hands, faces = await backend.infer(rgb, rgb, concurrent=True)
+        stats = backend.stats()
+        assert stats['concurrent'] is True
+        assert stats['wall_ms'] > 0 and stats['overlap_gain'] > 0
+        assert faces.shape == seq_faces.shape and hands.shape == seq_hands.shape
+        np.testing.assert_allclose(faces, seq_faces, atol=0.05)
+    finally:
+        backend.close()
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from Server.Frame_ring import FrameRing
+from Server.server import SmileAnalysisServer
+
+
+class FakeCam:
+    def read(self, image=None):
+        if image is None:
+            image = np.empty((48, 64, 3), dtype=np.uint8)
+        image[...] = 7
+        return True, image
+
+
+class DrawSpy:
+    def __init__(self):
+        self.calls = []
+
+    def draw_hands(self, frame, hands):
+        self.calls.append("hands")
+
+    def draw_faces(self, frame, faces):
+        self.calls.append("faces")
+
+    def draw_tracked_faces(self, frame, tracked_faces):
+        frame[0, 0] = 255
+        self.calls.append("tracked")
+
+
+def _server(video_clients, overlay_only):
+    server = SimpleNamespace(
+        state={"webcam": FakeCam(), "Video_Connections": {f"client_{i}": object() for i in range(video_clients)}},
+        controls={"TEST_MODE": False, "OVERLAY_ONLY": overlay_only, "DRAW_LANDMARKS": True},
+        SmileIDer=DrawSpy(),
+    )
+    server.FrameRing = FrameRing(server)
+    server.read_webcam = lambda into=None: SmileAnalysisServer.read_webcam(server, into)
+    return server
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("video_clients,overlay_only,draws", [(1, False, True), (1, True, False), (0, False, False)])
+async def test_drawing_and_pristine_copy_only_when_someone_sees_them(video_clients, overlay_only, draws):
+    server = _server(video_clients, overlay_only)
+    packet = await SmileAnalysisServer.capture_frame(server)
+    packet.update(hands=[], faces=[], tracked_faces={})
+    SmileAnalysisServer.annotate_frame(server, packet)
+    assert packet['draw'] is draws
+    assert (packet['pristine'] is packet['frame']) is not draws
+    assert server.SmileIDer.calls == (["hands", "faces", "tracked"] if draws else [])
+    assert packet['pristine'][0, 0, 0] == 7 # crops never see annotations
+
+
+@pytest.mark.asyncio
+async def test_toggle_mid_pipeline_keeps_the_capture_decision():
+    server = _server(1, True)
+    packet = await SmileAnalysisServer.capture_frame(server)
+    packet.update(hands=[], faces=[], tracked_faces={})
+    server.controls['OVERLAY_ONLY'] = False # turned off while the frame was in inference
+    SmileAnalysisServer.annotate_frame(server, packet)
+    assert server.SmileIDer.calls == [] and packet['pristine'][0, 0, 0] == 7
@@ -0,0 +1,165 @@
+import asyncio
+import datetime
+import os
+import time
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Crop_server import CropServer
+from Server.Crop_store import DirectoryStore, SegmentStore
+from Server.DB_manager import DBmanager
+from Server.Retention_service import RetentionService
+
+NOW = time.mktime((2026, 3, 31, 12, 0, 0, 0, 0, -1))
+
+
+def _setup(tmp_path, monkeypatch, store, **controls):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    mgr = DBmanager()
+    parent = SimpleNamespace(state={"shutdown_event": asyncio.Event()}, DB_manager=mgr, CropStore=store,
+                             controls={"RETENTION": True, "RETENTION_MAX_AGE_DAYS": 30, "RETENTION_DISK_BUDGET_MB": 0,
+                                       **controls})
+    return mgr, RetentionService(parent, slice_rows=3, pause_s=0, grace_s=60)
+
+
+def _smile(mgr, face_id, when, crop=None):
+    mgr.state['DB_conn'].execute("INSERT INTO smiles (face_id, capture_time, crop) VALUES (?, ?, ?)",
+                                 (face_id, when.isoformat(), crop))
+
+
+def _pass(retention):
+    asyncio.run(retention.run_pass(now=NOW))
+    asyncio.run(retention.close())
+
+
+def test_old_smiles_are_rolled_up_per_face_and_hour(tmp_path, monkeypatch):
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store)
+    old = datetime.datetime(2026, 2, 1, 9, 10)
+    for i in range(7): # 7 old smiles of face 1 over two hours, one of face 2, slices of 3
+        ts = old + datetime.timedelta(minutes=20 * i)
+        _smile(mgr, 1, ts, store.put("smile", 1, ts.timestamp(), b"x" * 10))
+    _smile(mgr, 2, old, None)
+    recent = datetime.datetime(2026, 3, 30, 8, 0)
+    _smile(mgr, 1, recent, store.put("smile", 1, recent.timestamp(), b"y" * 10))
+    mgr.state['DB_conn'].commit()
+    _pass(retention)
+    conn = mgr.state['DB_conn']
+    assert conn.execute("SELECT face_id, capture_time FROM smiles").fetchall() == [(1, recent.isoformat())]
+    assert conn.execute("SELECT face_id, hour, smiles FROM smile_rollups ORDER BY face_id, hour").fetchall() == [
+        (1, "2026-02-01T09:00:00", 3), (1, "2026-02-01T10:00:00", 3), (1, "2026-02-01T11:00:00", 1),
+        (2, "2026-02-01T09:00:00", 1)]
+    assert os.listdir(tmp_path / "server" / "data" / "images" / "1") == [
+        os.path.basename(store.path_for("smile", 1, recent.timestamp()))]
+    stats = retention.stats()
+    assert stats['rolled_up'] == 8 and stats['crops_evicted'] == 7 and stats['reclaimed_bytes'] == 70
+    assert stats['passes'] == 1 and stats['phase'] == "idle" and stats['max_slice_ms'] > 0
+    mgr.cleanup_resources()
+
+
+def test_thumbnails_go_with_their_crops(tmp_path, monkeypatch):
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store)
+    retention.parent.CropServer = crop_server = CropServer(retention.parent, thumbs_dir=str(tmp_path / "thumbs"))
+    ok, jpeg = cv2.imencode(".jpg", np.full((64, 64, 3), 90, dtype=np.uint8))
+    for when in (datetime.datetime(2026, 2, 1, 9, 0), datetime.datetime(2026, 3, 30, 9, 0)): # expired, kept
+        _smile(mgr, 1, when, store.put("smile", 1, when.timestamp(), jpeg.tobytes()))
+    mgr.state['DB_conn'].commit()
+    for smile_id, crop, when in mgr.state['DB_conn'].execute("SELECT id, crop, capture_time FROM smiles"):
+        for size in (32, 48):
+            assert crop_server.load("smile", smile_id, crop, size, crop_server.etag(crop, when, size)) is not None
+    thumbs = tmp_path / "thumbs" / "smile"
+    assert sorted(os.listdir(thumbs)) == ["1", "2"] and len(os.listdir(thumbs / "1")) == 2
+    thumb_bytes = sum(f.stat().st_size for f in (thumbs / "1").iterdir())
+    _pass(retention)
+    assert os.listdir(thumbs) == ["2"]
+    assert retention.stats()['reclaimed_bytes'] == len(jpeg) + thumb_bytes
+    mgr.cleanup_resources()
+
+
+def test_over_budget_the_oldest_crops_go_first_and_rows_stay(tmp_path, monkeypatch):
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store, RETENTION_DISK_BUDGET_MB=2600 / (1024 * 1024))
+    start = datetime.datetime(2026, 3, 31, 10, 0)
+    for i in range(8): # 8 x 500 B, budget 2600 B
+        ts = start + datetime.timedelta(seconds=i)
+        _smile(mgr, 1, ts, store.put("smile", 1, ts.timestamp(), bytes([i]) * 500))
+    mgr.state['DB_conn'].commit()
+    _pass(retention)
+    crops = mgr.state['DB_conn'].execute("SELECT crop FROM smiles ORDER BY capture_time").fetchall()
+    # evicted a slice (3) at a time, the 3 oldest were enough
+    assert [crop is None for (crop,) in crops] == [True] * 3 + [False] * 5
+    assert store.usage() == 2500 and retention.stats()['usage_bytes'] == 2500
+    assert retention.stats()['reclaimed_bytes'] == 1500
+    mgr.cleanup_resources()
+
+
+def test_segments_are_dropped_oldest_first_and_compacted(tmp_path, monkeypatch):
+    store = SegmentStore(str(tmp_path / "segments"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store, RETENTION_DISK_BUDGET_MB=550 / (1024 * 1024))
+    for day, hour in ((1, 9), (29, 9), (29, 10)): # one expired hour, two within the age
+        ts = datetime.datetime(2026, 3, day, hour, 0)
+        for i in range(4):
+            _smile(mgr, 1, ts, store.put("smile", 1, ts.timestamp() + i, b"z" * 79)) # 100 B records
+    mgr.state['DB_conn'].commit()
+    store.close()
+    for name in store.segments():
+        os.utime(tmp_path / "segments" / name, (NOW - 600, NOW - 600))
+    _pass(retention)
+    # 3 x 400 B over a 550 B budget: the expired hour's segment went first, then the oldest hour still in use
+    assert store.segments() == ["20260329_10_0.seg"]
+    conn = mgr.state['DB_conn']
+    rows = conn.execute("SELECT capture_time, crop IS NOT NULL FROM smiles ORDER BY id").fetchall()
+    assert [kept for _, kept in rows] == [False] * 4 + [True] * 4
+    stats = retention.stats()
+    assert stats['segments_dropped'] == 2 and stats['segments_compacted'] == 0 and stats['reclaimed_bytes'] == 800
+    retention = RetentionService(retention.parent, slice_rows=3, pause_s=0, grace_s=60)
+    retention.parent.controls['RETENTION_DISK_BUDGET_MB'] = 0
+    conn.execute("DELETE FROM smiles WHERE id > (SELECT MIN(id) FROM smiles WHERE crop IS NOT NULL)")
+    conn.commit()
+    os.utime(tmp_path / "segments" / "20260329_10_0.seg", (NOW - 600, NOW - 600))
+    _pass(retention)
+    # 1 of 4 records still live: rewritten into its own segment
+    assert store.segments() == ["20260329_10_0.c0.seg"]
+    assert retention.stats()['segments_compacted'] == 1 and retention.stats()['reclaimed_bytes'] == 300
+    (crop,) = conn.execute("SELECT crop FROM smiles WHERE crop IS NOT NULL").fetchone()
+    assert store.read(crop) == b"z" * 79
+    mgr.cleanup_resources()
+
+
+def test_crops_from_before_the_crop_column_are_adopted(tmp_path, monkeypatch):
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store, RETENTION_MAX_AGE_DAYS=0)
+    saved = datetime.datetime(2026, 3, 30, 8, 0)
+    for i in range(3): # the old worker: file stamped, written, row logged a few ms later
+        ts = saved + datetime.timedelta(seconds=i)
+        store.put("smile", 4, ts.timestamp(), b"old")
+        if i != 1:
+            _smile(mgr, 4, ts + datetime.timedelta(milliseconds=5))
+    store.put("face", 4, saved.timestamp(), b"face")
+    mgr.state['DB_conn'].commit()
+    _pass(retention)
+    crops = [crop for (crop,) in mgr.state['DB_conn'].execute("SELECT crop FROM smiles ORDER BY id")]
+    assert crops == [store.path_for("smile", 4, saved.timestamp()),
+                     store.path_for("smile", 4, (saved + datetime.timedelta(seconds=2)).timestamp())]
+    assert retention.stats()['adopted'] == 2 and retention.stats()['unmatched'] == 1
+    assert os.path.exists(tmp_path / "server" / "data" / "images" / ".retention_adopted")
+    mgr.cleanup_resources()
+
+
+@pytest.mark.asyncio
+async def test_service_loop_stops_on_close(tmp_path, monkeypatch):
+    store = DirectoryStore(str(tmp_path / "server" / "data" / "images"))
+    mgr, retention = _setup(tmp_path, monkeypatch, store)
+    retention.start()
+    for _ in range(100):
+        if retention.state['passes']:
+            break
+        await asyncio.sleep(0.01)
+    await retention.close()
+    assert retention.state['passes'] == 1 and retention.task is None and retention.conn is None
+    mgr.cleanup_resources()
@@ -0,0 +1,97 @@
+import os
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Flow_tracker import landmark_error_px
+from Server.Inference_backend import create_backend
+from Server.Roi_inference import RoiInference, crop_for_model, landmarks_to_frame, roi_around_boxes
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "Samples", "Faces", "Sam1.jpeg")
+
+
+def test_roi_geometry():
+    assert roi_around_boxes([], 0.3, 640, 480) is None
+    # grown to a square around both boxes, clipped at the frame edge
+    assert roi_around_boxes([(100, 100, 200, 200), (300, 150, 400, 250)], 0.0, 640, 480) == (100, 25, 400, 325)
+    assert roi_around_boxes([(0, 0, 100, 100)], 0.5, 640, 480) == (0, 0, 150, 150)
+
+    image = np.full((480, 640, 3), 255, dtype=np.uint8)
+    canvas, extent = crop_for_model(image, (100, 25, 400, 325), 256)
+    assert canvas.shape == (256, 256, 3) and extent == 300
+    # every crop lands on the same canvas size, off-square crops are padded
+    canvas, extent = crop_for_model(image, (0, 0, 100, 50), 256)
+    assert canvas.shape == (256, 256, 3) and extent == 100
+    assert canvas[:128].all() and not canvas[128:].any()
+
+    crop_points = np.array([[[0.0, 0.0, 0.1], [1.0, 1.0, 0.0], [0.5, 0.5, 0.0]]], dtype=np.float32)
+    frame_points = landmarks_to_frame(crop_points, (100, 25, 400, 325), 300, 640, 480)
+    np.testing.assert_allclose(frame_points[0, :, :2] * (640, 480), [[100, 25], [400, 325], [250, 175]], atol=1e-3)
+    np.testing.assert_allclose(frame_points[0, 0, 2], 0.1 * 300 / 640, rtol=1e-5)
+
+
+def test_plan_falls_back_to_full_frame():
+    controls = {"ROI_INFERENCE": True, "ROI_FULL_FRAME_EVERY": 3}
+    roi = RoiInference(SimpleNamespace(controls=controls))
+    boxes = [(100, 100, 200, 200)]
+    # first frame has to look everywhere
+    assert roi.plan(boxes, 640, 480) == (None, None)
+    roi.state['force_full'] = False
+    assert roi.plan([], 640, 480) == (None, None) # nothing tracked
+    faces_roi, hands_roi = roi.plan(boxes, 640, 480)
+    assert faces_roi is not None and hands_roi is not None
+    # the hand crop covers the face crop
+    assert hands_roi[0] <= faces_roi[0] and hands_roi[2] >= faces_roi[2]
+    roi.state['since_full'] = 2
+    assert roi.plan(boxes, 640, 480) == (None, None) # periodic full frame
+    controls['ROI_INFERENCE'] = False
+    roi.state['since_full'] = 0
+    assert roi.plan(boxes, 640, 480) == (None, None)
+
+
+def test_faces_far_apart_get_the_full_frame():
+    roi = RoiInference(SimpleNamespace(controls={"ROI_INFERENCE": True, "ROI_SIZE": 192}))
+    roi.state['force_full'] = False
+    # two people at opposite edges: the shared square would be ~the whole frame, each face ~25 px on the canvas
+    apart = [(20, 300, 120, 400), (1160, 300, 1260, 400)]
+    assert roi.plan(apart, 1280, 720) == (None, None)
+    assert roi.stats()['spread_out'] == 1
+    # a face alone still gets its crop (~120 px on the canvas)
+    faces_roi, hands_roi = roi.plan([apart[0]], 1280, 720)
+    assert faces_roi is not None and hands_roi is not None
+    # side by side they land at ~60 px, a shared crop only with a lower floor
+    side_by_side = [(500, 300, 600, 400), (610, 300, 710, 400)]
+    assert roi.plan(side_by_side, 1280, 720) == (None, None)
+    roi.parent.controls['ROI_MIN_FACE_PX'] = 48
+    assert roi.plan(side_by_side, 1280, 720)[0] is not None
+    assert roi.stats()['spread_out'] == 2
+
+
+@pytest.mark.asyncio
+async def test_roi_landmarks_match_full_frame():
+    canvas = np.full((720, 1280, 3), 90, dtype=np.uint8)
+    canvas[200:500, 450:750] = cv2.imread(SAMPLE)
+    rgb = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB)
+    full, cropped = create_backend("inprocess"), create_backend("inprocess")
+    roi = RoiInference(SimpleNamespace(controls={"ROI_INFERENCE": True}))
+    try:
+        # the first (detector) pass differs from the tracked steady state, compare against the latter
+        for _ in range(4):
+            _, reference = full.infer_sync(None, rgb)
+        _, faces = await roi.infer(cropped, rgb, [])
+        assert roi.state['full_frames'] == 1
+        points = faces[0, :, :2] * (1280, 720)
+        boxes = [tuple(int(v) for v in (*points.min(axis=0), *points.max(axis=0)))]
+        for _ in range(3):
+            _, faces = await roi.infer(cropped, rgb, boxes)
+        assert roi.state['roi_frames'] == 3 and roi.state['force_full'] is False
+        assert faces.shape == reference.shape
+        assert landmark_error_px(faces, reference, 1280, 720) < 3.0
+        assert roi.stats()['pixel_ratio'] < 0.5
+        assert roi.crop_backend is not cropped # crops don't go through the tracking graph
+    finally:
+        full.close()
+        cropped.close()
+        roi.close()
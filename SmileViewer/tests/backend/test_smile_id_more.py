@@ -77,3 +77,30 @@ def test_process_faces_occlusion_sets_status_occluded():
     assert sid.state["persistent_faces"][1]["smile_status"] in {"Detecting...", "Not Smiling", "Occluded", "Tilted", "Smiling"}
 
 
+
+
+def test_coasting_faces_are_not_scored_or_captured():
+    captures = []
+    parent = SimpleNamespace(CaptureService=SimpleNamespace(
+        notify=lambda kind, face_id, face_data: captures.append(kind) or True))
+    sid = SmileIDer(parent=parent)
+    sid.controls = {"FRAME_HISTORY_LEN": 5, "MAR_NEUTRAL_THRESHOLD": 0.005, "CLEAR_TIME": 1.0,
+                    "MIN_VISIBILITY_FRAMES": 1, "SMILE_PAD": 5, "FAR_TILT_TOLERANCE": 0.9, "SMILE_THRESH": 0.35}
+    sid.state = {"w": 100, "h": 100, "persistent_faces": {}, "hands_in_frame": []}
+    face = {
+        "landmarks": [SimpleNamespace(x=0.5, y=0.5) for _ in range(478)], # full face mesh
+        "face_bbox": (10, 10, 40, 40),
+        "mar_history": [],
+        "smile_history": [],
+        "baseline_far": 1.1,
+        "smile_status": "Smiling",
+        "last_seen": __import__('time').time(),
+        "visibility_count": 2,
+        "missed_frames": 1, # no matching detection this frame
+    }
+    sid.state["persistent_faces"][1] = face
+    sid.score_faces()
+    assert captures == [] and face['mar_history'] == [] and 'scored_at' not in face
+    face['missed_frames'] = 0 # detected again
+    sid.score_faces()
+    assert captures == ["face", "smile"] and len(face['mar_history']) == 1
@@ -22,3 +22,17 @@ def test_calculate_mar_basic_ratio():
     assert abs(mar - 0.5) < 1e-6
 
 
+
+
+def test_scoring_accepts_landmark_arrays():
+    import numpy as np
+    from Server.Smile_ID import as_landmark_array
+    landmarks = [SimpleNamespace(x=0.0, y=0.0) for _ in range(292)]
+    landmarks[61] = SimpleNamespace(x=0.0, y=0.0)
+    landmarks[291] = SimpleNamespace(x=2.0, y=0.0)
+    landmarks[13] = SimpleNamespace(x=1.0, y=1.0)
+    landmarks[14] = SimpleNamespace(x=1.0, y=0.0)
+    arr = as_landmark_array(landmarks)
+    assert arr.dtype == np.float32 and arr.shape == (292, 3) and arr.flags['C_CONTIGUOUS']
+    assert as_landmark_array(arr) is arr
+    assert SmileIDer.calculate_mar(arr) == SmileIDer.calculate_mar(landmarks)
@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from types import SimpleNamespace
+
+from Server.DB_manager import DBmanager
+from Server.Smile_queries import SmileQueries
+
+T0 = datetime.datetime(2026, 3, 1, 12, 0)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    (tmp_path / 'server' / 'data' / 'images').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    mgr = DBmanager()
+    # face 1: a smile every 20 s for 30 min, face 2: three smiles in the second hour
+    rows = [(1, (T0 + datetime.timedelta(seconds=20 * i)).isoformat()) for i in range(90)]
+    rows += [(2, (T0 + datetime.timedelta(hours=1, minutes=m)).isoformat()) for m in (0, 5, 10)]
+    for face_id, ts in rows: # straight to the writer to pick the capture times
+        mgr.Writer.log(("smile", face_id, ts, 0.25, None))
+    mgr.Writer.log(("crop", 2, "2026-03-01T12:59:00", 0.0, "images/2/face.jpg"))
+    assert mgr.flush()
+    app = FastAPI()
+    queries = SmileQueries(SimpleNamespace(DB_manager=mgr))
+    queries.register(app)
+    yield TestClient(app)
+    queries.close()
+    mgr.cleanup_resources()
+
+
+def test_counts_per_face_pages_by_face_id(client):
+    page = client.get("/smiles/faces", params={"limit": 1}).json()
+    assert page['faces'][0]['face_id'] == 1 and page['faces'][0]['smiles'] == 90
+    assert page['faces'][0]['first'] == T0.isoformat() and page['faces'][0]['smiling_s'] == 22.5
+    page = client.get("/smiles/faces", params={"after": page['next'], "limit": 1}).json()
+    assert page['faces'][0] == {"face_id": 2, "smiles": 3, "first": "2026-03-01T12:59:00", "last": "2026-03-01T13:10:00",
+                                "smiling_s": 0.75, "crop_path": "images/2/face.jpg"}
+    assert client.get("/smiles/faces", params={"after": 2}).json() == {"faces": [], "next": None}
+    assert client.get("/smiles/faces/2").json()['smiles'] == 3
+    assert client.get("/smiles/faces/3").status_code == 404
+
+
+def test_time_range_keyset_pages_cover_every_row_once(client):
+    params = {"start": "2026-03-01T12:10:00", "end": "2026-03-01T13:05:00", "limit": 7}
+    seen = []
+    while True:
+        page = client.get("/smiles", params=params).json()
+        seen += page['smiles']
+        if page['next'] is None:
+            break
+        params.update(page['next'])
+    # face 1 from 12:10 to its last smile at 12:29:40 (60 rows) + face 2 at 13:00
+    assert len(seen) == 61 and len({row[0] for row in seen}) == 61
+    assert [row[2] for row in seen] == sorted(row[2] for row in seen)
+    only_face_2 = client.get("/smiles", params={"face_id": 2}).json()['smiles']
+    assert [row[1] for row in only_face_2] == [2, 2, 2]
+
+
+def test_histograms(client):
+    minutes = client.get("/smiles/histogram", params={"bucket": "minute", "start": "2026-03-01T12:00:30",
+                                                      "end": "2026-03-01T12:03:00"}).json()
+    # first bucket starts at 12:00 but only counts from 12:00:30 (just the 12:00:40 smile)
+    assert minutes['counts'] == [["2026-03-01T12:00:00", 1], ["2026-03-01T12:01:00", 3], ["2026-03-01T12:02:00", 3]]
+    hours = client.get("/smiles/histogram", params={"bucket": "hour", "end": "2026-03-01T14:00:00",
+                                                    "face_id": 2}).json()
+    assert len(hours['counts']) == 24 and hours['counts'][-1] == ["2026-03-01T13:00:00", 3]
+    assert client.get("/smiles/histogram", params={"bucket": "week"}).status_code == 400
+    assert client.get("/smiles", params={"start": "yesterday"}).status_code == 400
+
+
+def test_times_with_an_offset_are_read_as_local_time(client):
+    def utc(naive):
+        return datetime.datetime.fromisoformat(naive).astimezone(datetime.timezone.utc).isoformat()
+    start, end = "2026-03-01T12:00:30", "2026-03-01T12:03:00"
+    local = client.get("/smiles/histogram", params={"bucket": "minute", "start": start, "end": end}).json()
+    aware = client.get("/smiles/histogram", params={"bucket": "minute", "start": utc(start), "end": utc(end)})
+    assert aware.status_code == 200 and aware.json() == local
+    zulu = utc(start).replace("+00:00", "Z")
+    assert client.get("/smiles", params={"start": zulu, "end": utc(end)}).json()['smiles'] == \
+        client.get("/smiles", params={"start": start, "end": end}).json()['smiles']
+
+
+def test_hour_histogram_adds_rolled_up_smiles(client):
+    import sqlite3
+    conn = sqlite3.connect("server/data/smile_metadata.db")
+    # retention folded older smiles of face 2 into hour counts
+    conn.executemany("INSERT INTO smile_rollups (face_id, hour, smiles) VALUES (?, ?, ?)",
+                     [(2, "2026-03-01T10:00:00", 40), (2, "2026-03-01T13:00:00", 2), (1, "2026-03-01T13:00:00", 5)])
+    conn.commit()
+    conn.close()
+    hours = client.get("/smiles/histogram", params={"bucket": "hour", "start": "2026-03-01T10:30:00",
+                                                    "end": "2026-03-01T14:00:00", "face_id": 2}).json()
+    assert hours['counts'] == [["2026-03-01T10:00:00", 40], ["2026-03-01T11:00:00", 0],
+                               ["2026-03-01T12:00:00", 0], ["2026-03-01T13:00:00", 5]]
+    everyone = client.get("/smiles/histogram", params={"bucket": "hour", "start": "2026-03-01T13:00:00",
+                                                       "end": "2026-03-01T14:00:00"}).json()
+    assert everyone['counts'] == [["2026-03-01T13:00:00", 10]]
+
+
+def test_queries_walk_the_indexes(client):
+    import sqlite3
+    conn = sqlite3.connect("server/data/smile_metadata.db")
+    plans = {
+        "range": "SELECT id FROM smiles WHERE (capture_time, id) > ('a', 1) AND capture_time < 'b' ORDER BY capture_time, id",
+        # the histogram: one statement, an index range COUNT per bucket
+        "histogram": "SELECT b.key, (SELECT COUNT(*) FROM smiles WHERE capture_time >= json_extract(b.value, '$[0]')"
+                     " AND capture_time < json_extract(b.value, '$[1]') AND face_id = 1) FROM json_each('[]') AS b",
+    }
+    for name, sql in plans.items():
+        plan = " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        assert "USING" in plan and "INDEX" in plan and "TEMP B-TREE" not in plan, (name, plan)
+    conn.close()
@@ -0,0 +1,84 @@
+import asyncio
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+import pytest
+
+from Server.Video_encoder import DEFAULT_PROFILE, VideoEncoder, parse_profile
+from Server.WS_multi_socket import MultiSocketManager
+
+
+class FakeVideoSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+def _parent():
+    parent = SimpleNamespace(state={"Video_Connections": {}, "Video_Profiles": {}, "Video_Last_Sent": {},
+                                    "Video_Senders": {}, "video_mailbox_depth": 1, "video_evict_after_s": 5.0})
+    parent.VideoEncoder = VideoEncoder(parent)
+    return parent
+
+
+def test_parse_profile_defaults_and_limits():
+    assert parse_profile({}) == DEFAULT_PROFILE
+    assert parse_profile({"scale": "0.5", "quality": "60", "max_fps": "10"}) == (0.5, 60, 10)
+    assert parse_profile({"scale": 5, "quality": 1, "max_fps": 1000}) == (1.0, 10, 60)
+    # junk keeps the current value
+    assert parse_profile({"scale": "big", "quality": None}, default=(0.5, 60, 10)) == (0.5, 60, 10)
+
+
+def test_one_encode_per_distinct_profile():
+    parent = _parent()
+    encoder = parent.VideoEncoder
+    frame = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    try:
+        for i, profile in enumerate([DEFAULT_PROFILE, DEFAULT_PROFILE, (0.5, 50, 0), (0.5, 50, 0), (0.5, 50, 0)]):
+            parent.state['Video_Connections'][f"client_{i}"] = FakeVideoSocket()
+            encoder.add_client(f"client_{i}", profile)
+        encoded, due = encoder.encode_for_due(frame, now=100.0)
+        assert len(due) == 5
+        assert set(encoded) == {DEFAULT_PROFILE, (0.5, 50, 0)}
+        assert encoder.state['encodes'] == 2
+        small = cv2.imdecode(np.frombuffer(encoded[(0.5, 50, 0)], np.uint8), cv2.IMREAD_COLOR)
+        assert small.shape == (60, 80, 3)
+        assert encoder.stats()['viewers_per_profile'] == {"1.0x80x0": 2, "0.5x50x0": 3}
+    finally:
+        encoder.close()
+
+
+@pytest.mark.asyncio
+async def test_max_fps_and_shared_bytes():
+    parent = _parent()
+    encoder = parent.VideoEncoder
+    manager = MultiSocketManager(parent)
+    desktop, phone = FakeVideoSocket(), FakeVideoSocket()
+    manager.add_video_client("desktop", desktop, DEFAULT_PROFILE)
+    manager.add_video_client("phone", phone, (0.25, 40, 5))
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    try:
+        now = 100.0
+        for _ in range(6): # 30 fps worth of frames over 0.2 s
+            encoded, due = encoder.encode_for_due(frame, now)
+            manager.broadcast_video_profiles(encoded, due, now)
+            await asyncio.sleep(0) # let the sender tasks drain their mailboxes
+            now += 1 / 30
+        assert len(desktop.sent) == 6
+        assert len(phone.sent) == 1 # 5 fps cap
+        assert len(phone.sent[0]) < len(desktop.sent[0])
+        # disconnect drops the profile and the sender too
+        manager.remove_video_client("phone")
+        assert "phone" not in parent.state['Video_Profiles'] and "phone" not in parent.state['Video_Senders']
+    finally:
+        encoder.close()
+
+
+def test_video_client_ids_never_repeat():
+    manager = MultiSocketManager(_parent())
+    # many viewers connecting in the same millisecond each get their own sender and profile
+    ids = [manager.new_video_client_id() for _ in range(200)]
+    assert len(set(ids)) == 200
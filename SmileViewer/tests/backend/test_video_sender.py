@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from Server.Video_sender import VideoSender
+
+
+class SlowVideoSocket:
+    def __init__(self, delay):
+        self.delay = delay
+        self.sent = []
+        self.closed = None
+
+    async def send_bytes(self, data):
+        await asyncio.sleep(self.delay)
+        self.sent.append(data)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = (code, reason)
+
+
+@pytest.mark.asyncio
+async def test_slow_client_gets_latest_frame_and_counts_drops():
+    socket = SlowVideoSocket(delay=0.05)
+    sender = VideoSender("slow", socket, depth=1, evict_after_s=10.0)
+    sender.start()
+    try:
+        sender.offer(b"0")
+        await asyncio.sleep(0) # frame 0 is now in flight
+        for i in range(1, 6):
+            sender.offer(str(i).encode()) # never waits on the socket
+        await asyncio.sleep(0.15)
+        # frame 0 went out, 1..4 were replaced before the socket was free, 5 is the newest
+        assert socket.sent == [b"0", b"5"]
+        stats = sender.stats()
+        assert stats['dropped'] == 4 and stats['sent'] == 2 and stats['queued'] == 0
+    finally:
+        sender.stop()
+
+
+@pytest.mark.asyncio
+async def test_stuck_client_is_evicted():
+    evicted = []
+    socket = SlowVideoSocket(delay=60)
+    sender = VideoSender("stuck", socket, depth=1, evict_after_s=1.0, on_evict=evicted.append)
+    sender.start()
+    sender.offer(b"0", now=100.0)
+    await asyncio.sleep(0)
+    assert sender.offer(b"1", now=100.0) # mailbox filled
+    assert sender.offer(b"2", now=100.5) # full, saturation clock starts
+    assert sender.offer(b"3", now=101.0)
+    assert not sender.offer(b"4", now=101.6) # full for more than a second
+    await asyncio.sleep(0)
+    assert evicted == ["stuck"]
+    assert socket.closed[0] == 1008
+    assert sender.task.cancelled() or sender.task.done()
@@ -0,0 +1,66 @@
+import { applyFaceDelta, decodeFaceFrame, HEADER_BYTES, RECORD_FIELDS } from '../../FrontEnd/protocol/faceFrame'
+import { controlsUrlFor } from '../../FrontEnd/hooks/useDataSocket'
+
+// same bytes Server/Face_protocol.faces_binary would send
+function packFrame(ts, faces, perFace, removed = null) {
+  const buffer = new ArrayBuffer(HEADER_BYTES + faces.length * (RECORD_FIELDS + perFace * 2) * 2 + (removed || []).length * 4)
+  const view = new DataView(buffer)
+  view.setUint8(0, removed ? 2 : 1)
+  view.setUint8(1, 1)
+  view.setUint16(2, faces.length, true)
+  view.setUint16(4, perFace, true)
+  view.setUint16(6, (removed || []).length, true)
+  view.setFloat64(8, ts, true)
+  const records = new Int16Array(buffer, HEADER_BYTES, faces.length * RECORD_FIELDS)
+  const points = new Int16Array(buffer, HEADER_BYTES + records.byteLength)
+  faces.forEach((f, i) => {
+    records.set([f.id & 0xffff, f.id >>> 16, ...f.box, ...f.smile, f.status, 0], i * RECORD_FIELDS)
+    points.set(f.landmarks, i * perFace * 2)
+  })
+  if (removed) {
+    new Uint16Array(buffer, buffer.byteLength - removed.length * 4).set(removed.flatMap((id) => [id & 0xffff, id >>> 16]))
+  }
+  return buffer
+}
+
+describe('decodeFaceFrame', () => {
+  it('decodes records and landmark views', () => {
+    const buffer = packFrame(12.5, [
+      { id: 7, box: [100, 120, 220, 260], smile: [140, 210, 190, 230], status: 1, landmarks: [1, 2, 3, 4] },
+      { id: 70000, box: [300, 40, 380, 150], smile: [-1, -1, -1, -1], status: 0, landmarks: [5, 6, 7, 8] },
+    ], 2)
+    const { ts, faces } = decodeFaceFrame(buffer)
+    expect(ts).toBe(12.5)
+    expect(faces[0]).toMatchObject({ face_id: 7, face_bbox: [100, 120, 220, 260], smile_bbox: [140, 210, 190, 230], smile_status: 'Smiling' })
+    expect(Array.from(faces[0].landmarks)).toEqual([1, 2, 3, 4])
+    expect(faces[1]).toMatchObject({ face_id: 70000, smile_bbox: [-1, -1, -1, -1], smile_status: 'Detecting...' })
+    expect(decodeFaceFrame(buffer, 1).faces).toHaveLength(1)
+  })
+
+  it('applies delta frames to the keyframe list', () => {
+    const key = decodeFaceFrame(packFrame(1, [
+      { id: 1, box: [0, 0, 10, 10], smile: [-1, -1, -1, -1], status: 2, landmarks: [] },
+      { id: 70000, box: [20, 0, 30, 10], smile: [-1, -1, -1, -1], status: 2, landmarks: [] },
+    ], 0))
+    expect(key.delta).toBe(false)
+    const delta = decodeFaceFrame(packFrame(2, [
+      { id: 1, box: [5, 0, 15, 10], smile: [6, 6, 9, 9], status: 1, landmarks: [] },
+      { id: 3, box: [40, 0, 50, 10], smile: [-1, -1, -1, -1], status: 0, landmarks: [] },
+    ], 0, [70000]))
+    expect(delta.delta).toBe(true)
+    expect(delta.removed).toEqual([70000])
+    const faces = applyFaceDelta(key.faces, delta.faces, delta.removed)
+    expect(faces.map((f) => f.face_id)).toEqual([1, 3])
+    expect(faces[0]).toMatchObject({ face_bbox: [5, 0, 15, 10], smile_status: 'Smiling' })
+  })
+
+  it('ignores what is not a face frame', () => {
+    expect(decodeFaceFrame(new ArrayBuffer(4))).toBeNull()
+    expect(decodeFaceFrame('{"t":"f"}')).toBeNull()
+  })
+
+  it('asks for binary in the controls url', () => {
+    expect(controlsUrlFor('ws://localhost:8000/controls')).toBe('ws://localhost:8000/controls')
+    expect(controlsUrlFor('ws://localhost:8000/controls', 'binary')).toBe('ws://localhost:8000/controls?format=binary')
+  })
+})
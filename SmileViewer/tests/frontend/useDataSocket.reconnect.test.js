@@ -34,3 +34,35 @@ describe('useDataSocket reconnect/backoff', () => {
 })
 
 
+
+describe('useDataSocket topics', () => {
+  it('subscribes on open and keeps topic messages', async () => {
+    const originalWS = global.WebSocket
+    const sent = []
+    class TopicWS {
+      static OPEN = 1
+      constructor(url) {
+        this.url = url
+        this.readyState = 0
+        setTimeout(() => {
+          this.readyState = TopicWS.OPEN
+          this.onopen && this.onopen()
+          this.onmessage && this.onmessage({ data: JSON.stringify({ t: 's', ts: 1, e: [[4, 'Not Smiling', 'Smiling']] }) })
+          this.onmessage && this.onmessage({ data: JSON.stringify({ t: 'm', ts: 1, fps: 29.5 }) })
+        }, 0)
+      }
+      send(msg) { sent.push(JSON.parse(msg)) }
+      close() { this.onclose && this.onclose() }
+    }
+    global.WebSocket = TopicWS
+
+    const { result } = renderHook(() => useDataSocket('ws://localhost:8000/controls', 'json', { smiles: 0, metrics: 1 }))
+    await waitFor(() => {
+      expect(result.current.topicsRef.current.smiles).toEqual([[4, 'Not Smiling', 'Smiling']])
+      expect(result.current.topicsRef.current.metrics.fps).toBe(29.5)
+    }, { timeout: 1500 })
+    expect(sent).toContainEqual({ type: 'subscribe', topics: { smiles: 0, metrics: 1 } })
+
+    global.WebSocket = originalWS
+  })
+})
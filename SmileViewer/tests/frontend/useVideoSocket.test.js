@@ -1,6 +1,6 @@
 import { renderHook } from '@testing-library/react'
 import { createRef } from 'react'
-import useVideoSocket from '../../FrontEnd/hooks/useVideoSocket'
+import useVideoSocket, { videoUrlFor } from '../../FrontEnd/hooks/useVideoSocket'
 
 describe('useVideoSocket', () => {
   it('returns video connection state and ws ref', () => {
@@ -9,6 +9,12 @@ describe('useVideoSocket', () => {
     expect(result.current).toHaveProperty('videoWs')
     expect(result.current).toHaveProperty('videoConnected')
   })
-})
-
 
+  it('puts the stream profile in the video url', () => {
+    expect(videoUrlFor('ws://localhost:8000/controls')).toBe('ws://localhost:8000/video')
+    expect(videoUrlFor('ws://localhost:8000/controls', { scale: 0.5, quality: 60, max_fps: 10 }))
+      .toBe('ws://localhost:8000/video?scale=0.5&quality=60&max_fps=10')
+    expect(videoUrlFor('ws://localhost:8000/controls', { quality: 40 }))
+      .toBe('ws://localhost:8000/video?quality=40')
+  })
+})